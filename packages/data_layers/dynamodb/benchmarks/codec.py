@@ -0,0 +1,76 @@
+"""Compare the data layer codec with boto3's TypeSerializer/TypeDeserializer.
+
+Run with `uv run python benchmarks/codec.py [steps]`.
+"""
+
+import sys
+import timeit
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from chainlit_dynamodb.codec import deserialize_item, serialize_item
+
+
+def make_step(i: int) -> dict:
+    return {
+        "PK": "THREAD#4f0c3b2a-6a3e-4b8c-9e55-0c2f5f3a1d7e",
+        "SK": f"STEP#{i}",
+        "id": str(i),
+        "threadId": "4f0c3b2a-6a3e-4b8c-9e55-0c2f5f3a1d7e",
+        "parentId": None,
+        "name": "assistant",
+        "type": "assistant_message",
+        "streaming": False,
+        "isError": False,
+        "input": "",
+        "output": "Lorem ipsum dolor sit amet. " * 20,
+        "createdAt": "2025-01-01T00:00:00.000000Z",
+        "start": "2025-01-01T00:00:00.000000Z",
+        "end": "2025-01-01T00:00:01.000000Z",
+        "metadata": {"model": "model", "usage": {"input": 512, "output": 128}},
+        "tags": ["a", "b"],
+        "generation": {
+            "messages": [{"role": "user", "content": "Hello"}] * 5,
+            "settings": {"max_tokens": 1024, "stream": True},
+        },
+        "feedback": {"value": 1, "comment": None},
+        "indent": 0,
+    }
+
+
+def main(steps: int):
+    items = [make_step(i) for i in range(steps)]
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+
+    def boto3_serialize():
+        return [{k: serializer.serialize(v) for k, v in item.items()} for item in items]
+
+    def codec_serialize():
+        return [serialize_item(item) for item in items]
+
+    serialized = codec_serialize()
+
+    def boto3_deserialize():
+        return [
+            {k: deserializer.deserialize(v) for k, v in item.items()}
+            for item in serialized
+        ]
+
+    def codec_deserialize():
+        return [deserialize_item(item) for item in serialized]
+
+    print(f"{steps} steps, best of 5 runs")
+    for name, boto3_fn, codec_fn in (
+        ("serialize", boto3_serialize, codec_serialize),
+        ("deserialize", boto3_deserialize, codec_deserialize),
+    ):
+        boto3_time = min(timeit.repeat(boto3_fn, number=1, repeat=5))
+        codec_time = min(timeit.repeat(codec_fn, number=1, repeat=5))
+        print(
+            f"{name:<12} boto3 {boto3_time * 1000:8.2f}ms  codec {codec_time * 1000:8.2f}ms"
+            f"  x{boto3_time / codec_time:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -1,3 +1,10 @@
 from .data_layer import DynamoDBDataLayer
+from .metrics import BaseMetricsSink, InMemoryMetricsSink
+from .rate_limiting import AdaptiveRateLimiter
 
-__all__ = ["DynamoDBDataLayer"]
+__all__ = [
+    "AdaptiveRateLimiter",
+    "BaseMetricsSink",
+    "DynamoDBDataLayer",
+    "InMemoryMetricsSink",
+]
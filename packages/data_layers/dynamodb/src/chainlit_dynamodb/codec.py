@@ -0,0 +1,106 @@
+from typing import Any, Dict
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+# Attributes of the thread, step, element and user items which are always
+# strings, read without looking at anything else
+STRING_ATTRIBUTES = frozenset(
+    {
+        # Keys
+        "PK",
+        "SK",
+        "UserThreadPK",
+        "UserThreadSK",
+        # ThreadDict
+        "id",
+        "createdAt",
+        "name",
+        "userId",
+        "userIdentifier",
+        # StepDict
+        "type",
+        "threadId",
+        "parentId",
+        "start",
+        "end",
+        "language",
+        # ElementDict
+        "chainlitKey",
+        "url",
+        "objectKey",
+        "display",
+        "size",
+        "mime",
+        "forId",
+        # User
+        "identifier",
+    }
+)
+
+_type_serializer = TypeSerializer()
+_type_deserializer = TypeDeserializer()
+
+
+def serialize(value: Any) -> Dict[str, Any]:
+    """Serialize a value to a DynamoDB attribute value.
+
+    Same as boto3's TypeSerializer for the JSON like values the data layer
+    writes, which it handles first. Anything else, e.g. floats, sets and bytes,
+    goes through TypeSerializer.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return {"S": value}
+    if value_type is bool:
+        return {"BOOL": value}
+    if value is None:
+        return {"NULL": True}
+    if value_type is int:
+        return {"N": str(value)}
+    if value_type is dict:
+        return {"M": {k: serialize(v) for k, v in value.items()}}
+    if value_type is list:
+        return {"L": [serialize(v) for v in value]}
+    return _type_serializer.serialize(value)
+
+
+def deserialize(value: Dict[str, Any]) -> Any:
+    """Deserialize a DynamoDB attribute value to native Python types.
+
+    Unlike boto3's TypeDeserializer, numbers are read as int or float instead
+    of Decimal. Binary and set values still go through TypeDeserializer.
+    """
+    ((tag, data),) = value.items()
+    if tag == "S":
+        return data
+    if tag == "M":
+        return {k: deserialize(v) for k, v in data.items()}
+    if tag == "L":
+        return [deserialize(v) for v in data]
+    if tag == "N":
+        return _number(data)
+    if tag == "BOOL":
+        return data
+    if tag == "NULL":
+        return None
+    return _type_deserializer.deserialize(value)
+
+
+def _number(data: str) -> int | float:
+    try:
+        return int(data)
+    except ValueError:
+        return float(data)
+
+
+def serialize_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: serialize(value) for key, value in item.items()}
+
+
+def deserialize_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: value["S"]
+        if key in STRING_ATTRIBUTES and "S" in value
+        else deserialize(value)
+        for key, value in item.items()
+    }
@@ -0,0 +1,60 @@
+import json
+import zlib
+from typing import Any, Literal
+
+Codec = Literal["zlib", "zstd"]
+
+# Step attributes which may be compressed, they hold most of the step's size
+COMPRESSED_STEP_ATTRIBUTES = ("input", "output", "generation")
+
+# First byte of a stored Binary attribute, telling how to read the rest
+ZLIB_HEADER = b"\x01"
+ZSTD_HEADER = b"\x02"
+# The rest is the storage provider object key of the compressed value
+SPILLED_HEADER = b"\x00"
+
+
+def check_codec(codec: str):
+    if codec not in ("zlib", "zstd"):
+        raise ValueError(f"Unsupported compression {codec}, expected zlib or zstd")
+    if codec == "zstd":
+        _zstandard()
+
+
+def _zstandard():
+    try:
+        import zstandard  # type: ignore
+    except ImportError as e:
+        raise ValueError(
+            "zstd compression requires the zstandard package, install it with `pip install zstandard`"
+        ) from e
+    return zstandard
+
+
+def compress_value(value: Any, codec: Codec = "zlib") -> bytes:
+    """Compress a JSON serializable value, prefixed with the header of its codec."""
+    data = json.dumps(value, default=str).encode()
+    if codec == "zstd":
+        return ZSTD_HEADER + _zstandard().ZstdCompressor().compress(data)
+    return ZLIB_HEADER + zlib.compress(data)
+
+
+def decompress_value(data: bytes) -> Any:
+    """Read back a value from `compress_value`."""
+    header, payload = data[:1], data[1:]
+    if header == ZLIB_HEADER:
+        return json.loads(zlib.decompress(payload))
+    if header == ZSTD_HEADER:
+        return json.loads(_zstandard().ZstdDecompressor().decompress(payload))
+    raise ValueError(f"Unknown compression header {header!r}")
+
+
+def spilled_reference(object_key: str) -> bytes:
+    return SPILLED_HEADER + object_key.encode()
+
+
+def spilled_object_key(data: bytes) -> str | None:
+    """Object key of a spilled value, None if `data` holds the value itself."""
+    if data[:1] != SPILLED_HEADER:
+        return None
+    return data[1:].decode()
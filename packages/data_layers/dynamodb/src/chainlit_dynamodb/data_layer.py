@@ -1,16 +1,24 @@
 import asyncio
+import contextvars
+import functools
 import json
 import logging
+import math
 import os
 import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
 from datetime import datetime
-from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 import aiofiles
 import aiohttp
 import boto3  # type: ignore
-from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from boto3.dynamodb.types import Binary
+from botocore import xform_name
+from botocore.exceptions import ClientError
 from chainlit.context import context
 from chainlit.data.base import BaseDataLayer
 from chainlit.data.storage_clients.base import BaseStorageClient
@@ -28,6 +36,25 @@ from chainlit.types import (
 )
 from chainlit.user import PersistedUser, User
 
+from .codec import deserialize_item, serialize, serialize_item
+from .compression import (
+    COMPRESSED_STEP_ATTRIBUTES,
+    Codec,
+    check_codec,
+    compress_value,
+    decompress_value,
+    spilled_object_key,
+    spilled_reference,
+)
+from .instrumentation import (
+    background,
+    background_work,
+    current_operation,
+    instrumented,
+)
+from .metrics import BaseMetricsSink
+from .rate_limiting import AdaptiveRateLimiter
+
 if TYPE_CHECKING:
     from chainlit.element import Element
     from types_boto3_dynamodb import DynamoDBClient
@@ -36,6 +63,29 @@ if TYPE_CHECKING:
 _logger = logger.getChild("DynamoDB")
 _logger.setLevel(logging.WARNING)
 
+# Attributes of a UserThread index item making up a query ExclusiveStartKey
+USER_THREAD_INDEX_KEYS = ("PK", "SK", "UserThreadPK", "UserThreadSK")
+USER_THREAD_FEEDBACK_INDEX_KEYS = ("PK", "SK", "UserThreadPK", "UserThreadFeedbackSK")
+
+# Operations consuming read capacity, the others consume write capacity
+READ_OPERATIONS = ("get_item", "batch_get_item", "query", "scan")
+# Error codes of requests rejected for exceeding the throughput
+THROTTLING_ERRORS = (
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+)
+
+# Threads whose attributes written by this process are remembered, to skip
+# writing them again
+THREAD_CACHE_SIZE = 10000
+# Thread attributes set once, when the thread is given an owner
+THREAD_OWNER_ATTRIBUTES = ("id", "userId", "userIdentifier", "UserThreadPK")
+
+# DynamoDB BatchWriteItem accepts up to 25 requests
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = 10
+
 
 class DynamoDBDataLayer(BaseDataLayer):
     def __init__(
@@ -44,6 +94,20 @@ class DynamoDBDataLayer(BaseDataLayer):
         client: Optional["DynamoDBClient"] = None,
         storage_provider: BaseStorageClient | None = None,
         user_thread_limit: int = 10,
+        max_workers: int | None = None,
+        list_threads_read_budget: int = 100,
+        batch_write_concurrency: int = 4,
+        step_buffer_interval: float | None = None,
+        compression_threshold: int | None = None,
+        compression: Codec = "zlib",
+        spill_threshold: int = 100_000,
+        feedback_index: bool = False,
+        metrics_sink: BaseMetricsSink | None = None,
+        rate_limiter: AdaptiveRateLimiter | None = None,
+        ttl: int | None = None,
+        ttl_attribute: str = "expiresAt",
+        ttl_granularity: int = 86400,
+        ttl_max_age: int | None = None,
     ):
         if client:
             self.client = client
@@ -51,28 +115,411 @@ class DynamoDBDataLayer(BaseDataLayer):
             region_name = os.environ.get("AWS_REGION", "us-east-1")
             self.client = boto3.client("dynamodb", region_name=region_name)  # type: ignore
 
+        # boto3 is blocking, run its calls in threads. More threads than pooled
+        # HTTP connections would only wait for a connection.
+        if max_workers is None:
+            max_pool_connections = getattr(
+                getattr(getattr(self.client, "meta", None), "config", None),
+                "max_pool_connections",
+                None,
+            )
+            max_workers = (
+                max_pool_connections if isinstance(max_pool_connections, int) else 10
+            )
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="chainlit-dynamodb"
+        )
+
         self.table_name = table_name
         self.storage_provider = storage_provider
         self.user_thread_limit = user_thread_limit
+        # Max thread index items read per list_threads call
+        self.list_threads_read_budget = list_threads_read_budget
+        # Concurrent BatchWriteItem requests per operation
+        self.batch_write_concurrency = batch_write_concurrency
+        # Write-behind buffer of the latest state of steps, keyed by (PK, SK)
+        self.step_buffer_interval = step_buffer_interval
+        self._step_buffer: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        # Buffered steps not written yet, put as a whole. The others are merged
+        # into the stored item, which may hold attributes set since, e.g. feedback.
+        self._new_steps: set[Tuple[str, str]] = set()
+        # Steps being written, set once done. Flushes of a step wait for the
+        # previous one, so that an older state can't land last.
+        self._flushing: Dict[Tuple[str, str], asyncio.Event] = {}
+        self._step_flusher: asyncio.Task | None = None
+        self.step_buffer_stats: Dict[str, float] = {
+            "buffered": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "flushed": 0,
+            "consumed_wcu": 0.0,
+        }
+
+        # Step attributes larger than compression_threshold bytes are compressed,
+        # and moved to the storage provider if still larger than spill_threshold
+        check_codec(compression)
+        self.compression_threshold = compression_threshold
+        self.compression = compression
+        self.spill_threshold = spill_threshold
+        # Maintain and query the UserThreadFeedback index
+        self.feedback_index = feedback_index
+        # Consumed capacity is only requested when there is a sink for it
+        self.metrics_sink = metrics_sink
+        self.rate_limiter = rate_limiter
+        # Threads expire ttl seconds after their last activity, rounded up to
+        # ttl_granularity so that it rarely changes. Their steps and elements
+        # are never refreshed, they expire ttl_max_age seconds after being written.
+        if ttl is not None and ttl_max_age is not None and ttl_max_age < ttl:
+            raise ValueError("Expected ttl_max_age >= ttl")
+        self.ttl = ttl
+        self.ttl_attribute = ttl_attribute
+        self.ttl_granularity = ttl_granularity
+        self.ttl_max_age = (
+            ttl_max_age if ttl_max_age is not None or ttl is None else 4 * ttl
+        )
+        # Last attributes written on thread items, by thread id
+        self._threads: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+
+        # botocore retries throttled requests itself, up to 10 times for
+        # DynamoDB: watch every response rather than the final error only
+        self._loop: asyncio.AbstractEventLoop | None = None
+        if metrics_sink is not None or rate_limiter is not None:
+            self.client.meta.events.register(
+                "needs-retry.dynamodb", self._on_retry_check
+            )
+
+    async def _call(self, operation: str, **kwargs) -> Dict[str, Any]:
+        """Run a DynamoDB client operation off the event loop."""
+        method = getattr(self.client, operation)
+        if self.metrics_sink is not None:
+            kwargs["ReturnConsumedCapacity"] = "INDEXES"
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(background=background_work.get())
+
+        self._loop = asyncio.get_running_loop()
+        # In the caller's context, for the botocore hooks
+        response = await self._loop.run_in_executor(
+            self._executor,
+            functools.partial(contextvars.copy_context().run, method, **kwargs),
+        )
+
+        if self.metrics_sink is not None and "ConsumedCapacity" in response:
+            self._record_consumed_capacity(operation, response["ConsumedCapacity"])
+        return response
+
+    def _on_retry_check(self, response=None, operation=None, **kwargs):
+        """botocore needs-retry hook, run in the client's thread for every response."""
+        if response is None or self._loop is None:
+            return None
+        if response[1].get("Error", {}).get("Code") in THROTTLING_ERRORS:
+            self._loop.call_soon_threadsafe(
+                self._on_throttle,
+                xform_name(operation.name) if operation is not None else "unknown",
+                current_operation.get(),
+            )
+        # Leave the retry decision to botocore
+        return None
+
+    def _on_throttle(self, operation: str, method: str | None = None):
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_throttle()
+        if self.metrics_sink is not None:
+            self.metrics_sink.increment(
+                "throttled_requests_total",
+                1,
+                {
+                    "method": method or current_operation.get() or "unknown",
+                    "operation": operation,
+                },
+            )
 
-        self._type_deserializer = TypeDeserializer()
-        self._type_serializer = TypeSerializer()
+    def _record_consumed_capacity(
+        self, operation: str, consumed_capacity: Dict[str, Any] | List[Dict[str, Any]]
+    ):
+        if self.metrics_sink is None:
+            return
+        name = (
+            "consumed_read_capacity_units"
+            if operation in READ_OPERATIONS
+            else "consumed_write_capacity_units"
+        )
+        method = current_operation.get() or "unknown"
+        # Batch operations return a list, with an entry per table
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        for capacity in consumed_capacity:
+            units = {"table": capacity.get("Table", {}).get("CapacityUnits", 0)}
+            for index_type in ("GlobalSecondaryIndexes", "LocalSecondaryIndexes"):
+                for index, index_capacity in capacity.get(index_type, {}).items():
+                    units[index] = index_capacity.get("CapacityUnits", 0)
+            if "Table" not in capacity:
+                # Without the per index breakdown
+                units["table"] = capacity.get("CapacityUnits", 0)
+            for index, value in units.items():
+                if value:
+                    self.metrics_sink.increment(
+                        name, value, {"method": method, "index": index}
+                    )
+
+    async def close(self):
+        if self._step_flusher is not None:
+            self._step_flusher.cancel()
+            try:
+                await self._step_flusher
+            except asyncio.CancelledError:
+                pass
+            self._step_flusher = None
+        with background():
+            await self.flush_steps()
+        self._executor.shutdown(wait=False)
+
+    ###### Step write buffer ######
+    async def _buffer_step(self, item: Dict[str, Any]):
+        key = (item["PK"], item["SK"])
+        if key in self._step_buffer:
+            self.step_buffer_stats["coalesced"] += 1
+        self._step_buffer[key] = item
+        self.step_buffer_stats["buffered"] += 1
+
+        if item.get("end"):
+            # Finished steps are not updated anymore, no need to wait
+            await self.flush_steps([key])
+        elif self._step_flusher is None or self._step_flusher.done():
+            self._step_flusher = asyncio.get_running_loop().create_task(
+                self._flush_steps_periodically()
+            )
+
+    async def _flush_steps_periodically(self):
+        while True:
+            await asyncio.sleep(self.step_buffer_interval or 0)
+            try:
+                with background():
+                    await self.flush_steps()
+            except Exception as e:
+                _logger.warning("DynamoDB: failed to flush buffered steps: %s", e)
+
+    @instrumented
+    async def flush_steps(self, keys: List[Tuple[str, str]] | None = None):
+        """Write buffered steps (all of them by default).
+
+        New steps are put with BatchWriteItem, updates of stored steps are
+        merged into them with UpdateItem.
+        """
+        keys = list(self._step_buffer) if keys is None else keys
+        while in_flight := {
+            self._flushing[key] for key in keys if key in self._flushing
+        }:
+            await asyncio.gather(*(flushed.wait() for flushed in in_flight))
+        items = {
+            key: self._step_buffer.pop(key) for key in keys if key in self._step_buffer
+        }
+        if not items:
+            return
+        new_steps = self._new_steps.intersection(items)
+        self._new_steps -= new_steps
+        flushed = asyncio.Event()
+        self._flushing.update(dict.fromkeys(items, flushed))
+
+        try:
+            packed = dict(
+                zip(
+                    items,
+                    await asyncio.gather(
+                        *(self._pack_step(item) for item in items.values())
+                    ),
+                )
+            )
+            consumed = await self._batch_write(
+                [
+                    {"PutRequest": {"Item": self._serialize_item(item)}}
+                    for key, item in packed.items()
+                    if key in new_steps
+                ],
+                ReturnConsumedCapacity="TOTAL",
+            )
+            semaphore = asyncio.Semaphore(self.batch_write_concurrency)
+
+            async def update_step_item(item: Dict[str, Any]) -> float:
+                async with semaphore:
+                    response = await self._update_item(
+                        key={"PK": item["PK"], "SK": item["SK"]},
+                        updates={
+                            attr: value
+                            for attr, value in item.items()
+                            if attr not in ("PK", "SK")
+                        },
+                        ReturnConsumedCapacity="TOTAL",
+                    )
+                return response.get("ConsumedCapacity", {}).get("CapacityUnits", 0)
+
+            consumed += sum(
+                await asyncio.gather(
+                    *(
+                        update_step_item(item)
+                        for key, item in packed.items()
+                        if key not in new_steps
+                    )
+                )
+            )
+        except Exception:
+            # Put them back, under the updates buffered in the meantime
+            for key, item in items.items():
+                self._step_buffer[key] = {**item, **self._step_buffer.get(key, {})}
+            self._new_steps |= new_steps
+            raise
+        finally:
+            for key in items:
+                del self._flushing[key]
+            flushed.set()
+
+        self.step_buffer_stats["flushes"] += 1
+        self.step_buffer_stats["flushed"] += len(items)
+        self.step_buffer_stats["consumed_wcu"] += consumed
 
     def _get_current_timestamp(self) -> str:
         return datetime.now().isoformat() + "Z"
 
+    ###### TTL ######
+    def _expires_at(self, ttl: int | None = None) -> int | None:
+        ttl = ttl if ttl is not None else self.ttl
+        if ttl is None:
+            return None
+        return (
+            math.ceil((time.time() + ttl) / self.ttl_granularity) * self.ttl_granularity
+        )
+
+    def _set_ttl(self, item: Dict[str, Any]):
+        """Set the expiry of a step or element item."""
+        expires_at = self._expires_at(self.ttl_max_age)
+        if expires_at is not None:
+            item[self.ttl_attribute] = expires_at
+
+    def _with_ttl(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        if self.ttl is None:
+            return item
+        item = dict(item)
+        self._set_ttl(item)
+        return item
+
+    def _is_expired(self, item: Dict[str, Any]) -> bool:
+        # DynamoDB deletes expired items within a few days, skip them meanwhile
+        expires_at = item.get(self.ttl_attribute)
+        return (
+            self.ttl is not None
+            and isinstance(expires_at, (int, float))
+            and expires_at < time.time()
+        )
+
+    def _remember_thread(self, thread_id: str, attributes: Dict[str, Any]):
+        self._threads.setdefault(thread_id, {}).update(attributes)
+        self._threads.move_to_end(thread_id)
+        if len(self._threads) > THREAD_CACHE_SIZE:
+            self._threads.popitem(last=False)
+
+    async def _refresh_thread_ttl(self, thread_id: str):
+        """Push back the expiry of an active thread, once per ttl_granularity."""
+        expires_at = self._expires_at()
+        if (
+            expires_at is None
+            or self._threads.get(thread_id, {}).get(self.ttl_attribute) == expires_at
+        ):
+            return
+
+        try:
+            await self._call(
+                "update_item",
+                TableName=self.table_name,
+                Key={"PK": {"S": f"THREAD#{thread_id}"}, "SK": {"S": "THREAD"}},
+                UpdateExpression="SET #ttl = :ttl",
+                # Don't create a partial thread item
+                ConditionExpression="attribute_exists(#pk)",
+                ExpressionAttributeNames={"#pk": "PK", "#ttl": self.ttl_attribute},
+                ExpressionAttributeValues={":ttl": {"N": str(expires_at)}},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return
+        self._remember_thread(thread_id, {self.ttl_attribute: expires_at})
+
     def _serialize_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
-        return {
-            key: self._type_serializer.serialize(value) for key, value in item.items()
-        }
+        return serialize_item(item)
 
     def _deserialize_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
-        return {
-            key: self._type_deserializer.deserialize(value)
-            for key, value in item.items()
-        }
+        return deserialize_item(item)
+
+    async def _pack_step(self, step: Dict[str, Any]) -> Dict[str, Any]:
+        """Compress the large attributes of a step about to be written."""
+        if self.compression_threshold is None:
+            return step
+
+        packed = dict(step)
+        spilled_keys: List[str] = []
+        for attribute in COMPRESSED_STEP_ATTRIBUTES:
+            value = step.get(attribute)
+            if value is None or value == "":
+                continue
+            size = (
+                len(value.encode())
+                if isinstance(value, str)
+                else len(json.dumps(value, default=str).encode())
+            )
+            if size < self.compression_threshold:
+                continue
 
-    def _update_item(self, key: Dict[str, Any], updates: Dict[str, Any]):
+            data = compress_value(value, self.compression)
+            if len(data) > self.spill_threshold and self.storage_provider is not None:
+                object_key = (
+                    f"threads/{step['threadId']}/steps/{step['id']}/{attribute}"
+                )
+                await self.storage_provider.upload_file(
+                    object_key=object_key, data=data, overwrite=True
+                )
+                data = spilled_reference(object_key)
+                spilled_keys.append(object_key)
+            packed[attribute] = data
+
+        if spilled_keys:
+            # Deleted with the thread
+            packed["spilledKeys"] = spilled_keys
+        return packed
+
+    async def _unpack_step(self, step: Dict[str, Any]) -> Dict[str, Any]:
+        """Read back the attributes compressed by `_pack_step`."""
+        step.pop("spilledKeys", None)
+        for attribute in COMPRESSED_STEP_ATTRIBUTES:
+            value = step.get(attribute)
+            if not isinstance(value, Binary):
+                continue
+            data = value.value
+            object_key = spilled_object_key(data)
+            if object_key is not None:
+                data = await self._read_spilled(object_key)
+            step[attribute] = decompress_value(data)
+        return step
+
+    async def _read_spilled(self, object_key: str) -> bytes:
+        if self.storage_provider is None:
+            raise ValueError(
+                f"No storage_provider is configured to read spilled step attribute {object_key}"
+            )
+        url = await self.storage_provider.get_read_url(object_key)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise ValueError(
+                        f"Failed to read spilled step attribute {object_key} status {response.status}"
+                    )
+                return await response.read()
+
+    async def _update_item(
+        self,
+        key: Dict[str, Any],
+        updates: Dict[str, Any],
+        initial: Dict[str, Any] | None = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Set the non empty `updates`, and `initial` attributes the item doesn't have yet."""
         update_expr: List[str] = []
         expression_attribute_names = {}
         expression_attribute_values = {}
@@ -86,22 +533,32 @@ class DynamoDBDataLayer(BaseDataLayer):
             expression_attribute_names[k] = attr
             expression_attribute_values[v] = value
 
-        self.client.update_item(
+        for index, (attr, value) in enumerate((initial or {}).items(), len(updates)):
+            k, v = f"#{index}", f":{index}"
+            update_expr.append(f"{k} = if_not_exists({k}, {v})")
+            expression_attribute_names[k] = attr
+            expression_attribute_values[v] = value
+
+        return await self._call(
+            "update_item",
             TableName=self.table_name,
             Key=self._serialize_item(key),
             UpdateExpression="SET " + ", ".join(update_expr),
             ExpressionAttributeNames=expression_attribute_names,
             ExpressionAttributeValues=self._serialize_item(expression_attribute_values),
+            **kwargs,
         )
 
     @property
     def context(self):
         return context
 
+    @instrumented
     async def get_user(self, identifier: str) -> Optional["PersistedUser"]:
         _logger.info("DynamoDB: get_user identifier=%s", identifier)
 
-        response = self.client.get_item(
+        response = await self._call(
+            "get_item",
             TableName=self.table_name,
             Key={
                 "PK": {"S": f"USER#{identifier}"},
@@ -121,6 +578,7 @@ class DynamoDBDataLayer(BaseDataLayer):
             metadata=user["metadata"],
         )
 
+    @instrumented
     async def create_user(self, user: "User") -> Optional["PersistedUser"]:
         _logger.info("DynamoDB: create_user user.identifier=%s", user.identifier)
 
@@ -136,7 +594,8 @@ class DynamoDBDataLayer(BaseDataLayer):
             "createdAt": ts,
         }
 
-        self.client.put_item(
+        await self._call(
+            "put_item",
             TableName=self.table_name,
             Item=self._serialize_item(item),
         )
@@ -148,6 +607,7 @@ class DynamoDBDataLayer(BaseDataLayer):
             metadata=metadata,
         )
 
+    @instrumented
     async def delete_feedback(self, feedback_id: str) -> bool:
         _logger.info("DynamoDB: delete_feedback feedback_id=%s", feedback_id)
 
@@ -156,7 +616,10 @@ class DynamoDBDataLayer(BaseDataLayer):
         thread_id = thread_id.strip("THREAD#")
         step_id = step_id.strip("STEP#")
 
-        self.client.update_item(
+        # The feedback is set on the step item, which has to exist first
+        await self.flush_steps([(f"THREAD#{thread_id}", f"STEP#{step_id}")])
+        response = await self._call(
+            "update_item",
             TableName=self.table_name,
             Key={
                 "PK": {"S": f"THREAD#{thread_id}"},
@@ -164,10 +627,16 @@ class DynamoDBDataLayer(BaseDataLayer):
             },
             UpdateExpression="REMOVE #feedback",
             ExpressionAttributeNames={"#feedback": "feedback"},
+            **({"ReturnValues": "UPDATED_OLD"} if self.feedback_index else {}),
         )
+        if self.feedback_index:
+            previous_value = self._feedback_value(response)
+            if previous_value is not None:
+                await self._unindex_thread_feedback(thread_id, step_id, previous_value)
 
         return True
 
+    @instrumented
     async def upsert_feedback(self, feedback: Feedback) -> str:
         _logger.info(
             "DynamoDB: upsert_feedback thread=%s step=%s value=%s",
@@ -182,9 +651,13 @@ class DynamoDBDataLayer(BaseDataLayer):
             )
 
         feedback.id = f"THREAD#{feedback.threadId}::STEP#{feedback.forId}"
-        serialized_feedback = self._type_serializer.serialize(asdict(feedback))
+        serialized_feedback = serialize(asdict(feedback))
 
-        self.client.update_item(
+        await self.flush_steps(
+            [(f"THREAD#{feedback.threadId}", f"STEP#{feedback.forId}")]
+        )
+        response = await self._call(
+            "update_item",
             TableName=self.table_name,
             Key={
                 "PK": {"S": f"THREAD#{feedback.threadId}"},
@@ -193,11 +666,138 @@ class DynamoDBDataLayer(BaseDataLayer):
             UpdateExpression="SET #feedback = :feedback",
             ExpressionAttributeNames={"#feedback": "feedback"},
             ExpressionAttributeValues={":feedback": serialized_feedback},
+            **({"ReturnValues": "UPDATED_OLD"} if self.feedback_index else {}),
         )
+        if self.feedback_index:
+            previous_value = self._feedback_value(response)
+            if previous_value is not None and previous_value != feedback.value:
+                await self._unindex_thread_feedback(
+                    feedback.threadId, feedback.forId, previous_value
+                )
+            await self._index_thread_feedback(
+                feedback.threadId, feedback.forId, feedback.value
+            )
 
         return feedback.id
 
+    ###### Feedback index ######
+    def _feedback_value(self, response: Dict[str, Any]) -> int | None:
+        """Value of the feedback a step had before an update returning UPDATED_OLD."""
+        old_attributes = self._deserialize_item(response.get("Attributes", {}))
+        feedback = old_attributes.get("feedback")
+        return feedback.get("value") if isinstance(feedback, dict) else None
+
+    async def _index_thread_feedback(self, thread_id: str, step_id: str, value: int):
+        """List the thread under `value` in the UserThreadFeedback index.
+
+        The thread has an index item per feedback value given to its steps,
+        holding the ids of those steps, so that it is listed under every value.
+        """
+        response = await self._call(
+            "get_item",
+            TableName=self.table_name,
+            Key={"PK": {"S": f"THREAD#{thread_id}"}, "SK": {"S": "THREAD"}},
+            ProjectionExpression="#owner, #name, #createdAt",
+            ExpressionAttributeNames={
+                "#owner": "UserThreadPK",
+                "#name": "name",
+                "#createdAt": "UserThreadSK",
+            },
+        )
+        thread = response.get("Item", {})
+        if "UserThreadPK" not in thread:
+            _logger.debug("DynamoDB: no thread=%s to index feedback of", thread_id)
+            return
+
+        attributes = {
+            **self._deserialize_item(thread),
+            "id": thread_id,
+            "UserThreadFeedbackSK": f"FEEDBACK#{value}#TS#{self._get_current_timestamp()}",
+        }
+        self._set_ttl(attributes)
+        names = {f"#{i}": attr for i, attr in enumerate(attributes)}
+        values = {
+            f":{i}": serialize(value) for i, value in enumerate(attributes.values())
+        }
+        await self._call(
+            "update_item",
+            TableName=self.table_name,
+            Key={
+                "PK": {"S": f"THREAD#{thread_id}"},
+                "SK": {"S": f"FEEDBACK#{value}"},
+            },
+            UpdateExpression="SET "
+            + ", ".join(f"{name} = :{name[1:]}" for name in names)
+            + " ADD #steps :step",
+            ExpressionAttributeNames={**names, "#steps": "FeedbackSteps"},
+            ExpressionAttributeValues={**values, ":step": {"SS": [step_id]}},
+        )
+
+    async def _unindex_thread_feedback(self, thread_id: str, step_id: str, value: int):
+        """Stop listing the thread under `value` once none of its steps has it."""
+        key = {"PK": {"S": f"THREAD#{thread_id}"}, "SK": {"S": f"FEEDBACK#{value}"}}
+        try:
+            response = await self._call(
+                "update_item",
+                TableName=self.table_name,
+                Key=key,
+                UpdateExpression="DELETE #steps :step",
+                # Don't create a partial index item
+                ConditionExpression="attribute_exists(#pk)",
+                ExpressionAttributeNames={"#pk": "PK", "#steps": "FeedbackSteps"},
+                ExpressionAttributeValues={":step": {"SS": [step_id]}},
+                ReturnValues="ALL_NEW",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return
+        if "FeedbackSteps" in response.get("Attributes", {}):
+            # Other steps still have that value
+            return
+
+        try:
+            await self._call(
+                "delete_item",
+                TableName=self.table_name,
+                Key=key,
+                # Unless given again in the meantime
+                ConditionExpression="attribute_not_exists(#steps)",
+                ExpressionAttributeNames={"#steps": "FeedbackSteps"},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    async def _update_thread_feedback_index(
+        self, thread_id: str, attributes: Dict[str, Any]
+    ):
+        """Copy the listed attributes of a thread to its feedback index items."""
+        response = await self._call(
+            "query",
+            TableName=self.table_name,
+            KeyConditionExpression="#pk = :pk AND begins_with(#sk, :feedback)",
+            ProjectionExpression="#pk, #sk",
+            ExpressionAttributeNames={"#pk": "PK", "#sk": "SK"},
+            ExpressionAttributeValues={
+                ":pk": {"S": f"THREAD#{thread_id}"},
+                ":feedback": {"S": "FEEDBACK#"},
+            },
+        )
+        for key in response["Items"]:
+            try:
+                await self._update_item(
+                    key=self._deserialize_item(key),
+                    updates=attributes,
+                    # Unless removed in the meantime
+                    ConditionExpression="attribute_exists(PK)",
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+
     @queue_until_user_message()
+    @instrumented
     async def create_element(self, element: "Element"):
         _logger.info(
             "DynamoDB: create_element thread=%s step=%s type=%s",
@@ -270,12 +870,15 @@ class DynamoDBDataLayer(BaseDataLayer):
                 "objectKey": uploaded_file.get("object_key"),
             }
         )
+        self._set_ttl(element_dict)
 
-        self.client.put_item(
+        await self._call(
+            "put_item",
             TableName=self.table_name,
             Item=self._serialize_item(element_dict),
         )
 
+    @instrumented
     async def get_element(
         self, thread_id: str, element_id: str
     ) -> Optional["ElementDict"]:
@@ -283,7 +886,8 @@ class DynamoDBDataLayer(BaseDataLayer):
             "DynamoDB: get_element thread=%s element=%s", thread_id, element_id
         )
 
-        response = self.client.get_item(
+        response = await self._call(
+            "get_item",
             TableName=self.table_name,
             Key={
                 "PK": {"S": f"THREAD#{thread_id}"},
@@ -297,13 +901,15 @@ class DynamoDBDataLayer(BaseDataLayer):
         return self._deserialize_item(response["Item"])  # type: ignore
 
     @queue_until_user_message()
+    @instrumented
     async def delete_element(self, element_id: str, thread_id: str | None = None):
         thread_id = self.context.session.thread_id
         _logger.info(
             "DynamoDB: delete_element thread=%s element=%s", thread_id, element_id
         )
 
-        self.client.delete_item(
+        await self._call(
+            "delete_item",
             TableName=self.table_name,
             Key={
                 "PK": {"S": f"THREAD#{thread_id}"},
@@ -312,6 +918,7 @@ class DynamoDBDataLayer(BaseDataLayer):
         )
 
     @queue_until_user_message()
+    @instrumented
     async def create_step(self, step_dict: "StepDict"):
         _logger.info(
             "DynamoDB: create_step thread=%s step=%s",
@@ -328,13 +935,22 @@ class DynamoDBDataLayer(BaseDataLayer):
                 "SK": f"STEP#{step_dict['id']}",  # type: ignore
             }
         )
+        self._set_ttl(item)
+        await self._refresh_thread_ttl(step_dict["threadId"])  # type: ignore
+
+        if self.step_buffer_interval is not None:
+            self._new_steps.add((item["PK"], item["SK"]))
+            await self._buffer_step(item)
+            return
 
-        self.client.put_item(
+        await self._call(
+            "put_item",
             TableName=self.table_name,
-            Item=self._serialize_item(item),
+            Item=self._serialize_item(await self._pack_step(item)),
         )
 
     @queue_until_user_message()
+    @instrumented
     async def update_step(self, step_dict: "StepDict"):
         _logger.info(
             "DynamoDB: update_step thread=%s step=%s",
@@ -343,21 +959,34 @@ class DynamoDBDataLayer(BaseDataLayer):
         )
         _logger.debug("DynamoDB: update_step: %s", step_dict)
 
-        self._update_item(
+        if self.step_buffer_interval is not None:
+            key = (f"THREAD#{step_dict['threadId']}", f"STEP#{step_dict['id']}")  # type: ignore
+            # Chainlit sends whole steps, which are written as a whole
+            item = {**self._step_buffer.get(key, {}), **step_dict}
+            item.update({"PK": key[0], "SK": key[1]})
+            self._set_ttl(item)
+            await self._buffer_step(item)
+            return
+
+        await self._update_item(
             key={
                 # ignore type, dynamo needs these so we want to fail if not set
                 "PK": f"THREAD#{step_dict['threadId']}",  # type: ignore
                 "SK": f"STEP#{step_dict['id']}",  # type: ignore
             },
-            updates=step_dict,  # type: ignore
+            updates=await self._pack_step(self._with_ttl(step_dict)),  # type: ignore
         )
 
     @queue_until_user_message()
+    @instrumented
     async def delete_step(self, step_id: str):
         thread_id = self.context.session.thread_id
         _logger.info("DynamoDB: delete_feedback thread=%s step=%s", thread_id, step_id)
 
-        self.client.delete_item(
+        self._step_buffer.pop((f"THREAD#{thread_id}", f"STEP#{step_id}"), None)
+        self._new_steps.discard((f"THREAD#{thread_id}", f"STEP#{step_id}"))
+        await self._call(
+            "delete_item",
             TableName=self.table_name,
             Key={
                 "PK": {"S": f"THREAD#{thread_id}"},
@@ -365,10 +994,12 @@ class DynamoDBDataLayer(BaseDataLayer):
             },
         )
 
+    @instrumented
     async def get_thread_author(self, thread_id: str) -> str:
         _logger.info("DynamoDB: get_thread_author thread=%s", thread_id)
 
-        response = self.client.get_item(
+        response = await self._call(
+            "get_item",
             TableName=self.table_name,
             Key={
                 "PK": {"S": f"THREAD#{thread_id}"},
@@ -383,59 +1014,112 @@ class DynamoDBDataLayer(BaseDataLayer):
         item = self._deserialize_item(response["Item"])
         return item["userId"]
 
+    @instrumented
     async def delete_thread(self, thread_id: str):
         _logger.info("DynamoDB: delete_thread thread=%s", thread_id)
 
-        thread = await self.get_thread(thread_id)
-        if not thread:
+        # A thread created again with the same id must be written in full
+        self._threads.pop(thread_id, None)
+        # Buffered steps would otherwise be written back under the deleted thread
+        for key in [
+            key for key in self._step_buffer if key[0] == f"THREAD#{thread_id}"
+        ]:
+            del self._step_buffer[key]
+            self._new_steps.discard(key)
+
+        # Only the keys are needed, and the storage objects of elements and steps
+        items: List[Dict[str, Any]] = []
+        cursor: Dict[str, Any] = {}
+        while True:
+            response = await self._call(
+                "query",
+                TableName=self.table_name,
+                KeyConditionExpression="#pk = :pk",
+                ExpressionAttributeNames={"#pk": "PK"},
+                ExpressionAttributeValues={":pk": {"S": f"THREAD#{thread_id}"}},
+                ProjectionExpression="PK, SK, objectKey, spilledKeys",
+                **cursor,
+            )
+            items.extend(response["Items"])
+
+            if "LastEvaluatedKey" not in response:
+                break
+            cursor["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+        if not items:
             return
 
-        items: List[Any] = thread["steps"]
-        if thread["elements"]:
-            items.extend(thread["elements"])
-
-        delete_requests = []
-        for item in items:
-            key = self._serialize_item({"PK": item["PK"], "SK": item["SK"]})
-            req = {"DeleteRequest": {"Key": key}}
-            delete_requests.append(req)
-
-        BATCH_ITEM_SIZE = 25  # pylint: disable=invalid-name
-        for i in range(0, len(delete_requests), BATCH_ITEM_SIZE):
-            chunk = delete_requests[i : i + BATCH_ITEM_SIZE]
-            response = self.client.batch_write_item(
-                RequestItems={
-                    self.table_name: chunk,  # type: ignore
-                }
+        if self.storage_provider is not None:
+            object_keys = [
+                item["objectKey"]["S"] for item in items if "objectKey" in item
+            ]
+            object_keys += [
+                key["S"]
+                for item in items
+                for key in item.get("spilledKeys", {}).get("L", [])
+            ]
+            await asyncio.gather(
+                *(
+                    self.storage_provider.delete_file(object_key=object_key)
+                    for object_key in object_keys
+                )
             )
 
-            backoff_time = 1
-            while response.get("UnprocessedItems"):
-                backoff_time *= 2
-                # Cap the backoff time at 32 seconds & add jitter
-                delay = min(backoff_time, 32) + random.uniform(0, 1)
-                await asyncio.sleep(delay)
+        # The thread item is deleted along with its steps and elements, nobody
+        # waits for them once they are gone from the listing
+        with background():
+            await self._batch_write(
+                [
+                    {"DeleteRequest": {"Key": {"PK": item["PK"], "SK": item["SK"]}}}
+                    for item in items
+                ]
+            )
 
-                response = self.client.batch_write_item(
-                    RequestItems=response["UnprocessedItems"]
+    async def _batch_write(self, requests: List[Dict[str, Any]], **kwargs) -> float:
+        """Send write requests in concurrent batches of 25, retrying unprocessed items.
+
+        Returns the consumed write capacity, when requested through `kwargs`.
+        """
+        semaphore = asyncio.Semaphore(self.batch_write_concurrency)
+        consumed = 0.0
+
+        async def write_batch(batch: List[Dict[str, Any]]):
+            async with semaphore:
+                request_items: Dict[str, Any] = {self.table_name: batch}
+                for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+                    response = await self._call(
+                        "batch_write_item", RequestItems=request_items, **kwargs
+                    )
+                    nonlocal consumed
+                    consumed += sum(
+                        capacity.get("CapacityUnits", 0)
+                        for capacity in response.get("ConsumedCapacity", [])
+                    )
+                    request_items = response.get("UnprocessedItems") or {}
+                    if not request_items:
+                        return
+                    # Items are left unprocessed when the throughput is exceeded
+                    self._on_throttle("batch_write_item")
+                    # Exponential backoff with full jitter
+                    await asyncio.sleep(random.uniform(0, min(0.05 * 2**attempt, 5)))
+                raise ValueError(
+                    f"DynamoDB: {len(request_items[self.table_name])} items still unprocessed after {BATCH_WRITE_MAX_ATTEMPTS} attempts"
                 )
 
-        self.client.delete_item(
-            TableName=self.table_name,
-            Key={
-                "PK": {"S": f"THREAD#{thread_id}"},
-                "SK": {"S": "THREAD"},
-            },
+        await asyncio.gather(
+            *(
+                write_batch(requests[i : i + BATCH_WRITE_SIZE])
+                for i in range(0, len(requests), BATCH_WRITE_SIZE)
+            )
         )
+        return consumed
 
+    @instrumented
     async def list_threads(
         self, pagination: "Pagination", filters: "ThreadFilter"
     ) -> "PaginatedResponse[ThreadDict]":
         _logger.info("DynamoDB: list_threads filters.userId=%s", filters.userId)
 
-        if filters.feedback:
-            _logger.warning("DynamoDB: filters on feedback not supported")
-
         paginated_response: PaginatedResponse[ThreadDict] = PaginatedResponse(
             data=[],
             pageInfo=PageInfo(
@@ -447,7 +1131,6 @@ class DynamoDBDataLayer(BaseDataLayer):
             "TableName": self.table_name,
             "IndexName": "UserThread",
             "ScanIndexForward": False,
-            "Limit": self.user_thread_limit,
             "KeyConditionExpression": "#UserThreadPK = :pk",
             "ExpressionAttributeNames": {
                 "#UserThreadPK": "UserThreadPK",
@@ -457,6 +1140,25 @@ class DynamoDBDataLayer(BaseDataLayer):
             },
         }
 
+        index_keys = USER_THREAD_INDEX_KEYS
+        if filters.feedback is not None:
+            if self.feedback_index:
+                index_keys = USER_THREAD_FEEDBACK_INDEX_KEYS
+                query_args["IndexName"] = "UserThreadFeedback"
+                query_args["KeyConditionExpression"] += (
+                    " AND begins_with(#UserThreadFeedbackSK, :feedback)"
+                )
+                query_args["ExpressionAttributeNames"]["#UserThreadFeedbackSK"] = (
+                    "UserThreadFeedbackSK"
+                )
+                query_args["ExpressionAttributeValues"][":feedback"] = {
+                    "S": f"FEEDBACK#{filters.feedback}#"
+                }
+            else:
+                _logger.warning(
+                    "DynamoDB: filters on feedback require feedback_index=True"
+                )
+
         if pagination.cursor:
             query_args["ExclusiveStartKey"] = json.loads(pagination.cursor)
 
@@ -465,25 +1167,52 @@ class DynamoDBDataLayer(BaseDataLayer):
             query_args["ExpressionAttributeNames"]["#name"] = "name"
             query_args["ExpressionAttributeValues"][":search"] = {"S": filters.search}
 
-        response = self.client.query(**query_args)  # type: ignore
-
-        if "LastEvaluatedKey" in response:
-            paginated_response.pageInfo.hasNextPage = True
-            paginated_response.pageInfo.endCursor = json.dumps(
-                response["LastEvaluatedKey"]
+        # Limit applies before the filter, keep reading until the page is full
+        read_budget = self.list_threads_read_budget
+        while True:
+            response = await self._call(
+                "query",
+                **query_args,
+                Limit=min(self.user_thread_limit, read_budget),
             )
+            read_budget -= response.get("ScannedCount", len(response["Items"]))
+
+            items = response["Items"]
+            missing = pagination.first - len(paginated_response.data)
+            for item in items[:missing]:
+                paginated_response.data.append(self._thread_from_index_item(item))
+
+            if len(items) >= missing:
+                # Page full, resume right after its last thread
+                if len(items) > missing or "LastEvaluatedKey" in response:
+                    last_item = items[missing - 1]
+                    paginated_response.pageInfo.hasNextPage = True
+                    paginated_response.pageInfo.endCursor = json.dumps(
+                        {key: last_item[key] for key in index_keys}
+                    )
+                break
 
-        for item in response["Items"]:
-            deserialized_item: Dict[str, Any] = self._deserialize_item(item)
-            thread = ThreadDict(  # type: ignore
-                id=deserialized_item["PK"].strip("THREAD#"),
-                createdAt=deserialized_item["UserThreadSK"].strip("TS#"),
-                name=deserialized_item["name"],
-            )
-            paginated_response.data.append(thread)
+            if "LastEvaluatedKey" not in response:
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+            if read_budget <= 0:
+                paginated_response.pageInfo.hasNextPage = True
+                paginated_response.pageInfo.endCursor = json.dumps(
+                    response["LastEvaluatedKey"]
+                )
+                break
 
         return paginated_response
 
+    def _thread_from_index_item(self, item: Dict[str, Any]) -> "ThreadDict":
+        deserialized_item: Dict[str, Any] = self._deserialize_item(item)
+        return ThreadDict(  # type: ignore
+            id=deserialized_item["PK"].strip("THREAD#"),
+            createdAt=deserialized_item["UserThreadSK"].strip("TS#"),
+            name=deserialized_item["name"],
+        )
+
+    @instrumented
     async def get_thread(self, thread_id: str) -> "ThreadDict | None":
         _logger.info("DynamoDB: get_thread thread=%s", thread_id)
 
@@ -492,7 +1221,8 @@ class DynamoDBDataLayer(BaseDataLayer):
 
         cursor: Dict[str, Any] = {}
         while True:
-            response = self.client.query(
+            response = await self._call(
+                "query",
                 TableName=self.table_name,
                 KeyConditionExpression="#pk = :pk",
                 ExpressionAttributeNames={"#pk": "PK"},
@@ -500,8 +1230,7 @@ class DynamoDBDataLayer(BaseDataLayer):
                 **cursor,
             )
 
-            deserialized_items = map(self._deserialize_item, response["Items"])
-            thread_items.extend(deserialized_items)
+            thread_items.extend(map(self._deserialize_item, response["Items"]))
 
             if "LastEvaluatedKey" not in response:
                 break
@@ -519,12 +1248,14 @@ class DynamoDBDataLayer(BaseDataLayer):
             if item["SK"] == "THREAD":
                 thread_dict = item
 
+            elif self._is_expired(item):
+                # Older than ttl_max_age, in a conversation still going on
+                continue
+
             elif item["SK"].startswith("ELEMENT"):
                 elements.append(item)
 
             elif item["SK"].startswith("STEP"):
-                if "feedback" in item:  # Decimal is not json serializable
-                    item["feedback"]["value"] = int(item["feedback"]["value"])
                 steps.append(item)
 
         if not thread_dict:
@@ -534,6 +1265,22 @@ class DynamoDBDataLayer(BaseDataLayer):
                 )
             return None
 
+        if self._is_expired(thread_dict):
+            # The conversation expired as a whole, its items await deletion
+            return None
+
+        steps = list(await asyncio.gather(*map(self._unpack_step, steps)))
+
+        # Steps waiting in the write buffer are newer than the stored ones
+        buffered = {
+            key[1]: dict(item)
+            for key, item in self._step_buffer.items()
+            if key[0] == f"THREAD#{thread_id}"
+        }
+        if buffered:
+            steps = [step for step in steps if step["SK"] not in buffered]
+            steps.extend(buffered.values())
+
         steps.sort(key=lambda i: i["createdAt"])
         thread_dict.update(
             {
@@ -544,6 +1291,7 @@ class DynamoDBDataLayer(BaseDataLayer):
 
         return thread_dict
 
+    @instrumented
     async def update_thread(
         self,
         thread_id: str,
@@ -559,12 +1307,8 @@ class DynamoDBDataLayer(BaseDataLayer):
 
         ts = self._get_current_timestamp()
 
-        item = {
-            # GSI: UserThread
-            "UserThreadSK": f"TS#{ts}",
-            #
+        item: Dict[str, Any] = {
             "id": thread_id,
-            "createdAt": ts,
             "name": name,
             "userId": user_id,
             "userIdentifier": user_id,
@@ -576,13 +1320,40 @@ class DynamoDBDataLayer(BaseDataLayer):
             # user_id may be None on subsequent calls, don't update UserThreadPK to "USER#{None}"
             item["UserThreadPK"] = f"USER#{user_id}"
 
-        self._update_item(
+        expires_at = self._expires_at()
+        if expires_at is not None:
+            item[self.ttl_attribute] = expires_at
+
+        # Attributes which don't change once set, and the coarse expiry, are
+        # only sent if this process did not write them yet. The others may
+        # have been changed by other processes.
+        written = self._threads.get(thread_id, {})
+        cached = (*THREAD_OWNER_ATTRIBUTES, self.ttl_attribute)
+        changes = {
+            attr: value
+            for attr, value in item.items()
+            if value and (attr not in cached or written.get(attr) != value)
+        }
+
+        await self._update_item(
             key={
                 "PK": f"THREAD#{thread_id}",
                 "SK": "THREAD",
             },
-            updates=item,
+            updates=changes,
+            # Rewriting the UserThread sort key would move the index entry
+            initial={
+                "createdAt": ts,
+                # GSI: UserThread
+                "UserThreadSK": f"TS#{ts}",
+            },
         )
+        self._remember_thread(thread_id, changes)
+        listed = {
+            attr: changes[attr] for attr in ("name", "UserThreadPK") if attr in changes
+        }
+        if self.feedback_index and listed:
+            await self._update_thread_feedback_index(thread_id, listed)
 
     async def build_debug_url(self) -> str:
         return ""
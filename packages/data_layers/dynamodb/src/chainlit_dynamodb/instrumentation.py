@@ -0,0 +1,49 @@
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Name of the outermost data layer method being executed, e.g. "list_threads"
+current_operation: ContextVar[str | None] = ContextVar(
+    "chainlit_dynamodb_operation", default=None
+)
+
+# Whether the running calls are background work nobody waits for, e.g. buffer flushes
+background_work: ContextVar[bool] = ContextVar(
+    "chainlit_dynamodb_background", default=False
+)
+
+
+def instrumented(method):
+    """Attribute the DynamoDB calls issued by the decorated method to it and time it."""
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if current_operation.get() is not None:
+            # Attribute nested calls to the outermost method
+            return await method(self, *args, **kwargs)
+
+        token = current_operation.set(method.__name__)
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            current_operation.reset(token)
+            if self.metrics_sink is not None:
+                self.metrics_sink.observe(
+                    "operation_duration_seconds",
+                    time.perf_counter() - start,
+                    {"method": method.__name__},
+                )
+
+    return wrapper
+
+
+@contextmanager
+def background():
+    """Mark the DynamoDB calls made in this block as background work."""
+    token = background_work.set(True)
+    try:
+        yield
+    finally:
+        background_work.reset(token)
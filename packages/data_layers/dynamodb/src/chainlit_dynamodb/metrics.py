@@ -0,0 +1,49 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+Labels = Dict[str, str]
+
+
+class BaseMetricsSink(ABC):
+    """Receives data layer metrics.
+
+    Metric names are unprefixed (e.g. `consumed_read_capacity_units`), adapters
+    are expected to add their own namespace.
+    """
+
+    @abstractmethod
+    def observe(self, name: str, value: float, labels: Labels):
+        """Record a sample of a distribution (histogram)."""
+
+    @abstractmethod
+    def increment(self, name: str, value: float, labels: Labels):
+        """Add `value` to a monotonic counter."""
+
+
+def _key(labels: Labels) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted(labels.items()))
+
+
+class InMemoryMetricsSink(BaseMetricsSink):
+    """Keeps every sample in memory, for tests and debugging."""
+
+    def __init__(self):
+        self.samples: Dict[str, Dict[Tuple, List[float]]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+        self.counters: Dict[str, Dict[Tuple, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+
+    def observe(self, name: str, value: float, labels: Labels):
+        self.samples[name][_key(labels)].append(value)
+
+    def increment(self, name: str, value: float, labels: Labels):
+        self.counters[name][_key(labels)] += value
+
+    def get_samples(self, name: str, **labels: str) -> List[float]:
+        return list(self.samples[name].get(_key(labels), []))
+
+    def get_counter(self, name: str, **labels: str) -> float:
+        return self.counters[name].get(_key(labels), 0)
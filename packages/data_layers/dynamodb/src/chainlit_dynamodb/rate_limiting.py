@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+
+class AdaptiveRateLimiter:
+    """Token bucket limiting the rate of DynamoDB requests, adapting to throttling.
+
+    The rate is halved (down to `min_rate`, at most once a second) whenever
+    DynamoDB throttles a request, and grows back by `increase` requests per
+    second for every second without throttling, up to `max_rate`.
+
+    Background work only takes tokens while more than `background_reserve` of
+    the bucket is left, and not at all for `background_cooldown` seconds after
+    a throttle, so that it backs off before requests someone is waiting for.
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        min_rate: float = 1.0,
+        burst: float | None = None,
+        increase: float | None = None,
+        background_reserve: float = 0.5,
+        background_cooldown: float = 5.0,
+    ):
+        if not 0 < min_rate <= max_rate:
+            raise ValueError("Expected 0 < min_rate <= max_rate")
+        if not 0 <= background_reserve < 1:
+            raise ValueError("Expected 0 <= background_reserve < 1")
+
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        # A request takes a whole token, a smaller bucket would never allow one
+        self.burst = max(1.0, burst if burst is not None else max_rate)
+        self.increase = increase if increase is not None else max_rate / 20
+        self.background_reserve = background_reserve
+        self.background_cooldown = background_cooldown
+
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._throttled_at = float("-inf")
+        self._decreased_at = float("-inf")
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if now - self._throttled_at > 1:
+            self.rate = min(self.max_rate, self.rate + self.increase * elapsed)
+        self._tokens = min(self.burst, self._tokens + self.rate * elapsed)
+
+    async def acquire(self, background: bool = False):
+        """Wait for a token, background work waiting for the bucket to be refilled more."""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+
+            floor = 0.0
+            if background:
+                floor = max(
+                    0.0, min(self.burst * self.background_reserve, self.burst - 1)
+                )
+                cooldown = self._throttled_at + self.background_cooldown - now
+                if cooldown > 0:
+                    await asyncio.sleep(cooldown)
+                    continue
+
+            if self._tokens - 1 >= floor:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((floor + 1 - self._tokens) / self.rate)
+
+    def on_throttle(self):
+        """DynamoDB rejected a request for exceeding the throughput."""
+        now = time.monotonic()
+        self._refill(now)
+        if now - self._decreased_at >= 1:
+            # Concurrent requests are throttled together, count them once
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._decreased_at = now
+        self._throttled_at = now
@@ -1,7 +1,13 @@
+import asyncio
+import json
+import threading
+import time
 from contextlib import asynccontextmanager
+from types import SimpleNamespace
 from unittest.mock import ANY, AsyncMock, MagicMock
 
 import pytest
+from boto3.dynamodb.types import TypeSerializer
 from chainlit.context import ChainlitContext, context_var
 from chainlit.element import Text
 from chainlit.session import WebsocketSession
@@ -11,7 +17,12 @@ from chainlit.types import (
     ThreadFilter,
 )
 from chainlit.user import PersistedUser, User
-from chainlit_dynamodb import DynamoDBDataLayer
+from chainlit_dynamodb import (
+    AdaptiveRateLimiter,
+    DynamoDBDataLayer,
+    InMemoryMetricsSink,
+)
+from chainlit_dynamodb.codec import deserialize_item, serialize_item
 
 
 @pytest.fixture
@@ -84,6 +95,135 @@ async def test_get_user_exists(data_layer):
     )
 
 
+async def test_client_calls_run_off_the_event_loop(data_layer):
+    threads = []
+    data_layer.client.get_item.side_effect = lambda **kwargs: (
+        threads.append(threading.current_thread()) or {}
+    )
+
+    assert await data_layer.get_user("test_user") is None
+
+    assert threads
+    assert threads[0] is not threading.current_thread()
+    assert threads[0].name.startswith("chainlit-dynamodb")
+
+
+async def test_consumed_capacity_metrics(mock_dynamodb_client):
+    metrics_sink = InMemoryMetricsSink()
+    rate_limiter = AdaptiveRateLimiter(max_rate=100)
+    data_layer = DynamoDBDataLayer(
+        table_name="test_table",
+        client=mock_dynamodb_client,
+        metrics_sink=metrics_sink,
+        rate_limiter=rate_limiter,
+    )
+    mock_dynamodb_client.query.return_value = {
+        "Items": [],
+        "ConsumedCapacity": {
+            "TableName": "test_table",
+            "CapacityUnits": 1.5,
+            "GlobalSecondaryIndexes": {"UserThread": {"CapacityUnits": 1.5}},
+        },
+    }
+
+    await data_layer.list_threads(
+        pagination=Pagination(first=5), filters=ThreadFilter(userId="user123")
+    )
+
+    assert (
+        mock_dynamodb_client.query.call_args.kwargs["ReturnConsumedCapacity"]
+        == "INDEXES"
+    )
+    assert (
+        metrics_sink.get_counter(
+            "consumed_read_capacity_units", method="list_threads", index="UserThread"
+        )
+        == 1.5
+    )
+    assert (
+        len(
+            metrics_sink.get_samples(
+                "operation_duration_seconds", method="list_threads"
+            )
+        )
+        == 1
+    )
+
+    # Throttled requests slow the limiter down, as soon as botocore retries them
+    event_name, on_retry_check = (
+        mock_dynamodb_client.meta.events.register.call_args.args
+    )
+    assert event_name == "needs-retry.dynamodb"
+
+    def throttled_then_retried(**kwargs):
+        on_retry_check(
+            response=(
+                None,
+                {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+            ),
+            operation=SimpleNamespace(name="GetItem"),
+        )
+        return {}
+
+    mock_dynamodb_client.get_item.side_effect = throttled_then_retried
+    await data_layer.get_user("test_user")
+    await asyncio.sleep(0)
+
+    assert rate_limiter.rate == 50
+    assert (
+        metrics_sink.get_counter(
+            "throttled_requests_total", method="get_user", operation="get_item"
+        )
+        == 1
+    )
+
+
+async def test_rate_limiter_below_one_request_per_second():
+    rate_limiter = AdaptiveRateLimiter(max_rate=0.5, min_rate=0.1)
+
+    await asyncio.wait_for(rate_limiter.acquire(), timeout=1)
+
+
+async def test_rate_limiter_backs_off_background_work_first():
+    rate_limiter = AdaptiveRateLimiter(max_rate=1000, burst=4, background_cooldown=60)
+    rate_limiter.on_throttle()
+
+    # Right after a throttle, only foreground requests get through
+    background = asyncio.create_task(rate_limiter.acquire(background=True))
+    await asyncio.wait_for(rate_limiter.acquire(), timeout=1)
+    await asyncio.sleep(0.01)
+    assert not background.done()
+    background.cancel()
+
+
+def test_codec():
+    step = {
+        "PK": "THREAD#thread123",
+        "SK": "STEP#step1",
+        "id": "step1",
+        "name": "tool",
+        "output": "",
+        "streaming": False,
+        "parentId": None,
+        "tags": ["a", "b"],
+        "metadata": {"nested": {"count": 2, "ratio": {1, 2}}},
+        "feedback": {"value": 1, "comment": None},
+        "indent": 0,
+    }
+
+    serialized = serialize_item(step)
+
+    # Same wire format as boto3
+    serializer = TypeSerializer()
+    assert serialized == {
+        key: serializer.serialize(value) for key, value in step.items()
+    }
+    # Numbers are read back as native ints, not Decimal
+    deserialized = deserialize_item(serialized)
+    assert deserialized == step
+    assert type(deserialized["feedback"]["value"]) is int
+
+
 async def test_create_user_new(data_layer):
     test_user = User(identifier="new_user", metadata={"key": "value"})
 
@@ -122,6 +262,118 @@ async def test_upsert_feedback_new(data_layer):
     )
 
 
+async def test_feedback_index(data_layer):
+    data_layer.feedback_index = True
+    data_layer.client.get_item.return_value = {
+        "Item": {
+            "UserThreadPK": {"S": "USER#user123"},
+            "UserThreadSK": {"S": "TS#2023-01-01T00:00:01"},
+            "name": {"S": "Thread 1"},
+        }
+    }
+
+    def update_item(**kwargs):
+        if kwargs["Key"]["SK"] == {"S": "STEP#step1"}:
+            # step1 had a thumbs-down
+            return {"Attributes": {"feedback": {"M": {"value": {"N": "0"}}}}}
+        return {}
+
+    data_layer.client.update_item.side_effect = update_item
+
+    await data_layer.upsert_feedback(
+        Feedback(forId="step2", value=0, threadId="thread1")
+    )
+    await data_layer.upsert_feedback(
+        Feedback(forId="step3", value=1, threadId="thread1")
+    )
+
+    # The thread is listed under every value given to its steps
+    index_updates = [
+        call.kwargs
+        for call in data_layer.client.update_item.call_args_list
+        if call.kwargs["Key"]["SK"]["S"].startswith("FEEDBACK#")
+    ]
+    assert [
+        (u["Key"]["SK"]["S"], u["ExpressionAttributeValues"][":step"])
+        for u in index_updates
+    ] == [
+        ("FEEDBACK#0", {"SS": ["step2"]}),
+        ("FEEDBACK#1", {"SS": ["step3"]}),
+    ]
+    attributes = {
+        name: index_updates[0]["ExpressionAttributeValues"][f":{key[1:]}"]
+        for key, name in index_updates[0]["ExpressionAttributeNames"].items()
+        if key != "#steps"
+    }
+    sort_key = attributes["UserThreadFeedbackSK"]["S"]
+    assert sort_key.startswith("FEEDBACK#0#TS#")
+    assert attributes["name"] == {"S": "Thread 1"}
+    assert attributes["UserThreadPK"] == {"S": "USER#user123"}
+    data_layer.client.delete_item.assert_not_called()
+
+    # A changed feedback moves its step to the other value, whose index item
+    # goes once no step has that value
+    data_layer.client.update_item.reset_mock()
+    await data_layer.upsert_feedback(
+        Feedback(forId="step1", value=1, threadId="thread1")
+    )
+    assert [
+        (call.kwargs["Key"]["SK"]["S"], call.kwargs["UpdateExpression"].split()[0])
+        for call in data_layer.client.update_item.call_args_list
+    ] == [("STEP#step1", "SET"), ("FEEDBACK#0", "DELETE"), ("FEEDBACK#1", "SET")]
+    data_layer.client.delete_item.assert_called_once_with(
+        TableName="test_table",
+        Key={"PK": {"S": "THREAD#thread1"}, "SK": {"S": "FEEDBACK#0"}},
+        ConditionExpression="attribute_not_exists(#steps)",
+        ExpressionAttributeNames={"#steps": "FeedbackSteps"},
+    )
+
+    item = thread_index_item("thread1", "Thread 1")
+    item["SK"] = {"S": "FEEDBACK#0"}
+    item["UserThreadFeedbackSK"] = {"S": sort_key}
+    data_layer.client.query.return_value = {"Items": [item, item], "ScannedCount": 2}
+    result = await data_layer.list_threads(
+        pagination=Pagination(first=1),
+        filters=ThreadFilter(userId="user123", feedback=0),
+    )
+
+    assert [thread["id"] for thread in result.data] == ["thread1"]
+    data_layer.client.query.assert_called_once_with(
+        TableName="test_table",
+        IndexName="UserThreadFeedback",
+        ScanIndexForward=False,
+        Limit=5,
+        KeyConditionExpression="#UserThreadPK = :pk AND begins_with(#UserThreadFeedbackSK, :feedback)",
+        ExpressionAttributeNames={
+            "#UserThreadPK": "UserThreadPK",
+            "#UserThreadFeedbackSK": "UserThreadFeedbackSK",
+        },
+        ExpressionAttributeValues={
+            ":pk": {"S": "USER#user123"},
+            ":feedback": {"S": "FEEDBACK#0#"},
+        },
+    )
+    assert json.loads(result.pageInfo.endCursor) == {
+        "PK": {"S": "THREAD#thread1"},
+        "SK": {"S": "FEEDBACK#0"},
+        "UserThreadPK": {"S": "USER#user123"},
+        "UserThreadFeedbackSK": {"S": sort_key},
+    }
+
+    # Renaming the thread renames it in the index
+    data_layer.client.query.return_value = {
+        "Items": [{"PK": {"S": "THREAD#thread1"}, "SK": {"S": "FEEDBACK#1"}}]
+    }
+    data_layer.client.update_item.reset_mock()
+    await data_layer.update_thread("thread1", name="Renamed")
+    index_update = data_layer.client.update_item.call_args.kwargs
+    assert index_update["Key"] == {
+        "PK": {"S": "THREAD#thread1"},
+        "SK": {"S": "FEEDBACK#1"},
+    }
+    assert {"S": "Renamed"} in index_update["ExpressionAttributeValues"].values()
+
+
 async def test_create_element(data_layer, mock_context):
     element = Text(
         id="elem123", content="test content", thread_id="test_thread", for_id="step123"
@@ -176,6 +428,299 @@ async def test_delete_step(data_layer, mock_context):
     )
 
 
+async def test_step_write_buffer(mock_dynamodb_client, mock_context):
+    data_layer = DynamoDBDataLayer(
+        table_name="test_table",
+        client=mock_dynamodb_client,
+        step_buffer_interval=60,
+    )
+    mock_dynamodb_client.batch_write_item.return_value = {
+        "ConsumedCapacity": [{"TableName": "test_table", "CapacityUnits": 1.0}]
+    }
+    step = {"id": "step1", "threadId": "thread123", "createdAt": "2023-01-01"}
+
+    async with mock_context():
+        await data_layer.create_step(step)
+        await data_layer.update_step({**step, "output": "Hel"})
+        await data_layer.update_step({**step, "output": "Hello"})
+
+        # Nothing is written while the step streams, but it can be read back
+        mock_dynamodb_client.put_item.assert_not_called()
+        mock_dynamodb_client.update_item.assert_not_called()
+        mock_dynamodb_client.query.return_value = {
+            "Items": [{"PK": {"S": "THREAD#thread123"}, "SK": {"S": "THREAD"}}]
+        }
+        thread = await data_layer.get_thread("thread123")
+        assert [s["output"] for s in thread["steps"]] == ["Hello"]
+
+        # The step is written once, when it ends
+        await data_layer.update_step({**step, "output": "Hello!", "end": "2023-01-02"})
+
+    mock_dynamodb_client.batch_write_item.assert_called_once_with(
+        RequestItems={
+            "test_table": [
+                {
+                    "PutRequest": {
+                        "Item": {
+                            "id": {"S": "step1"},
+                            "threadId": {"S": "thread123"},
+                            "createdAt": {"S": "2023-01-01"},
+                            "output": {"S": "Hello!"},
+                            "end": {"S": "2023-01-02"},
+                            "PK": {"S": "THREAD#thread123"},
+                            "SK": {"S": "STEP#step1"},
+                        }
+                    }
+                }
+            ]
+        },
+        ReturnConsumedCapacity="TOTAL",
+    )
+    assert data_layer.step_buffer_stats == {
+        "buffered": 4,
+        "coalesced": 3,
+        "flushes": 1,
+        "flushed": 1,
+        "consumed_wcu": 1.0,
+    }
+
+    # Steps still buffered are written on close
+    async with mock_context():
+        await data_layer.update_step({**step, "id": "step2"})
+        await data_layer.create_step({**step, "id": "step3", "threadId": "thread456"})
+    # but not the ones of deleted threads
+    mock_dynamodb_client.query.return_value = {"Items": []}
+    await data_layer.delete_thread("thread456")
+    await data_layer.close()
+    assert mock_dynamodb_client.batch_write_item.call_count == 1
+    # Updates of stored steps are merged into them
+    mock_dynamodb_client.update_item.assert_called_once_with(
+        TableName="test_table",
+        Key={"PK": {"S": "THREAD#thread123"}, "SK": {"S": "STEP#step2"}},
+        UpdateExpression=ANY,
+        ExpressionAttributeNames=ANY,
+        ExpressionAttributeValues=ANY,
+        ReturnConsumedCapacity="TOTAL",
+    )
+
+
+async def test_step_write_buffer_keeps_feedback(mock_dynamodb_client, mock_context):
+    data_layer = DynamoDBDataLayer(
+        table_name="test_table",
+        client=mock_dynamodb_client,
+        step_buffer_interval=60,
+    )
+    mock_dynamodb_client.batch_write_item.return_value = {}
+    mock_dynamodb_client.update_item.return_value = {}
+    step = {"id": "step1", "threadId": "thread123", "createdAt": "2023-01-01"}
+
+    async with mock_context():
+        await data_layer.create_step(step)
+        # The new step is put before its feedback is set
+        await data_layer.upsert_feedback(
+            Feedback(forId="step1", value=1, threadId="thread123")
+        )
+        assert mock_dynamodb_client.batch_write_item.call_count == 1
+        await data_layer.update_step({**step, "output": "Hello"})
+    await data_layer.close()
+
+    # The update is merged, not put over the item and its feedback
+    assert mock_dynamodb_client.batch_write_item.call_count == 1
+    update = mock_dynamodb_client.update_item.call_args.kwargs
+    assert update["Key"] == {
+        "PK": {"S": "THREAD#thread123"},
+        "SK": {"S": "STEP#step1"},
+    }
+    assert update["UpdateExpression"].startswith("SET ")
+    assert "feedback" not in update["ExpressionAttributeNames"].values()
+    assert "output" in update["ExpressionAttributeNames"].values()
+
+
+async def test_step_write_buffer_orders_flushes(mock_dynamodb_client, mock_context):
+    data_layer = DynamoDBDataLayer(
+        table_name="test_table",
+        client=mock_dynamodb_client,
+        step_buffer_interval=60,
+    )
+    writes = []
+
+    def batch_write_item(**kwargs):
+        time.sleep(0.05)
+        writes.append("put")
+        return {}
+
+    def update_item(**kwargs):
+        writes.append("update")
+        return {}
+
+    mock_dynamodb_client.batch_write_item.side_effect = batch_write_item
+    mock_dynamodb_client.update_item.side_effect = update_item
+    step = {"id": "step1", "threadId": "thread123", "createdAt": "2023-01-01"}
+
+    async with mock_context():
+        await data_layer.create_step(step)
+        periodic_flush = asyncio.create_task(data_layer.flush_steps())
+        await asyncio.sleep(0.01)
+        # The step ends while its previous state is being written
+        await data_layer.update_step({**step, "output": "Hello", "end": "2023-01-02"})
+        await periodic_flush
+
+    assert writes == ["put", "update"]
+    update = mock_dynamodb_client.update_item.call_args.kwargs
+    assert {"S": "Hello"} in update["ExpressionAttributeValues"].values()
+    assert data_layer._flushing == {}
+
+
+async def test_step_compression(mock_dynamodb_client, mock_context):
+    storage_provider = AsyncMock()
+    data_layer = DynamoDBDataLayer(
+        table_name="test_table",
+        client=mock_dynamodb_client,
+        storage_provider=storage_provider,
+        compression_threshold=100,
+        spill_threshold=200,
+    )
+    step = {
+        "id": "step1",
+        "threadId": "thread123",
+        "createdAt": "2023-01-01",
+        "input": "short",
+        "output": "Hello " * 1000,
+        "generation": {"messages": [{"content": str(i)} for i in range(1000)]},
+    }
+
+    async with mock_context():
+        await data_layer.create_step(step)
+
+    item = mock_dynamodb_client.put_item.call_args.kwargs["Item"]
+    assert item["input"] == {"S": "short"}
+    # Still too large once compressed, moved to the storage provider
+    object_key = "threads/thread123/steps/step1/generation"
+    storage_provider.upload_file.assert_awaited_once_with(
+        object_key=object_key, data=ANY, overwrite=True
+    )
+    assert item["generation"] == {"B": b"\x00" + object_key.encode()}
+    assert item["spilledKeys"] == {"L": [{"S": object_key}]}
+    assert len(item["output"]["B"]) < 100
+
+    mock_dynamodb_client.query.return_value = {
+        "Items": [{"PK": {"S": "THREAD#thread123"}, "SK": {"S": "THREAD"}}, item]
+    }
+    data_layer._read_spilled = AsyncMock(
+        return_value=storage_provider.upload_file.call_args.kwargs["data"]
+    )
+    thread = await data_layer.get_thread("thread123")
+
+    assert thread["steps"] == [{**step, "PK": "THREAD#thread123", "SK": "STEP#step1"}]
+    data_layer._read_spilled.assert_awaited_once_with(object_key)
+
+
+async def test_ttl(mock_dynamodb_client, mock_context):
+    data_layer = DynamoDBDataLayer(
+        table_name="test_table",
+        client=mock_dynamodb_client,
+        ttl=3600,
+        ttl_granularity=600,
+    )
+
+    async with mock_context():
+        for i in range(3):
+            await data_layer.create_step(
+                {"id": f"step{i}", "threadId": "thread123", "createdAt": "2023-01-01"}
+            )
+
+    # Steps outlive the conversation, which expires with its thread item
+    expires_at = mock_dynamodb_client.put_item.call_args.kwargs["Item"]["expiresAt"]
+    assert int(expires_at["N"]) % 600 == 0
+    assert int(expires_at["N"]) > time.time() + 4 * 3600 - 600
+    # The thread is refreshed once per granularity, not on every step, and
+    # nothing else is
+    mock_dynamodb_client.query.assert_not_called()
+    mock_dynamodb_client.update_item.assert_called_once()
+    thread_expires_at = mock_dynamodb_client.update_item.call_args.kwargs[
+        "ExpressionAttributeValues"
+    ][":ttl"]
+    assert time.time() + 3600 <= int(thread_expires_at["N"]) < time.time() + 4200
+
+    # Expired items awaiting deletion are ignored
+    step = {
+        "PK": {"S": "THREAD#thread123"},
+        "SK": {"S": "STEP#step0"},
+        "createdAt": {"S": "2023-01-01"},
+        "expiresAt": {"N": "1"},
+    }
+    thread_item = {
+        "PK": {"S": "THREAD#thread123"},
+        "SK": {"S": "THREAD"},
+        "expiresAt": thread_expires_at,
+    }
+    mock_dynamodb_client.query.return_value = {"Items": [thread_item, step]}
+    thread = await data_layer.get_thread("thread123")
+    assert thread["steps"] == []
+
+    # Along with the items of expired threads
+    thread_item["expiresAt"] = {"N": "1"}
+    step["expiresAt"] = expires_at
+    assert await data_layer.get_thread("thread123") is None
+
+    with pytest.raises(ValueError, match="ttl_max_age"):
+        DynamoDBDataLayer(
+            table_name="test_table",
+            client=mock_dynamodb_client,
+            ttl=3600,
+            ttl_max_age=60,
+        )
+
+
+async def test_delete_thread(data_layer):
+    items = [{"PK": {"S": "THREAD#thread123"}, "SK": {"S": "THREAD"}}]
+    items += [
+        {"PK": {"S": "THREAD#thread123"}, "SK": {"S": f"STEP#step{i}"}}
+        for i in range(28)
+    ]
+    items.append(
+        {
+            "PK": {"S": "THREAD#thread123"},
+            "SK": {"S": "ELEMENT#elem1"},
+            "objectKey": {"S": "user/thread123/elem1"},
+        }
+    )
+    data_layer.client.query.return_value = {"Items": items}
+    unprocessed = {"test_table": [{"DeleteRequest": {"Key": items[0]}}]}
+    data_layer.client.batch_write_item.side_effect = [
+        {"UnprocessedItems": unprocessed},
+        {},
+        {},
+    ]
+
+    await data_layer.delete_thread("thread123")
+
+    # Only keys are read, and the thread item goes with the others
+    data_layer.client.query.assert_called_once_with(
+        TableName="test_table",
+        KeyConditionExpression="#pk = :pk",
+        ExpressionAttributeNames={"#pk": "PK"},
+        ExpressionAttributeValues={":pk": {"S": "THREAD#thread123"}},
+        ProjectionExpression="PK, SK, objectKey, spilledKeys",
+    )
+    data_layer.client.delete_item.assert_not_called()
+    deleted_keys = [
+        request["DeleteRequest"]["Key"]
+        for call in data_layer.client.batch_write_item.call_args_list[:2]
+        for request in call.kwargs["RequestItems"]["test_table"]
+    ]
+    assert sorted(key["SK"]["S"] for key in deleted_keys) == sorted(
+        item["SK"]["S"] for item in items
+    )
+    # The unprocessed item is retried
+    assert data_layer.client.batch_write_item.call_args_list[2].kwargs == {
+        "RequestItems": unprocessed
+    }
+    data_layer.storage_provider.delete_file.assert_awaited_once_with(
+        object_key="user/thread123/elem1"
+    )
+
+
 async def test_get_thread_author(data_layer):
     mock_thread = {
         "PK": {"S": "THREAD#thread123"},
@@ -188,27 +733,36 @@ async def test_get_thread_author(data_layer):
     assert author == "user123"
 
 
-async def test_list_threads(data_layer):
-    mock_response = {
-        "Items": [
-            {
-                "PK": {"S": "THREAD#thread1"},
-                "UserThreadSK": {"S": "TS#2023-01-01"},
-                "name": {"S": "Thread 1"},
-            }
-        ],
-        "LastEvaluatedKey": {"key": "value"},
+def thread_index_item(thread_id: str, name: str):
+    return {
+        "PK": {"S": f"THREAD#{thread_id}"},
+        "SK": {"S": "THREAD"},
+        "UserThreadPK": {"S": "USER#user123"},
+        "UserThreadSK": {"S": f"TS#2023-01-01T00:00:0{thread_id[-1]}"},
+        "name": {"S": name},
     }
-    data_layer.client.query.return_value = mock_response
+
+
+async def test_list_threads(data_layer):
+    data_layer.client.query.side_effect = [
+        {
+            "Items": [thread_index_item("thread1", "Thread test 1")],
+            "ScannedCount": 5,
+            "LastEvaluatedKey": {"key": "value"},
+        },
+        {"Items": [thread_index_item("thread2", "Thread test 2")], "ScannedCount": 3},
+    ]
 
     result = await data_layer.list_threads(
         pagination=Pagination(first=5),
         filters=ThreadFilter(userId="user123", search="test"),
     )
 
-    assert len(result.data) == 1
-    assert result.pageInfo.hasNextPage is True
-    data_layer.client.query.assert_called_once_with(
+    # Filtered pages are read until the page is full or the index exhausted
+    assert [thread["id"] for thread in result.data] == ["thread1", "thread2"]
+    assert result.pageInfo.hasNextPage is False
+    assert data_layer.client.query.call_count == 2
+    data_layer.client.query.assert_called_with(
         TableName="test_table",
         IndexName="UserThread",
         ScanIndexForward=False,
@@ -220,9 +774,49 @@ async def test_list_threads(data_layer):
             ":search": {"S": "test"},
         },
         FilterExpression="contains(#name, :search)",
+        ExclusiveStartKey={"key": "value"},
     )
 
 
+async def test_list_threads_cursor_follows_last_returned_thread(data_layer):
+    data_layer.client.query.return_value = {
+        "Items": [thread_index_item(f"thread{i}", f"Thread {i}") for i in range(1, 4)],
+        "ScannedCount": 3,
+    }
+
+    result = await data_layer.list_threads(
+        pagination=Pagination(first=2), filters=ThreadFilter(userId="user123")
+    )
+
+    assert [thread["id"] for thread in result.data] == ["thread1", "thread2"]
+    assert result.pageInfo.hasNextPage is True
+    assert json.loads(result.pageInfo.endCursor) == {
+        "PK": {"S": "THREAD#thread2"},
+        "SK": {"S": "THREAD"},
+        "UserThreadPK": {"S": "USER#user123"},
+        "UserThreadSK": {"S": "TS#2023-01-01T00:00:02"},
+    }
+
+
+async def test_list_threads_read_budget(data_layer):
+    data_layer.list_threads_read_budget = 10
+    data_layer.client.query.return_value = {
+        "Items": [],
+        "ScannedCount": 5,
+        "LastEvaluatedKey": {"key": "value"},
+    }
+
+    result = await data_layer.list_threads(
+        pagination=Pagination(first=5),
+        filters=ThreadFilter(userId="user123", search="nothing"),
+    )
+
+    assert result.data == []
+    assert data_layer.client.query.call_count == 2
+    assert result.pageInfo.hasNextPage is True
+    assert json.loads(result.pageInfo.endCursor) == {"key": "value"}
+
+
 async def test_get_thread(data_layer):
     mock_items = [
         {
@@ -255,14 +849,43 @@ async def test_update_thread(data_layer):
         tags=["tag1"],
     )
 
+    # Creation attributes are only set if missing, not to move the index entry
     data_layer.client.update_item.assert_called_once_with(
         TableName="test_table",
-        Key=ANY,
-        UpdateExpression=ANY,
-        ExpressionAttributeNames=ANY,
+        Key={"PK": {"S": "THREAD#thread123"}, "SK": {"S": "THREAD"}},
+        UpdateExpression="SET #0 = :0, #1 = :1, #2 = :2, #3 = :3, #4 = :4, #5 = :5, #6 = :6, #7 = if_not_exists(#7, :7), #8 = if_not_exists(#8, :8)",
+        ExpressionAttributeNames={
+            "#0": "id",
+            "#1": "name",
+            "#2": "userId",
+            "#3": "userIdentifier",
+            "#4": "tags",
+            "#5": "metadata",
+            "#6": "UserThreadPK",
+            "#7": "createdAt",
+            "#8": "UserThreadSK",
+        },
         ExpressionAttributeValues=ANY,
     )
 
+    # Owner attributes written once are not sent again
+    await data_layer.update_thread("thread123", name="Renamed", user_id="user123")
+
+    names = data_layer.client.update_item.call_args.kwargs["ExpressionAttributeNames"]
+    assert sorted(names.values()) == [
+        "UserThreadSK",
+        "createdAt",
+        "name",
+    ]
+
+    # Unless the thread was deleted since
+    data_layer.client.query.return_value = {"Items": []}
+    await data_layer.delete_thread("thread123")
+    await data_layer.update_thread("thread123", name="Again", user_id="user123")
+
+    names = data_layer.client.update_item.call_args.kwargs["ExpressionAttributeNames"]
+    assert "UserThreadPK" in names.values()
+
 
 async def test_build_debug_url(data_layer):
     url = await data_layer.build_debug_url()
@@ -0,0 +1,37 @@
+-- PostgreSQL only: replaces the steps table of schema.sql with one range
+-- partitioned by month of "createdAt". Load schema.sql first, then this file
+-- on an empty database, and create the monthly partitions with
+-- SQLAlchemyDataLayer.create_step_partitions().
+DROP TABLE IF EXISTS steps;
+
+CREATE TABLE steps (
+    "id" UUID NOT NULL,
+    "name" TEXT NOT NULL,
+    "type" TEXT NOT NULL,
+    "threadId" UUID NOT NULL,
+    "parentId" UUID,
+    "streaming" BOOLEAN NOT NULL,
+    "waitForAnswer" BOOLEAN,
+    "isError" BOOLEAN,
+    "metadata" JSONB,
+    "tags" TEXT[],
+    "input" TEXT,
+    "output" TEXT,
+    -- Byte order, so that ISO timestamps sort within their month bounds
+    "createdAt" TEXT COLLATE "C" NOT NULL,
+    "start" TEXT,
+    "end" TEXT,
+    "generation" JSONB,
+    "showInput" TEXT,
+    "language" TEXT,
+    "indent" INT,
+    PRIMARY KEY ("id", "createdAt"),
+    FOREIGN KEY ("threadId") REFERENCES threads("id") ON DELETE CASCADE
+) PARTITION BY RANGE ("createdAt");
+
+-- Catches steps outside of the monthly partitions
+CREATE TABLE steps_default PARTITION OF steps DEFAULT;
+
+CREATE INDEX IF NOT EXISTS "steps_threadId_idx" ON steps ("threadId");
+CREATE INDEX IF NOT EXISTS "steps_parentId_idx" ON steps ("parentId");
+CREATE INDEX IF NOT EXISTS "steps_createdAt_idx" ON steps ("createdAt");
@@ -13,6 +13,7 @@ CREATE TABLE IF NOT EXISTS threads (
     "userIdentifier" TEXT,
     "tags" TEXT[],
     "metadata" JSONB,
+    "deletedAt" TEXT,
     FOREIGN KEY ("userId") REFERENCES users("id") ON DELETE CASCADE
 );
 
@@ -65,3 +66,10 @@ CREATE TABLE IF NOT EXISTS feedbacks (
     "comment" TEXT,
     FOREIGN KEY ("threadId") REFERENCES threads("id") ON DELETE CASCADE
 );
+
+CREATE INDEX IF NOT EXISTS "elements_threadId_idx" ON elements ("threadId");
+CREATE INDEX IF NOT EXISTS "steps_parentId_idx" ON steps ("parentId");
+CREATE INDEX IF NOT EXISTS "threads_deletedAt_idx" ON threads ("deletedAt") WHERE "deletedAt" IS NOT NULL;
+CREATE INDEX IF NOT EXISTS "feedbacks_forId_idx" ON feedbacks ("forId");
+CREATE INDEX IF NOT EXISTS "feedbacks_threadId_idx" ON feedbacks ("threadId");
+CREATE INDEX IF NOT EXISTS "steps_createdAt_idx" ON steps ("createdAt");
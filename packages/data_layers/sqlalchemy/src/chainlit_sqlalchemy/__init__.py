@@ -1,3 +1,28 @@
 from .data_layer import SQLAlchemyDataLayer
+from .invalidation import (
+    BaseInvalidationBus,
+    InMemoryInvalidationBus,
+    InvalidationEvent,
+    PostgresInvalidationBus,
+)
+from .metrics import (
+    BaseMetricsSink,
+    InMemoryMetricsSink,
+    OpenTelemetryMetricsSink,
+    PrometheusMetricsSink,
+)
+from .slow_queries import SlowQuery, SlowQueryRecorder
 
-__all__ = ["SQLAlchemyDataLayer"]
+__all__ = [
+    "BaseInvalidationBus",
+    "BaseMetricsSink",
+    "InMemoryInvalidationBus",
+    "InMemoryMetricsSink",
+    "InvalidationEvent",
+    "OpenTelemetryMetricsSink",
+    "PostgresInvalidationBus",
+    "PrometheusMetricsSink",
+    "SQLAlchemyDataLayer",
+    "SlowQuery",
+    "SlowQueryRecorder",
+]
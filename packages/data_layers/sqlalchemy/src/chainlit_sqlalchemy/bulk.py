@@ -0,0 +1,238 @@
+import asyncio
+import csv
+import json
+import os
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, List, Literal
+
+import aiofiles
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+BulkFormat = Literal["ndjson", "csv"]
+
+# In foreign key order, import them in this order
+BULK_TABLES = ("users", "threads", "steps", "elements", "feedbacks")
+
+
+def _check_table(table: str):
+    if table not in BULK_TABLES:
+        raise ValueError(f"Unsupported table {table}, expected one of {BULK_TABLES}")
+
+
+def _check_format(format: str):
+    if format not in ("ndjson", "csv"):
+        raise ValueError(f"Unsupported format {format}, expected ndjson or csv")
+
+
+async def _table_columns(conn: AsyncConnection, table: str) -> List[str]:
+    result = await conn.execute(text(f"SELECT * FROM {table} LIMIT 0"))
+    return list(result.keys())
+
+
+def _check_columns(table: str, columns: List[str], table_columns: List[str]):
+    unknown = [column for column in columns if column not in table_columns]
+    if unknown:
+        raise ValueError(f"Unknown columns for table {table}: {unknown}")
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _sql_value(value: Any) -> Any:
+    # JSON documents have to be serialized for the DBAPI, SQLite has no arrays
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+###### Export ######
+
+
+async def export_table(
+    engine: AsyncEngine,
+    table: str,
+    path: str | os.PathLike,
+    format: BulkFormat = "ndjson",
+    batch_size: int = 10000,
+) -> int:
+    """Dump `table` to `path`, streaming rows `batch_size` at a time. Returns the number of rows."""
+    _check_table(table)
+    _check_format(format)
+    async with engine.connect() as conn:
+        if format == "csv" and engine.dialect.driver == "asyncpg":
+            raw_connection = await conn.get_raw_connection()
+            status = await raw_connection.driver_connection.copy_from_query(
+                f"SELECT * FROM {table}", output=path, format="csv", header=True
+            )
+            return int(status.split()[-1])
+
+        result = await conn.stream(
+            text(f"SELECT * FROM {table}"),
+            execution_options={"yield_per": batch_size},
+        )
+        columns = list(result.keys())
+        rows = 0
+        async with aiofiles.open(path, "w", newline="") as f:
+            if format == "csv":
+                writer = csv.writer(_LineBuffer())
+                await f.write(writer.writerow(columns))
+            async for partition in result.partitions():
+                if format == "csv":
+                    chunk = "".join(
+                        writer.writerow([_csv_value(value) for value in row])
+                        for row in partition
+                    )
+                else:
+                    chunk = "".join(
+                        json.dumps(dict(zip(columns, row)), default=str) + "\n"
+                        for row in partition
+                    )
+                await f.write(chunk)
+                rows += len(partition)
+        return rows
+
+
+class _LineBuffer:
+    """File-like object handing back what csv.writer writes to it."""
+
+    def write(self, line: str) -> str:
+        return line
+
+
+###### Import ######
+
+
+async def _read_batches(
+    path: str | os.PathLike, format: BulkFormat, batch_size: int
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    if format == "ndjson":
+        batch: List[Dict[str, Any]] = []
+        async with aiofiles.open(path) as f:
+            async for line in f:
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+        return
+
+    # Quoted CSV fields may span several lines, parse it with the csv module in a thread
+    f = await asyncio.to_thread(open, path, newline="")
+    try:
+        reader = csv.DictReader(f)
+        while True:
+            csv_batch = await asyncio.to_thread(
+                lambda: list(islice(reader, batch_size))
+            )
+            if not csv_batch:
+                break
+            # Without a schema, empty fields can only be read as NULL
+            yield [
+                {key: value if value != "" else None for key, value in row.items()}
+                for row in csv_batch
+            ]
+    finally:
+        f.close()
+
+
+def _csv_header(path: str | os.PathLike) -> List[str]:
+    with open(path, newline="") as f:
+        return next(csv.reader(f), [])
+
+
+async def _column_types(conn: AsyncConnection, table: str) -> Dict[str, str]:
+    result = await conn.execute(
+        text(
+            "SELECT column_name, data_type FROM information_schema.columns WHERE table_name = :table"
+        ),
+        {"table": table},
+    )
+    return {row[0]: row[1] for row in result.fetchall()}
+
+
+async def import_table(
+    engine: AsyncEngine,
+    table: str,
+    path: str | os.PathLike,
+    format: BulkFormat = "ndjson",
+    batch_size: int = 10000,
+) -> int:
+    """Load rows from `path` into `table`, `batch_size` at a time. Returns the number of rows.
+
+    Rows are inserted as is, the table is expected not to contain them yet.
+    """
+    _check_table(table)
+    _check_format(format)
+    async with engine.connect() as conn:
+        table_columns = await _table_columns(conn, table)
+        if engine.dialect.driver == "asyncpg":
+            return await _copy_to_table(
+                conn, table, table_columns, path, format, batch_size
+            )
+
+        rows = 0
+        async for batch in _read_batches(path, format, batch_size):
+            columns = list(batch[0].keys())
+            _check_columns(table, columns, table_columns)
+            query = f"""
+                INSERT INTO {table} ({", ".join(f'"{column}"' for column in columns)})
+                VALUES ({", ".join(f":{column}" for column in columns)})
+            """
+            await conn.execute(
+                text(query),
+                [
+                    {column: _sql_value(row.get(column)) for column in columns}
+                    for row in batch
+                ],
+            )
+            # One transaction per batch keeps the server side state bounded
+            await conn.commit()
+            rows += len(batch)
+        return rows
+
+
+async def _copy_to_table(
+    conn: AsyncConnection,
+    table: str,
+    table_columns: List[str],
+    path: str | os.PathLike,
+    format: BulkFormat,
+    batch_size: int,
+) -> int:
+    column_types = await _column_types(conn, table)
+    # COPY runs on the bare asyncpg connection, outside of the transaction
+    # SQLAlchemy began for the queries above
+    await conn.rollback()
+    raw_connection = await conn.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    if format == "csv":
+        columns = await asyncio.to_thread(_csv_header, path)
+        _check_columns(table, columns, table_columns)
+        status = await driver_connection.copy_to_table(
+            table, source=path, columns=columns, format="csv", header=True
+        )
+        return int(status.split()[-1])
+
+    async def records() -> AsyncIterator[tuple]:
+        async for batch in _read_batches(path, format, batch_size):
+            for row in batch:
+                _check_columns(table, list(row.keys()), table_columns)
+                yield tuple(
+                    json.dumps(row.get(column))
+                    if column_types.get(column) in ("json", "jsonb")
+                    and row.get(column) is not None
+                    and not isinstance(row.get(column), str)
+                    else row.get(column)
+                    for column in table_columns
+                )
+
+    status = await driver_connection.copy_records_to_table(
+        table, records=records(), columns=table_columns
+    )
+    return int(status.split()[-1])
@@ -1,9 +1,15 @@
+import asyncio
+import copy
+import functools
+import hashlib
 import json
+import os
 import ssl
 import uuid
+from contextvars import ContextVar
 from dataclasses import asdict
 from datetime import datetime
-from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, TypedDict
 
 import aiofiles
 import aiohttp
@@ -32,10 +38,117 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
 )
 
+from .bulk import BulkFormat, export_table, import_table
+from .cache import LRUCache
+from .instrumentation import (
+    current_operation,
+    install_statement_hooks,
+    instrumented,
+    operation_execution_options,
+)
+from .invalidation import BaseInvalidationBus, InvalidationEntity, InvalidationEvent
+from .metrics import BaseMetricsSink
+from .partitioning import (
+    add_months,
+    create_partition_query,
+    month_of,
+    partition_month,
+    partition_name,
+    thread_steps_created_after,
+)
+from .sharding import HashRing, on_shard
+from .singleflight import SingleFlight, single_flight
+from .slow_queries import SlowQueryRecorder
+from .sqlite import (
+    DEFAULT_SQLITE_PRAGMAS,
+    SQLiteWriteQueue,
+    is_write_query,
+    set_sqlite_pragmas,
+)
+
 if TYPE_CHECKING:
     from chainlit.element import Element, ElementDict
     from chainlit.step import StepDict
 
+# Columns of a steps (s) LEFT JOIN feedbacks (f) query, see _step_dict_from_row()
+STEP_FEEDBACK_COLUMNS = """
+    s."id" AS step_id,
+    s."name" AS step_name,
+    s."type" AS step_type,
+    s."threadId" AS step_threadid,
+    s."parentId" AS step_parentid,
+    s."streaming" AS step_streaming,
+    s."waitForAnswer" AS step_waitforanswer,
+    s."isError" AS step_iserror,
+    s."metadata" AS step_metadata,
+    s."tags" AS step_tags,
+    s."input" AS step_input,
+    s."output" AS step_output,
+    s."createdAt" AS step_createdat,
+    s."start" AS step_start,
+    s."end" AS step_end,
+    s."generation" AS step_generation,
+    s."showInput" AS step_showinput,
+    s."language" AS step_language,
+    f."value" AS feedback_value,
+    f."comment" AS feedback_comment,
+    f."id" AS feedback_id
+"""
+
+# Feedback buckets of get_feedback_stats()
+FEEDBACK_GROUPS = {
+    "day": 'substr(s."createdAt", 1, 10)',
+    "step": 's."name"',
+    "user": 't."userIdentifier"',
+}
+
+
+class FeedbackStats(TypedDict):
+    bucket: str | None
+    positive: int
+    negative: int
+    total: int
+    positive_rate: float
+
+
+# Postgres error code of statements cancelled by statement_timeout
+QUERY_CANCELED = "57014"
+
+
+class StatementTimeoutError(Exception):
+    def __init__(self, operation: str, timeout: float):
+        super().__init__(
+            f"statement of {operation or 'unknown'} cancelled after {timeout}s"
+        )
+
+
+USER_QUERY = "SELECT * FROM users WHERE identifier = :identifier"
+
+# Step dict keys of the step upserts Chainlit sends the most (root and nested
+# steps, while running and once ended), prepared by warm_up()
+HOT_STEP_KEYS = [
+    [
+        "name",
+        "type",
+        "id",
+        "threadId",
+        *(["parentId"] if nested else []),
+        "streaming",
+        "input",
+        "isError",
+        "output",
+        "createdAt",
+        "start",
+        *(["end"] if ended else []),
+        "showInput",
+        # Appended by create_step when empty
+        "metadata",
+        "generation",
+    ]
+    for nested in (False, True)
+    for ended in (False, True)
+]
+
 
 class SQLAlchemyDataLayer(BaseDataLayer):
     def __init__(
@@ -45,23 +158,92 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         storage_provider: BaseStorageClient | None = None,
         user_thread_limit: int | None = 1000,
         show_logger: bool | None = False,
+        step_fingerprint_cache_size: int = 1000,
+        sqlite_production_mode: bool = False,
+        sqlite_pragmas: Dict[str, Any] | None = None,
+        sqlite_write_batch_size: int = 64,
+        invalidation_bus: BaseInvalidationBus | None = None,
+        cache_size: int = 1000,
+        shard_conninfos: List[str] | None = None,
+        previous_shard_count: int | None = None,
+        metrics_sink: BaseMetricsSink | None = None,
+        slow_query_recorder: SlowQueryRecorder | None = None,
+        soft_delete: bool = False,
+        partitioned_steps: bool = False,
+        statement_timeout: float | None = None,
+        statement_timeouts: Dict[str, float] | None = None,
     ):
         self._conninfo = conninfo
+        self.metrics_sink = metrics_sink
+        self.slow_query_recorder = slow_query_recorder
         self.user_thread_limit = user_thread_limit
         self.show_logger = show_logger
-        ssl_args = {}
+        # step id -> (thread id, fingerprint of the last persisted parameters)
+        self._step_fingerprints: LRUCache[str, tuple[str | None, str]] = LRUCache(
+            step_fingerprint_cache_size
+        )
+        self.step_write_stats: Dict[str, int] = {"written": 0, "skipped": 0}
+        # Deleted threads are only tombstoned, see reap_deleted_threads()
+        self.soft_delete = soft_delete
+        self._reaper: asyncio.Task | None = None
+        # Postgres steps table partitioned by month, see partitioned_steps.sql
+        self.partitioned_steps = partitioned_steps
+        # Seconds, per data layer method name with `statement_timeout` as fallback
+        self.statement_timeout = statement_timeout
+        self.statement_timeouts = statement_timeouts or {}
+        # Reads are only cached when other workers can tell us about their writes.
+        self._invalidation_bus = invalidation_bus
+        cache_size = cache_size if invalidation_bus is not None else 0
+        self._user_cache: LRUCache[str, PersistedUser] = LRUCache(cache_size)
+        self._thread_author_cache: LRUCache[str, str] = LRUCache(cache_size)
+        self._thread_cache: LRUCache[str, ThreadDict] = LRUCache(cache_size)
+        self._cache_generation = 0
+        # Concurrent identical reads share a single query
+        self._single_flight = SingleFlight()
+        if invalidation_bus is not None:
+            invalidation_bus.subscribe(self._apply_invalidation)
+        self._ssl_args = {}
         if ssl_require:
             # Create an SSL context to require an SSL connection
             ssl_context = ssl.create_default_context()
             ssl_context.check_hostname = False
             ssl_context.verify_mode = ssl.CERT_NONE
-            ssl_args["ssl"] = ssl_context
-        self.engine: AsyncEngine = create_async_engine(
-            self._conninfo, connect_args=ssl_args
+            self._ssl_args["ssl"] = ssl_context
+        self._sqlite_pragmas = (
+            {**DEFAULT_SQLITE_PRAGMAS, **(sqlite_pragmas or {})}
+            if sqlite_production_mode
+            else None
+        )
+        self._sqlite_write_batch_size = sqlite_write_batch_size
+
+        # Shard 0 is `conninfo`, users are spread over the shards by identifier.
+        self.engines: List[AsyncEngine] = []
+        self._session_factories: List[async_sessionmaker[AsyncSession]] = []
+        self._write_queues: List[SQLiteWriteQueue | None] = []
+        for shard_conninfo in [conninfo, *(shard_conninfos or [])]:
+            self._add_engine(shard_conninfo)
+        self.engine: AsyncEngine = self.engines[0]
+        self.async_session = self._session_factories[0]
+        self._ring = HashRing(len(self.engines))
+        # Ring from before shards were added, users not rebalanced yet still
+        # live there. Set on every worker until `rebalance_shards` is done.
+        if previous_shard_count is not None and not (
+            0 < previous_shard_count <= len(self.engines)
+        ):
+            raise ValueError(
+                "previous_shard_count must be between 1 and the number of shards"
+            )
+        self._previous_ring: HashRing | None = (
+            HashRing(previous_shard_count)
+            if previous_shard_count is not None
+            and previous_shard_count < len(self.engines)
+            else None
         )
-        self.async_session = async_sessionmaker(
-            bind=self.engine, expire_on_commit=False, class_=AsyncSession
-        )  # type: ignore
+        self._shard: ContextVar[int] = ContextVar(
+            f"chainlit_sqlalchemy_shard_{id(self)}", default=0
+        )
+        self._thread_shards: LRUCache[str, int] = LRUCache(10000)
+        self._user_id_shards: LRUCache[str, int] = LRUCache(10000)
         if storage_provider:
             self.storage_provider: BaseStorageClient | None = storage_provider
             if self.show_logger:
@@ -75,15 +257,142 @@ class SQLAlchemyDataLayer(BaseDataLayer):
     async def build_debug_url(self) -> str:
         return ""
 
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        if self.slow_query_recorder is not None:
+            await self.slow_query_recorder.drain()
+        for write_queue in self._write_queues:
+            if write_queue is not None:
+                await write_queue.close()
+        if self._invalidation_bus is not None:
+            await self._invalidation_bus.close()
+        for engine in self.engines:
+            await engine.dispose()
+
+    @instrumented
+    async def warm_up(self, connections: int | None = None) -> int:
+        """Open `connections` connections per shard (the pool size by default), ping
+        them and, on asyncpg, prepare the hot statements on each of them.
+
+        Await it from a startup hook so that the first requests after a deploy do
+        not pay for it. Returns the number of connections warmed up.
+        """
+        warmed_up = await asyncio.gather(
+            *(self._warm_up_engine(engine, connections) for engine in self.engines)
+        )
+        if self.show_logger:
+            logger.info(f"SQLAlchemy: warmed up {sum(warmed_up)} connections")
+        return sum(warmed_up)
+
+    async def _warm_up_engine(
+        self, engine: AsyncEngine, connections: int | None
+    ) -> int:
+        if connections is None:
+            pool_size = getattr(engine.pool, "size", None)
+            connections = pool_size() if callable(pool_size) else 1
+        statements = []
+        if engine.dialect.driver == "asyncpg":
+            # Prepare the exact SQL the asyncpg adapter will be asked to run
+            statements = [
+                str(text(query).compile(dialect=engine.dialect))
+                for query in self._hot_queries()
+            ]
+
+        async def warm_up_connection() -> bool:
+            try:
+                # Held concurrently, so that the pool opens distinct connections
+                async with engine.connect() as conn:
+                    await conn.exec_driver_sql(
+                        "SELECT 1", execution_options=operation_execution_options()
+                    )
+                    if statements:
+                        raw_connection = await conn.get_raw_connection()
+                        if not await self._prepare_statements(
+                            raw_connection.dbapi_connection, engine, statements
+                        ):
+                            # Unsupported, don't try again on the other connections
+                            statements.clear()
+                return True
+            except Exception as e:
+                logger.warn(f"SQLAlchemy: failed to warm up a connection: {e}")
+                return False
+
+        warmed_up = await asyncio.gather(
+            *(warm_up_connection() for _ in range(connections))
+        )
+        return sum(warmed_up)
+
+    async def _prepare_statements(
+        self, adapter: Any, engine: AsyncEngine, statements: List[str]
+    ) -> bool:
+        """Fill the prepared statement cache of SQLAlchemy's asyncpg adapter.
+
+        There is no public API for it: asyncpg's `Connection.prepare()` does not
+        go through that cache. Returns False, skipping the preparation, when the
+        installed SQLAlchemy adapter does not work the expected way.
+        """
+        try:
+            for statement in statements:
+                await adapter._prepare(
+                    statement,
+                    getattr(engine.dialect, "_invalidate_schema_cache_asof", 0),
+                )
+        except (AttributeError, TypeError) as e:
+            logger.warn(
+                f"SQLAlchemy: can't prepare statements with this SQLAlchemy version's asyncpg adapter, warming up connections without them: {e}"
+            )
+            return False
+        return True
+
+    def _add_engine(self, conninfo: str):
+        engine = create_async_engine(conninfo, connect_args=self._ssl_args)
+        session_factory = async_sessionmaker(
+            bind=engine, expire_on_commit=False, class_=AsyncSession
+        )
+        if self.metrics_sink is not None or self.slow_query_recorder is not None:
+            install_statement_hooks(
+                engine, functools.partial(self._on_statement, engine)
+            )
+        write_queue = None
+        if self._sqlite_pragmas is not None:
+            if engine.dialect.name != "sqlite":
+                raise ValueError(
+                    "sqlite_production_mode requires a sqlite connection string"
+                )
+            set_sqlite_pragmas(engine, self._sqlite_pragmas)
+            write_queue = SQLiteWriteQueue(
+                session_factory, batch_size=self._sqlite_write_batch_size
+            )
+        self.engines.append(engine)
+        self._session_factories.append(session_factory)
+        self._write_queues.append(write_queue)
+
     ###### SQL Helpers ######
     async def execute_sql(
         self, query: str, parameters: dict
     ) -> List[Dict[str, Any]] | int | None:
+        shard = self._shard.get()
+        execution_options = operation_execution_options()
+        write_queue = self._write_queues[shard]
+        if write_queue is not None and is_write_query(query):
+            rowcount = await write_queue.submit(query, parameters, execution_options)
+            if rowcount is not None:
+                self._record_rows(rowcount)
+            return rowcount
+
         parameterized_query = text(query)
-        async with self.async_session() as session:
+        async with self._session_factories[shard]() as session:
             try:
                 await session.begin()
-                result = await session.execute(parameterized_query, parameters)
+                result = await self._execute_statement(
+                    session, parameterized_query, parameters, execution_options
+                )
                 await session.commit()
 
                 assert hasattr(result, "returns_rows")
@@ -94,13 +403,25 @@ class SQLAlchemyDataLayer(BaseDataLayer):
                 # For now, this is working, so we ignore.
                 if result.returns_rows:  # pyright: ignore reportAttributeAccessIssue
                     json_result = [dict(row._mapping) for row in result.fetchall()]
+                    self._record_rows(len(json_result))
                     clean_json_result = self.clean_result(json_result)
                     assert isinstance(clean_json_result, list) or isinstance(
                         clean_json_result, int
                     )
                     return clean_json_result  # pyright: ignore reportReturnType
                 else:
+                    self._record_rows(result.rowcount)  # pyright: ignore reportAttributeAccessIssue
                     return result.rowcount  # pyright: ignore reportAttributeAccessIssue
+            except StatementTimeoutError as e:
+                await session.rollback()
+                logger.warn(f"SQLAlchemy: {e}")
+                if self.metrics_sink is not None:
+                    self.metrics_sink.increment(
+                        "statement_timeouts_total",
+                        1,
+                        {"method": current_operation.get() or "unknown"},
+                    )
+                return None
             except SQLAlchemyError as e:
                 await session.rollback()
                 logger.warn(f"An error occurred: {e}")
@@ -110,9 +431,442 @@ class SQLAlchemyDataLayer(BaseDataLayer):
                 logger.warn(f"An unexpected error occurred: {e}")
                 return None
 
+    async def _execute_statement(
+        self,
+        session: AsyncSession,
+        statement,
+        parameters: dict,
+        execution_options: dict,
+    ):
+        """Execute `statement`, cancelling it after the current method's statement timeout."""
+        operation = current_operation.get() or ""
+        timeout = self.statement_timeouts.get(operation, self.statement_timeout)
+        if timeout is None:
+            return await session.execute(
+                statement, parameters, execution_options=execution_options
+            )
+
+        connection = await session.connection()
+        dialect = connection.dialect.name
+        interrupted: List[bool] = []
+        interrupt_timer = None
+        if dialect == "postgresql":
+            # Cancelled by the server, which frees the connection right away
+            await session.execute(
+                text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"),
+                execution_options=execution_options,
+            )
+        elif dialect == "sqlite":
+            raw_connection = await connection.get_raw_connection()
+            try:
+                sqlite_connection = raw_connection.driver_connection._conn  # type: ignore
+            except (AttributeError, ValueError):
+                sqlite_connection = None
+            if sqlite_connection is not None:
+
+                def interrupt():
+                    interrupted.append(True)
+                    sqlite_connection.interrupt()
+
+                interrupt_timer = asyncio.get_running_loop().call_later(
+                    timeout, interrupt
+                )
+
+        try:
+            # Client side deadline, for other dialects and as a backstop
+            # when the server does not answer (e.g. network stalls)
+            return await asyncio.wait_for(
+                session.execute(
+                    statement, parameters, execution_options=execution_options
+                ),
+                timeout if dialect not in ("postgresql", "sqlite") else timeout + 1,
+            )
+        except asyncio.TimeoutError as e:
+            # The statement may still be running, don't give the connection back to the pool
+            await session.invalidate()
+            raise StatementTimeoutError(operation, timeout) from e
+        except SQLAlchemyError as e:
+            orig = getattr(e, "orig", None)
+            sqlstate = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+            cancelled = sqlstate == QUERY_CANCELED
+            if interrupted or cancelled:
+                raise StatementTimeoutError(operation, timeout) from e
+            raise
+        finally:
+            if interrupt_timer is not None:
+                interrupt_timer.cancel()
+
+    ###### Instrumentation ######
+    def _on_statement(
+        self,
+        engine: AsyncEngine,
+        operation: str,
+        elapsed: float,
+        statement: str,
+        parameters,
+        context,
+    ):
+        labels = {"method": operation}
+        if self.metrics_sink is not None:
+            self.metrics_sink.observe("statement_duration_seconds", elapsed, labels)
+            self.metrics_sink.increment("statements_total", 1, labels)
+        if self.slow_query_recorder is not None:
+            slow_query = self.slow_query_recorder.record(
+                engine, operation, elapsed, statement, parameters
+            )
+            if slow_query is not None and self.metrics_sink is not None:
+                self.metrics_sink.increment("slow_statements_total", 1, labels)
+
+    def _record_rows(self, rows: int):
+        if self.metrics_sink is not None and rows >= 0:
+            self.metrics_sink.increment(
+                "rows_total", rows, {"method": current_operation.get() or "unknown"}
+            )
+
+    ###### Sharding ######
+    async def _execute_on_shard(
+        self, shard: int, query: str, parameters: dict
+    ) -> List[Dict[str, Any]] | int | None:
+        token = self._shard.set(shard)
+        try:
+            return await self.execute_sql(query=query, parameters=parameters)
+        finally:
+            self._shard.reset(token)
+
+    async def _locate_shard(self, table: str, id: str | None) -> int | None:
+        """Find the shard holding row `id` of `table` by asking all of them."""
+        if id is None:
+            return None
+        query = f"""SELECT 1 AS found FROM {table} WHERE "id" = :id"""
+        results = await asyncio.gather(
+            *(
+                self._execute_on_shard(shard, query, {"id": id})
+                for shard in range(len(self.engines))
+            )
+        )
+        for shard, result in enumerate(results):
+            if isinstance(result, list) and result:
+                return shard
+        return None
+
+    async def _user_shard(self, identifier: str) -> int:
+        shard = self._ring.get_shard(identifier)
+        if self._previous_ring is None:
+            return shard
+        previous = self._previous_ring.get_shard(identifier)
+        if (
+            previous != shard
+            and not await self._has_user(shard, identifier)
+            and await self._has_user(previous, identifier)
+        ):
+            # Not moved by `rebalance_shards` yet
+            return previous
+        return shard
+
+    async def _has_user(self, shard: int, identifier: str) -> bool:
+        result = await self._execute_on_shard(
+            shard,
+            """SELECT 1 AS found FROM users WHERE "identifier" = :identifier""",
+            {"identifier": identifier},
+        )
+        return isinstance(result, list) and bool(result)
+
+    async def _user_id_shard(self, user_id: str | None) -> int:
+        if user_id is None:
+            return 0
+        shard = self._user_id_shards.get(user_id)
+        if shard is None:
+            shard = await self._locate_shard("users", user_id)
+            if shard is None:
+                return 0
+            self._user_id_shards.set(user_id, shard)
+        return shard
+
+    async def _thread_shard(self, thread_id: str | None) -> int:
+        if thread_id is None:
+            return 0
+        shard = self._thread_shards.get(thread_id)
+        if shard is None:
+            shard = await self._locate_shard("threads", thread_id)
+            if shard is None:
+                # Thread not persisted yet and not owned by a user
+                return self._ring.get_shard(thread_id)
+            self._thread_shards.set(thread_id, shard)
+        return shard
+
+    async def _located_shard(self, table: str, id: str) -> int:
+        return await self._locate_shard(table, id) or 0
+
+    async def _locate_step_shard(self, step_id: str) -> int:
+        fingerprint = self._step_fingerprints.get(step_id)
+        if fingerprint is not None and fingerprint[0] is not None:
+            return await self._thread_shard(fingerprint[0])
+        return await self._located_shard("steps", step_id)
+
+    async def _element_shard(self, arguments: Dict[str, Any]) -> int:
+        if arguments["thread_id"]:
+            return await self._thread_shard(arguments["thread_id"])
+        return await self._located_shard("elements", arguments["element_id"])
+
+    async def _user_threads_shard(self, arguments: Dict[str, Any]) -> int:
+        if arguments["user_id"]:
+            return await self._user_id_shard(arguments["user_id"])
+        return await self._thread_shard(arguments["thread_id"])
+
+    async def _update_thread_shard(self, arguments: Dict[str, Any]) -> int:
+        if arguments["user_id"]:
+            return await self._user_id_shard(arguments["user_id"])
+        return await self._thread_shard(arguments["thread_id"])
+
+    async def add_shard(self, conninfo: str):
+        """Add a database to the shard ring. Call `rebalance_shards` afterwards to move users onto it.
+
+        Until then, users are read and updated on the shard they live on. Only
+        this data layer knows about the new shard: other workers must be
+        (re)started with it in `shard_conninfos` and `previous_shard_count` set
+        to the former number of shards.
+        """
+        if self._previous_ring is None:
+            self._previous_ring = copy.deepcopy(self._ring)
+        self._add_engine(conninfo)
+        self._ring.add_shard(len(self.engines) - 1)
+
+    async def rebalance_shards(self, batch_size: int = 100) -> Dict[str, int]:
+        """Move every user living on the wrong shard, with all of their data, to its ring shard.
+
+        Rows are copied before being deleted from the source shard, so the
+        operation can be safely re-run after a failure. Writes to a user's data
+        between the copy and the delete are lost, so move users while they are
+        inactive. Once done, workers can be restarted without
+        `previous_shard_count`.
+        """
+        moved = {"users": 0, "threads": 0}
+        for source in range(len(self.engines)):
+            after = ""
+            while True:
+                users = await self._execute_on_shard(
+                    source,
+                    """SELECT "id", "identifier" FROM users WHERE "identifier" > :after ORDER BY "identifier" LIMIT :limit""",
+                    {"after": after, "limit": batch_size},
+                )
+                if not isinstance(users, list) or not users:
+                    break
+                for user in users:
+                    target = self._ring.get_shard(user["identifier"])
+                    if target != source:
+                        moved["threads"] += await self._move_user(
+                            str(user["id"]), source, target
+                        )
+                        moved["users"] += 1
+                after = users[-1]["identifier"]
+
+        self._previous_ring = None
+        self._thread_shards.clear()
+        self._user_id_shards.clear()
+        self._apply_invalidation(InvalidationEvent(entity="all", id=""))
+        return moved
+
+    async def _move_user(self, user_id: str, source: int, target: int) -> int:
+        user_threads = """SELECT "id" FROM threads WHERE "userId" = :user_id"""
+        queries = [
+            ("users", """SELECT * FROM users WHERE "id" = :user_id"""),
+            ("threads", """SELECT * FROM threads WHERE "userId" = :user_id"""),
+            ("steps", f"""SELECT * FROM steps WHERE "threadId" IN ({user_threads})"""),
+            (
+                "elements",
+                f"""SELECT * FROM elements WHERE "threadId" IN ({user_threads})""",
+            ),
+            (
+                "feedbacks",
+                f"""SELECT * FROM feedbacks WHERE "threadId" IN ({user_threads})""",
+            ),
+        ]
+        rows: Dict[str, List[Dict[str, Any]]] = {}
+        for table, query in queries:
+            result = await self._execute_on_shard(source, query, {"user_id": user_id})
+            if not isinstance(result, list):
+                raise ValueError(f"Failed to read {table} of user {user_id}")
+            rows[table] = result
+
+        async with self._session_factories[target]() as session:
+            async with session.begin():
+                for table, table_rows in rows.items():
+                    if not table_rows:
+                        continue
+                    columns = list(table_rows[0].keys())
+                    query = f"""
+                        INSERT INTO {table} ({", ".join(f'"{column}"' for column in columns)})
+                        VALUES ({", ".join(f":{column}" for column in columns)})
+                        ON CONFLICT ("id") DO NOTHING
+                    """
+                    await session.execute(text(query), table_rows)
+
+        async with self._session_factories[source]() as session:
+            async with session.begin():
+                for table, query in reversed(queries):
+                    delete_query = query.replace("SELECT *", "DELETE", 1)
+                    await session.execute(text(delete_query), {"user_id": user_id})
+
+        return len(rows["threads"])
+
+    ###### Bulk import/export ######
+    @instrumented
+    async def export_table(
+        self,
+        table: str,
+        path: str | os.PathLike,
+        format: BulkFormat = "ndjson",
+        shard: int = 0,
+        batch_size: int = 10000,
+    ) -> int:
+        """Dump `table` of `shard` to an NDJSON or CSV file, returns the number of rows.
+
+        Uses COPY on asyncpg for CSV and a streaming cursor otherwise.
+        """
+        if self.show_logger:
+            logger.info(f"SQLAlchemy: export_table, table={table}, path={path}")
+        return await export_table(
+            self.engines[shard], table, path, format=format, batch_size=batch_size
+        )
+
+    @instrumented
+    async def import_table(
+        self,
+        table: str,
+        path: str | os.PathLike,
+        format: BulkFormat = "ndjson",
+        shard: int = 0,
+        batch_size: int = 10000,
+    ) -> int:
+        """Load an NDJSON or CSV file written by `export_table` into `table` of `shard`.
+
+        Uses COPY on asyncpg and batches of `batch_size` rows otherwise. Caches
+        are not invalidated, import into a database that is not serving yet.
+        """
+        if self.show_logger:
+            logger.info(f"SQLAlchemy: import_table, table={table}, path={path}")
+        return await import_table(
+            self.engines[shard], table, path, format=format, batch_size=batch_size
+        )
+
+    ###### Step partitions ######
+    @instrumented
+    async def create_step_partitions(
+        self, months_ahead: int = 3, since: str | None = None
+    ) -> List[str]:
+        """Create the monthly steps partitions from `since` (the current month by
+        default) up to `months_ahead` months from now, on every shard.
+
+        Run it periodically (e.g. daily), partitions must exist before steps
+        are written in their month or they land in the default partition.
+        """
+        self._check_partitioned_steps()
+        current_month = month_of(datetime.now())
+        month = month_of(since) if since else current_month
+        last_month = add_months(current_month, months_ahead)
+        created = []
+        while month <= last_month:
+            query = create_partition_query(month)
+            for shard in range(len(self.engines)):
+                if await self._execute_on_shard(shard, query, {}) is None:
+                    raise ValueError(
+                        f"Failed to create partition {partition_name(month)}"
+                    )
+            created.append(partition_name(month))
+            month = add_months(month, 1)
+        return created
+
+    @instrumented
+    async def drop_step_partitions(self, before: str) -> List[str]:
+        """Drop the monthly steps partitions entirely older than `before` (an ISO
+        date or timestamp) on every shard, returning their names.
+
+        This is the cheap way to enforce retention: no rows are deleted one by
+        one and nothing is left for vacuum. Feedback and elements of the dropped
+        steps are kept.
+        """
+        self._check_partitioned_steps()
+        cutoff = month_of(before)
+        query = """
+            SELECT c.relname AS name
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'steps'::regclass
+        """
+        dropped = set()
+        for shard in range(len(self.engines)):
+            partitions = await self._execute_on_shard(shard, query, {})
+            if not isinstance(partitions, list):
+                raise ValueError("Failed to list steps partitions")
+            for partition in partitions:
+                month = partition_month(partition["name"])
+                if month is not None and add_months(month, 1) <= cutoff:
+                    await self._execute_on_shard(
+                        shard, f"DROP TABLE IF EXISTS {partition['name']}", {}
+                    )
+                    dropped.add(partition["name"])
+        self._step_fingerprints.clear()
+        await self._publish_invalidation("all", "")
+        return sorted(dropped)
+
+    def _check_partitioned_steps(self):
+        if not self.partitioned_steps:
+            raise ValueError("Step partitions require partitioned_steps=True")
+        if self.engine.dialect.name != "postgresql":
+            raise ValueError("Step partitions are only supported on PostgreSQL")
+
     async def get_current_timestamp(self) -> str:
         return datetime.now().isoformat() + "Z"
 
+    def _step_fingerprint(self, parameters: Dict[str, Any]) -> str:
+        serialized = json.dumps(parameters, sort_keys=True, default=str)
+        return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+    def _forget_thread_steps(self, thread_id: str):
+        for step_id, (step_thread_id, _) in self._step_fingerprints.items():
+            if step_thread_id == thread_id:
+                self._step_fingerprints.pop(step_id)
+
+    ###### Cache invalidation ######
+    async def _cache_enabled(self) -> bool:
+        """Whether cached reads may be served, making sure we are listening for invalidations."""
+        if self._invalidation_bus is None:
+            return False
+        try:
+            await self._invalidation_bus.start()
+        except Exception as e:
+            logger.warn(
+                f"SQLAlchemy: invalidation bus unavailable, bypassing cache: {e}"
+            )
+            return False
+        return True
+
+    def _apply_invalidation(self, event: InvalidationEvent):
+        self._cache_generation += 1
+        if event.entity == "all":
+            self._user_cache.clear()
+            self._thread_author_cache.clear()
+            self._thread_cache.clear()
+        elif event.entity == "user":
+            self._user_cache.pop(event.id)
+        elif event.entity == "thread":
+            self._thread_cache.pop(event.id)
+            self._thread_author_cache.pop(event.id)
+        elif event.entity == "step" and event.thread_id:
+            self._thread_cache.pop(event.thread_id)
+
+    async def _publish_invalidation(
+        self, entity: InvalidationEntity, id: str, thread_id: str | None = None
+    ):
+        event = InvalidationEvent(entity=entity, id=id, thread_id=thread_id)
+        # Even without a bus, so that later reads don't join the in-flight ones
+        self._apply_invalidation(event)
+        if self._invalidation_bus is None:
+            return
+        try:
+            await self._invalidation_bus.publish(event)
+        except Exception as e:
+            logger.warn(f"SQLAlchemy: failed to publish invalidation {event}: {e}")
+
     def clean_result(self, obj):
         """Recursively change UUID -> str and serialize dictionaries"""
         if isinstance(obj, dict):
@@ -124,12 +878,18 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         return obj
 
     ###### User ######
+    @instrumented
+    @single_flight
+    @on_shard(lambda self, args: self._user_shard(args["identifier"]))
     async def get_user(self, identifier: str) -> PersistedUser | None:
         if self.show_logger:
             logger.info(f"SQLAlchemy: get_user, identifier={identifier}")
-        query = "SELECT * FROM users WHERE identifier = :identifier"
+        cache_enabled = await self._cache_enabled()
+        if cache_enabled and (cached := self._user_cache.get(identifier)):
+            return copy.deepcopy(cached)
+        generation = self._cache_generation
         parameters = {"identifier": identifier}
-        result = await self.execute_sql(query=query, parameters=parameters)
+        result = await self.execute_sql(query=USER_QUERY, parameters=parameters)
         if result and isinstance(result, list):
             user_data = result[0]
 
@@ -143,14 +903,19 @@ class SQLAlchemyDataLayer(BaseDataLayer):
             assert isinstance(user_data["identifier"], str)
             assert isinstance(user_data["createdAt"], str)
 
-            return PersistedUser(
+            user = PersistedUser(
                 id=user_data["id"],
                 identifier=user_data["identifier"],
                 createdAt=user_data["createdAt"],
                 metadata=metadata,
             )
+            if cache_enabled and generation == self._cache_generation:
+                self._user_cache.set(identifier, copy.deepcopy(user))
+            self._user_id_shards.set(user.id, self._shard.get())
+            return user
         return None
 
+    @on_shard(lambda self, args: self._user_id_shard(args["user_id"]))
     async def _get_user_identifer_by_id(self, user_id: str) -> str:
         if self.show_logger:
             logger.info(f"SQLAlchemy: _get_user_identifer_by_id, user_id={user_id}")
@@ -163,6 +928,7 @@ class SQLAlchemyDataLayer(BaseDataLayer):
 
         return result[0]["identifier"]
 
+    @on_shard(lambda self, args: self._thread_shard(args["thread_id"]))
     async def _get_user_id_by_thread(self, thread_id: str) -> str | None:
         if self.show_logger:
             logger.info(f"SQLAlchemy: _get_user_id_by_thread, thread_id={thread_id}")
@@ -175,6 +941,8 @@ class SQLAlchemyDataLayer(BaseDataLayer):
 
         return None
 
+    @instrumented
+    @on_shard(lambda self, args: self._user_shard(args["user"].identifier))
     async def create_user(self, user: User) -> PersistedUser | None:
         if self.show_logger:
             logger.info(f"SQLAlchemy: create_user, user_identifier={user.identifier}")
@@ -197,32 +965,54 @@ class SQLAlchemyDataLayer(BaseDataLayer):
             await self.execute_sql(
                 query=query, parameters=user_dict
             )  # We want to update the metadata
+        await self._publish_invalidation("user", str(user.identifier))
         return await self.get_user(user.identifier)
 
     ###### Threads ######
+    @instrumented
+    @single_flight
+    @on_shard(lambda self, args: self._thread_shard(args["thread_id"]))
     async def get_thread_author(self, thread_id: str) -> str:
         if self.show_logger:
             logger.info(f"SQLAlchemy: get_thread_author, thread_id={thread_id}")
-        query = """SELECT "userIdentifier" FROM threads WHERE "id" = :id"""
+        cache_enabled = await self._cache_enabled()
+        if cache_enabled and (cached := self._thread_author_cache.get(thread_id)):
+            return cached
+        generation = self._cache_generation
         parameters = {"id": thread_id}
-        result = await self.execute_sql(query=query, parameters=parameters)
+        result = await self.execute_sql(
+            query=self._thread_author_query(), parameters=parameters
+        )
         if isinstance(result, list) and result:
             author_identifier = result[0].get("userIdentifier")
             if author_identifier is not None:
+                if cache_enabled and generation == self._cache_generation:
+                    self._thread_author_cache.set(thread_id, author_identifier)
                 return author_identifier
         raise ValueError(f"Author not found for thread_id {thread_id}")
 
+    @instrumented
+    @single_flight
+    @on_shard(lambda self, args: self._thread_shard(args["thread_id"]))
     async def get_thread(self, thread_id: str) -> ThreadDict | None:
         if self.show_logger:
             logger.info(f"SQLAlchemy: get_thread, thread_id={thread_id}")
+        cache_enabled = await self._cache_enabled()
+        if cache_enabled and (cached := self._thread_cache.get(thread_id)):
+            return copy.deepcopy(cached)
+        generation = self._cache_generation
         user_threads: List[ThreadDict] | None = await self.get_all_user_threads(
             thread_id=thread_id
         )
         if user_threads:
+            if cache_enabled and generation == self._cache_generation:
+                self._thread_cache.set(thread_id, copy.deepcopy(user_threads[0]))
             return user_threads[0]
         else:
             return None
 
+    @instrumented
+    @on_shard(lambda self, args: self._update_thread_shard(args))
     async def update_thread(
         self,
         thread_id: str,
@@ -259,7 +1049,12 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         columns = ", ".join(f'"{key}"' for key in parameters.keys())
         values = ", ".join(f":{key}" for key in parameters.keys())
         updates = ", ".join(
-            f'"{key}" = EXCLUDED."{key}"' for key in parameters.keys() if key != "id"
+            # A thread is created once, its steps' partitions are bounded by it
+            f'"{key}" = COALESCE(threads."{key}", EXCLUDED."{key}")'
+            if key == "createdAt"
+            else f'"{key}" = EXCLUDED."{key}"'
+            for key in parameters.keys()
+            if key != "id"
         )
         query = f"""
             INSERT INTO threads ({columns})
@@ -268,11 +1063,29 @@ class SQLAlchemyDataLayer(BaseDataLayer):
             SET {updates};
         """
         await self.execute_sql(query=query, parameters=parameters)
+        self._thread_shards.set(thread_id, self._shard.get())
+        await self._publish_invalidation("thread", thread_id)
 
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["thread_id"]))
     async def delete_thread(self, thread_id: str):
         if self.show_logger:
             logger.info(f"SQLAlchemy: delete_thread, thread_id={thread_id}")
 
+        if self.soft_delete:
+            query = """UPDATE threads SET "deletedAt" = :deleted_at WHERE "id" = :id"""
+            parameters = {
+                "id": thread_id,
+                "deleted_at": await self.get_current_timestamp(),
+            }
+            await self.execute_sql(query=query, parameters=parameters)
+        else:
+            await self._hard_delete_thread(thread_id)
+            self._thread_shards.pop(thread_id)
+        self._forget_thread_steps(thread_id)
+        await self._publish_invalidation("thread", thread_id)
+
+    async def _hard_delete_thread(self, thread_id: str):
         elements_query = """SELECT * FROM elements WHERE "threadId" = :id"""
         elements = await self.execute_sql(elements_query, {"id": thread_id})
 
@@ -280,17 +1093,128 @@ class SQLAlchemyDataLayer(BaseDataLayer):
             for elem in filter(lambda x: x["objectKey"], elements):
                 await self.storage_provider.delete_file(object_key=elem["objectKey"])
 
+        parameters: Dict[str, Any] = {"id": thread_id}
+        thread_steps = """"threadId" = :id"""
+        if self.partitioned_steps:
+            created_at = await self.execute_sql(
+                """SELECT "createdAt" FROM threads WHERE "id" = :id""", parameters
+            )
+            if (
+                isinstance(created_at, list)
+                and created_at
+                and created_at[0]["createdAt"]
+            ):
+                # Skip the partitions older than the thread
+                thread_steps += """ AND "createdAt" >= :created_after"""
+                parameters["created_after"] = thread_steps_created_after(
+                    created_at[0]["createdAt"]
+                )
+
         # Delete feedbacks/elements/steps/thread
-        feedbacks_query = """DELETE FROM feedbacks WHERE "forId" IN (SELECT "id" FROM steps WHERE "threadId" = :id)"""
+        feedbacks_query = f"""DELETE FROM feedbacks WHERE "forId" IN (SELECT "id" FROM steps WHERE {thread_steps})"""
         elements_query = """DELETE FROM elements WHERE "threadId" = :id"""
-        steps_query = """DELETE FROM steps WHERE "threadId" = :id"""
+        steps_query = f"""DELETE FROM steps WHERE {thread_steps}"""
         thread_query = """DELETE FROM threads WHERE "id" = :id"""
-        parameters = {"id": thread_id}
         await self.execute_sql(query=feedbacks_query, parameters=parameters)
         await self.execute_sql(query=elements_query, parameters=parameters)
         await self.execute_sql(query=steps_query, parameters=parameters)
         await self.execute_sql(query=thread_query, parameters=parameters)
 
+    ###### Queries ######
+    def _thread_author_query(self) -> str:
+        return f"""SELECT "userIdentifier" FROM threads WHERE "id" = :id {self._not_deleted()}"""
+
+    def _user_threads_query(self) -> str:
+        return f"""
+            SELECT
+                "id" AS thread_id,
+                "createdAt" AS thread_createdat,
+                "name" AS thread_name,
+                "userId" AS user_id,
+                "userIdentifier" AS user_identifier,
+                "tags" AS thread_tags,
+                "metadata" AS thread_metadata
+            FROM threads
+            WHERE ("userId" = :user_id OR "id" = :thread_id) {self._not_deleted()}
+            ORDER BY "createdAt" DESC
+            LIMIT :limit
+        """
+
+    def _step_upsert_query(self, keys: List[str]) -> str:
+        columns = ", ".join(f'"{key}"' for key in keys)
+        values = ", ".join(f":{key}" for key in keys)
+        updates = ", ".join(f'"{key}" = :{key}' for key in keys if key != "id")
+        return f"""
+            INSERT INTO steps ({columns})
+            VALUES ({values})
+            ON CONFLICT ({'"id", "createdAt"' if self.partitioned_steps else "id"}) DO UPDATE
+            SET {updates};
+        """
+
+    def _hot_queries(self) -> List[str]:
+        return [
+            USER_QUERY,
+            self._thread_author_query(),
+            self._user_threads_query(),
+            *(self._step_upsert_query(keys) for keys in HOT_STEP_KEYS),
+        ]
+
+    def _not_deleted(self, alias: str | None = None) -> str:
+        """SQL condition excluding tombstoned threads, when soft delete is enabled."""
+        if not self.soft_delete:
+            return ""
+        column = f'{alias}."deletedAt"' if alias else '"deletedAt"'
+        return f"AND {column} IS NULL"
+
+    @instrumented
+    async def reap_deleted_threads(self, batch_size: int = 100) -> int:
+        """Hard delete up to `batch_size` tombstoned threads per shard, oldest first.
+
+        Returns the number of threads deleted.
+        """
+        query = """
+            SELECT "id" FROM threads
+            WHERE "deletedAt" IS NOT NULL
+            ORDER BY "deletedAt" ASC
+            LIMIT :limit
+        """
+        reaped = 0
+        for shard in range(len(self.engines)):
+            threads = await self._execute_on_shard(shard, query, {"limit": batch_size})
+            if not isinstance(threads, list):
+                continue
+            token = self._shard.set(shard)
+            try:
+                for thread in threads:
+                    thread_id = str(thread["id"])
+                    await self._hard_delete_thread(thread_id)
+                    self._thread_shards.pop(thread_id)
+                    reaped += 1
+            finally:
+                self._shard.reset(token)
+        if self.show_logger and reaped:
+            logger.info(f"SQLAlchemy: reaped {reaped} deleted threads")
+        return reaped
+
+    def start_reaper(self, interval: float = 60.0, batch_size: int = 100):
+        """Hard delete tombstoned threads in the background, `batch_size` per shard every `interval` seconds."""
+        if not self.soft_delete:
+            raise ValueError("start_reaper requires soft_delete=True")
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(
+                self._run_reaper(interval, batch_size)
+            )
+
+    async def _run_reaper(self, interval: float, batch_size: int):
+        while True:
+            try:
+                await self.reap_deleted_threads(batch_size=batch_size)
+            except Exception as e:
+                logger.warn(f"SQLAlchemy: failed to reap deleted threads: {e}")
+            await asyncio.sleep(interval)
+
+    @instrumented
+    @on_shard(lambda self, args: self._user_id_shard(args["filters"].userId))
     async def list_threads(
         self, pagination: Pagination, filters: ThreadFilter
     ) -> PaginatedResponse:
@@ -354,6 +1278,8 @@ class SQLAlchemyDataLayer(BaseDataLayer):
 
     ###### Steps ######
     @queue_until_user_message()
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["step_dict"].get("threadId")))
     async def create_step(self, step_dict: "StepDict"):
         if self.show_logger:
             logger.info(f"SQLAlchemy: create_step, step_id={step_dict.get('id')}")
@@ -370,30 +1296,61 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         }
         parameters["metadata"] = json.dumps(step_dict.get("metadata", {}))
         parameters["generation"] = json.dumps(step_dict.get("generation", {}))
-        columns = ", ".join(f'"{key}"' for key in parameters.keys())
-        values = ", ".join(f":{key}" for key in parameters.keys())
-        updates = ", ".join(
-            f'"{key}" = :{key}' for key in parameters.keys() if key != "id"
+        step_id = str(parameters.get("id"))
+        if self.partitioned_steps and not parameters.get("createdAt"):
+            # Partition key, part of the primary key: updates must keep the
+            # stored one or they would insert a second row
+            parameters["createdAt"] = (
+                await self._get_step_created_at(step_id, parameters.get("threadId"))
+                or await self.get_current_timestamp()
+            )
+
+        # Chainlit re-sends unchanged steps (e.g. when closing them), skip those.
+        fingerprint = self._step_fingerprint(parameters)
+        cached = self._step_fingerprints.get(step_id)
+        if cached is not None and cached[1] == fingerprint:
+            self.step_write_stats["skipped"] += 1
+            if self.metrics_sink is not None:
+                self.metrics_sink.increment(
+                    "step_writes_skipped_total",
+                    1,
+                    {"method": current_operation.get() or "unknown"},
+                )
+            if self.show_logger:
+                logger.info(f"SQLAlchemy: create_step, step_id={step_id} unchanged")
+            return
+
+        result = await self.execute_sql(
+            query=self._step_upsert_query(list(parameters.keys())),
+            parameters=parameters,
         )
-        query = f"""
-            INSERT INTO steps ({columns})
-            VALUES ({values})
-            ON CONFLICT (id) DO UPDATE
-            SET {updates};
-        """
-        await self.execute_sql(query=query, parameters=parameters)
+        if result is not None:
+            self.step_write_stats["written"] += 1
+            self._step_fingerprints.set(
+                step_id, (parameters.get("threadId"), fingerprint)
+            )
+            await self._publish_invalidation(
+                "step", step_id, thread_id=parameters.get("threadId")
+            )
 
     @queue_until_user_message()
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["step_dict"].get("threadId")))
     async def update_step(self, step_dict: "StepDict"):
         if self.show_logger:
             logger.info(f"SQLAlchemy: update_step, step_id={step_dict.get('id')}")
         await self.create_step(step_dict)
 
     @queue_until_user_message()
+    @instrumented
+    @on_shard(lambda self, args: self._locate_step_shard(args["step_id"]))
     async def delete_step(self, step_id: str):
         if self.show_logger:
             logger.info(f"SQLAlchemy: delete_step, step_id={step_id}")
-        # Delete feedbacks/elements/steps
+        thread_id = await self._get_thread_id_by_step(step_id)
+        # Delete feedbacks/elements/steps. With partitioned steps this probes the
+        # primary key index of every partition, finding the step's "createdAt"
+        # first would cost the same.
         feedbacks_query = """DELETE FROM feedbacks WHERE "forId" = :id"""
         elements_query = """DELETE FROM elements WHERE "forId" = :id"""
         steps_query = """DELETE FROM steps WHERE "id" = :id"""
@@ -401,8 +1358,87 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         await self.execute_sql(query=feedbacks_query, parameters=parameters)
         await self.execute_sql(query=elements_query, parameters=parameters)
         await self.execute_sql(query=steps_query, parameters=parameters)
+        self._step_fingerprints.pop(step_id)
+        await self._publish_invalidation("step", step_id, thread_id=thread_id)
+
+    async def _get_step_created_at(
+        self, step_id: str, thread_id: str | None
+    ) -> str | None:
+        query = """SELECT "createdAt" FROM steps WHERE "id" = :id AND "threadId" = :thread_id"""
+        result = await self.execute_sql(
+            query=query, parameters={"id": step_id, "thread_id": thread_id}
+        )
+        if isinstance(result, list) and result:
+            return result[0]["createdAt"]
+        return None
+
+    async def _get_thread_id_by_step(self, step_id: str) -> str | None:
+        """Thread of a step, only looked up when other workers need to be told about it."""
+        if self._invalidation_bus is None:
+            return None
+        fingerprint = self._step_fingerprints.get(step_id)
+        if fingerprint is not None and fingerprint[0] is not None:
+            return fingerprint[0]
+        query = """SELECT "threadId" FROM steps WHERE "id" = :id"""
+        result = await self.execute_sql(query=query, parameters={"id": step_id})
+        if isinstance(result, list) and result:
+            return result[0]["threadId"]
+        return None
+
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["thread_id"]))
+    async def get_step_descendants(
+        self, thread_id: str, step_id: str, max_depth: int | None = None
+    ) -> List["StepDict"]:
+        """Fetch the steps nested under `step_id`, ordered by creation.
+
+        `max_depth` limits how deep to go, 1 returning only direct children.
+        """
+        if self.show_logger:
+            logger.info(
+                f"SQLAlchemy: get_step_descendants, thread_id={thread_id}, step_id={step_id}, max_depth={max_depth}"
+            )
+        parameters: Dict[str, Any] = {"thread_id": thread_id, "step_id": step_id}
+        depth_condition = ""
+        if max_depth is not None:
+            depth_condition = "AND subtree.depth < :max_depth"
+            parameters["max_depth"] = max_depth
+        created_after = ""
+        if self.partitioned_steps:
+            # Steps are created after their parent, skip older partitions
+            created_after = """>= (SELECT "createdAt" FROM steps WHERE "id" = :step_id AND "threadId" = :thread_id)"""
+        not_deleted = ""
+        if self.soft_delete:
+            not_deleted = """WHERE NOT EXISTS (SELECT 1 FROM threads WHERE "id" = :thread_id AND "deletedAt" IS NOT NULL)"""
+        query = f"""
+            WITH RECURSIVE subtree ("id", depth) AS (
+                SELECT "id", 1
+                FROM steps
+                WHERE "threadId" = :thread_id AND "parentId" = :step_id
+                    {'AND "createdAt" ' + created_after if created_after else ""}
+                UNION ALL
+                SELECT child."id", subtree.depth + 1
+                FROM steps child JOIN subtree ON child."parentId" = subtree."id"
+                WHERE child."threadId" = :thread_id {depth_condition}
+                    {'AND child."createdAt" ' + created_after if created_after else ""}
+            )
+            SELECT
+                {STEP_FEEDBACK_COLUMNS}
+            FROM subtree
+                JOIN steps s ON s."id" = subtree."id"
+                    {'AND s."createdAt" ' + created_after if created_after else ""}
+                LEFT JOIN feedbacks f ON s."id" = f."forId"
+            {not_deleted}
+            ORDER BY s."createdAt" ASC
+        """
+        result = await self.execute_sql(query=query, parameters=parameters)
+        if not isinstance(result, list):
+            return []
+        return [self._step_dict_from_row(row) for row in result]
 
     ###### Feedback ######
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["feedback"].threadId))
     async def upsert_feedback(self, feedback: Feedback) -> str:
         if self.show_logger:
             logger.info(f"SQLAlchemy: upsert_feedback, feedback_id={feedback.id}")
@@ -424,17 +1460,110 @@ class SQLAlchemyDataLayer(BaseDataLayer):
             SET {updates};
         """
         await self.execute_sql(query=query, parameters=parameters)
+        await self._publish_invalidation(
+            "step", feedback.forId, thread_id=feedback.threadId
+        )
         return feedback.id
 
+    @instrumented
+    async def get_feedback_stats(
+        self,
+        group_by: Literal["day", "step", "user"] = "day",
+        user_id: str | None = None,
+        step_name: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> List[FeedbackStats]:
+        """Count positive and negative feedback per day, step name or user.
+
+        Days are those of the rated step's creation, `since` (inclusive) and
+        `until` (exclusive) are ISO timestamps or dates bounding it.
+        """
+        if self.show_logger:
+            logger.info(f"SQLAlchemy: get_feedback_stats, group_by={group_by}")
+        if group_by not in FEEDBACK_GROUPS:
+            raise ValueError(f"Cannot group feedback by {group_by}")
+        bucket = FEEDBACK_GROUPS[group_by]
+        filters = {
+            """t."userId" = :user_id""": user_id,
+            """s."name" = :step_name""": step_name,
+            """s."createdAt" >= :since""": since,
+            """s."createdAt" < :until""": until,
+        }
+        conditions = [condition for condition, value in filters.items() if value]
+        if self.soft_delete:
+            conditions.append("""t."deletedAt" IS NULL""")
+        query = f"""
+            SELECT
+                {bucket} AS bucket,
+                SUM(CASE WHEN f."value" > 0 THEN 1 ELSE 0 END) AS positive,
+                SUM(CASE WHEN f."value" > 0 THEN 0 ELSE 1 END) AS negative
+            FROM feedbacks f
+                JOIN steps s ON s."id" = f."forId"
+                JOIN threads t ON t."id" = f."threadId"
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            GROUP BY {bucket}
+        """
+        parameters = {
+            "user_id": user_id,
+            "step_name": step_name,
+            "since": since,
+            "until": until,
+        }
+        shards = (
+            [await self._user_id_shard(user_id)]
+            if user_id
+            else range(len(self.engines))
+        )
+        results = await asyncio.gather(
+            *(self._execute_on_shard(shard, query, parameters) for shard in shards)
+        )
+
+        # Users live on a single shard, but days and step names span them all
+        counts: Dict[str | None, List[int]] = {}
+        for result in results:
+            if not isinstance(result, list):
+                continue
+            for row in result:
+                count = counts.setdefault(row["bucket"], [0, 0])
+                count[0] += int(row["positive"] or 0)
+                count[1] += int(row["negative"] or 0)
+        return [
+            FeedbackStats(
+                bucket=key,
+                positive=positive,
+                negative=negative,
+                total=positive + negative,
+                positive_rate=positive / (positive + negative),
+            )
+            for key, (positive, negative) in sorted(
+                counts.items(), key=lambda item: (item[0] is None, item[0] or "")
+            )
+        ]
+
+    @instrumented
+    @on_shard(lambda self, args: self._located_shard("feedbacks", args["feedback_id"]))
     async def delete_feedback(self, feedback_id: str) -> bool:
         if self.show_logger:
             logger.info(f"SQLAlchemy: delete_feedback, feedback_id={feedback_id}")
+        feedback = None
+        if self._invalidation_bus is not None:
+            feedback = await self.execute_sql(
+                query="""SELECT "forId", "threadId" FROM feedbacks WHERE "id" = :feedback_id""",
+                parameters={"feedback_id": feedback_id},
+            )
         query = """DELETE FROM feedbacks WHERE "id" = :feedback_id"""
         parameters = {"feedback_id": feedback_id}
         await self.execute_sql(query=query, parameters=parameters)
+        if isinstance(feedback, list) and feedback:
+            await self._publish_invalidation(
+                "step", feedback[0]["forId"], thread_id=feedback[0]["threadId"]
+            )
         return True
 
     ###### Elements ######
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["thread_id"]))
     async def get_element(
         self, thread_id: str, element_id: str
     ) -> Optional["ElementDict"]:
@@ -442,35 +1571,74 @@ class SQLAlchemyDataLayer(BaseDataLayer):
             logger.info(
                 f"SQLAlchemy: get_element, thread_id={thread_id}, element_id={element_id}"
             )
-        query = """SELECT * FROM elements WHERE "threadId" = :thread_id AND "id" = :element_id"""
-        parameters = {"thread_id": thread_id, "element_id": element_id}
-        element: List[Dict[str, Any]] | int | None = await self.execute_sql(
-            query=query, parameters=parameters
-        )
-        if isinstance(element, list) and element:
-            element_dict: Dict[str, Any] = element[0]
-            return ElementDict(
-                id=element_dict["id"],
-                threadId=element_dict.get("threadId"),
-                type=element_dict["type"],
-                chainlitKey=element_dict.get("chainlitKey"),
-                url=element_dict.get("url"),
-                objectKey=element_dict.get("objectKey"),
-                name=element_dict["name"],
-                props=json.loads(element_dict.get("props", "{}")),
-                display=element_dict["display"],
-                size=element_dict.get("size"),
-                language=element_dict.get("language"),
-                page=element_dict.get("page"),
-                autoPlay=element_dict.get("autoPlay"),
-                playerConfig=element_dict.get("playerConfig"),
-                forId=element_dict.get("forId"),
-                mime=element_dict.get("mime"),
+        elements = await self.get_elements(thread_id, [element_id])
+        return elements[0] if elements else None
+
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["thread_id"]))
+    async def get_elements(
+        self, thread_id: str, element_ids: List[str]
+    ) -> List["ElementDict"]:
+        """Fetch several elements of a thread in a single query, in the order of `element_ids`."""
+        if self.show_logger:
+            logger.info(
+                f"SQLAlchemy: get_elements, thread_id={thread_id}, element_ids={element_ids}"
             )
-        else:
-            return None
+        if not element_ids:
+            return []
+        parameters: Dict[str, Any] = {
+            f"element_id_{i}": element_id for i, element_id in enumerate(element_ids)
+        }
+        placeholders = ", ".join(f":{key}" for key in parameters.keys())
+        parameters["thread_id"] = thread_id
+        not_deleted = ""
+        if self.soft_delete:
+            not_deleted = """AND NOT EXISTS (SELECT 1 FROM threads WHERE "id" = :thread_id AND "deletedAt" IS NOT NULL)"""
+        query = f"""
+            SELECT
+                "id", "threadId", "type", "chainlitKey", "url", "objectKey", "name",
+                "props", "display", "size", "language", "page", "forId", "mime"
+            FROM elements
+            WHERE "threadId" = :thread_id AND "id" IN ({placeholders}) {not_deleted}
+        """
+        result = await self.execute_sql(query=query, parameters=parameters)
+        if not isinstance(result, list):
+            return []
+
+        elements_by_id = {
+            str(element_dict["id"]): element_dict for element_dict in result
+        }
+        elements: List[ElementDict] = []
+        for element_id in element_ids:
+            element_dict = elements_by_id.get(element_id)
+            if element_dict is None:
+                continue
+            props = element_dict.get("props")
+            elements.append(
+                ElementDict(
+                    id=element_dict["id"],
+                    threadId=element_dict.get("threadId"),
+                    type=element_dict["type"],
+                    chainlitKey=element_dict.get("chainlitKey"),
+                    url=element_dict.get("url"),
+                    objectKey=element_dict.get("objectKey"),
+                    name=element_dict["name"],
+                    props=json.loads(props) if isinstance(props, str) else props or {},
+                    display=element_dict["display"],
+                    size=element_dict.get("size"),
+                    language=element_dict.get("language"),
+                    page=element_dict.get("page"),
+                    autoPlay=element_dict.get("autoPlay"),
+                    playerConfig=element_dict.get("playerConfig"),
+                    forId=element_dict.get("forId"),
+                    mime=element_dict.get("mime"),
+                )
+            )
+        return elements
 
     @queue_until_user_message()
+    @instrumented
+    @on_shard(lambda self, args: self._thread_shard(args["element"].thread_id))
     async def create_element(self, element: "Element"):
         if self.show_logger:
             logger.info(f"SQLAlchemy: create_element, element_id = {element.id}")
@@ -531,8 +1699,11 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         placeholders = ", ".join(f":{column}" for column in element_dict_cleaned.keys())
         query = f"INSERT INTO elements ({columns}) VALUES ({placeholders})"
         await self.execute_sql(query=query, parameters=element_dict_cleaned)
+        await self._publish_invalidation("thread", element.thread_id)
 
     @queue_until_user_message()
+    @instrumented
+    @on_shard(lambda self, args: self._element_shard(args))
     async def delete_element(self, element_id: str, thread_id: str | None = None):
         if self.show_logger:
             logger.info(f"SQLAlchemy: delete_element, element_id={element_id}")
@@ -552,29 +1723,63 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         parameters = {"id": element_id}
 
         await self.execute_sql(query=query, parameters=parameters)
+        element_thread_id = thread_id or (
+            elements[0]["threadId"]
+            if isinstance(elements, list) and len(elements) > 0
+            else None
+        )
+        if element_thread_id:
+            await self._publish_invalidation("thread", element_thread_id)
+
+    def _step_dict_from_row(self, step_feedback: Dict[str, Any]) -> "StepDict":
+        feedback = None
+        if step_feedback["feedback_value"] is not None:
+            feedback = FeedbackDict(
+                forId=step_feedback["step_id"],
+                id=step_feedback.get("feedback_id"),
+                value=step_feedback["feedback_value"],
+                comment=step_feedback.get("feedback_comment"),
+            )
+        return StepDict(
+            id=step_feedback["step_id"],
+            name=step_feedback["step_name"],
+            type=step_feedback["step_type"],
+            threadId=step_feedback["step_threadid"],
+            parentId=step_feedback.get("step_parentid"),
+            streaming=step_feedback.get("step_streaming", False),
+            waitForAnswer=step_feedback.get("step_waitforanswer"),
+            isError=step_feedback.get("step_iserror"),
+            metadata=(
+                step_feedback["step_metadata"]
+                if step_feedback.get("step_metadata") is not None
+                else {}
+            ),
+            tags=step_feedback.get("step_tags"),
+            input=(
+                step_feedback.get("step_input", "")
+                if step_feedback.get("step_showinput") not in [None, "false"]
+                else ""
+            ),
+            output=step_feedback.get("step_output", ""),
+            createdAt=step_feedback.get("step_createdat"),
+            start=step_feedback.get("step_start"),
+            end=step_feedback.get("step_end"),
+            generation=step_feedback.get("step_generation"),
+            showInput=step_feedback.get("step_showinput"),
+            language=step_feedback.get("step_language"),
+            feedback=feedback,
+        )
 
+    @instrumented
+    @on_shard(lambda self, args: self._user_threads_shard(args))
     async def get_all_user_threads(
         self, user_id: str | None = None, thread_id: str | None = None
     ) -> List[ThreadDict] | None:
         """Fetch all user threads up to self.user_thread_limit, or one thread by id if thread_id is provided."""
         if self.show_logger:
             logger.info("SQLAlchemy: get_all_user_threads")
-        user_threads_query = """
-            SELECT
-                "id" AS thread_id,
-                "createdAt" AS thread_createdat,
-                "name" AS thread_name,
-                "userId" AS user_id,
-                "userIdentifier" AS user_identifier,
-                "tags" AS thread_tags,
-                "metadata" AS thread_metadata
-            FROM threads
-            WHERE "userId" = :user_id OR "id" = :thread_id
-            ORDER BY "createdAt" DESC
-            LIMIT :limit
-        """
         user_threads = await self.execute_sql(
-            query=user_threads_query,
+            query=self._user_threads_query(),
             parameters={
                 "user_id": user_id,
                 "limit": self.user_thread_limit,
@@ -592,35 +1797,24 @@ class SQLAlchemyDataLayer(BaseDataLayer):
                 + "')"
             )
 
+        steps_parameters: Dict[str, Any] = {}
+        created_after = ""
+        threads_created_at = [thread["thread_createdat"] for thread in user_threads]
+        if self.partitioned_steps and all(threads_created_at):
+            # Skip the partitions older than the oldest thread
+            created_after = """AND s."createdAt" >= :created_after"""
+            steps_parameters["created_after"] = thread_steps_created_after(
+                min(threads_created_at)
+            )
         steps_feedbacks_query = f"""
             SELECT
-                s."id" AS step_id,
-                s."name" AS step_name,
-                s."type" AS step_type,
-                s."threadId" AS step_threadid,
-                s."parentId" AS step_parentid,
-                s."streaming" AS step_streaming,
-                s."waitForAnswer" AS step_waitforanswer,
-                s."isError" AS step_iserror,
-                s."metadata" AS step_metadata,
-                s."tags" AS step_tags,
-                s."input" AS step_input,
-                s."output" AS step_output,
-                s."createdAt" AS step_createdat,
-                s."start" AS step_start,
-                s."end" AS step_end,
-                s."generation" AS step_generation,
-                s."showInput" AS step_showinput,
-                s."language" AS step_language,
-                f."value" AS feedback_value,
-                f."comment" AS feedback_comment,
-                f."id" AS feedback_id
+                {STEP_FEEDBACK_COLUMNS}
             FROM steps s LEFT JOIN feedbacks f ON s."id" = f."forId"
-            WHERE s."threadId" IN {thread_ids}
+            WHERE s."threadId" IN {thread_ids} {created_after}
             ORDER BY s."createdAt" ASC
         """
         steps_feedbacks = await self.execute_sql(
-            query=steps_feedbacks_query, parameters={}
+            query=steps_feedbacks_query, parameters=steps_parameters
         )
 
         elements_query = f"""
@@ -647,6 +1841,7 @@ class SQLAlchemyDataLayer(BaseDataLayer):
         for thread in user_threads:
             thread_id = thread["thread_id"]
             if thread_id is not None:
+                self._thread_shards.set(thread_id, self._shard.get())
                 thread_dicts[thread_id] = ThreadDict(
                     id=thread_id,
                     createdAt=thread["thread_createdat"],
@@ -663,44 +1858,7 @@ class SQLAlchemyDataLayer(BaseDataLayer):
             for step_feedback in steps_feedbacks:
                 thread_id = step_feedback["step_threadid"]
                 if thread_id is not None:
-                    feedback = None
-                    if step_feedback["feedback_value"] is not None:
-                        feedback = FeedbackDict(
-                            forId=step_feedback["step_id"],
-                            id=step_feedback.get("feedback_id"),
-                            value=step_feedback["feedback_value"],
-                            comment=step_feedback.get("feedback_comment"),
-                        )
-                    step_dict = StepDict(
-                        id=step_feedback["step_id"],
-                        name=step_feedback["step_name"],
-                        type=step_feedback["step_type"],
-                        threadId=thread_id,
-                        parentId=step_feedback.get("step_parentid"),
-                        streaming=step_feedback.get("step_streaming", False),
-                        waitForAnswer=step_feedback.get("step_waitforanswer"),
-                        isError=step_feedback.get("step_iserror"),
-                        metadata=(
-                            step_feedback["step_metadata"]
-                            if step_feedback.get("step_metadata") is not None
-                            else {}
-                        ),
-                        tags=step_feedback.get("step_tags"),
-                        input=(
-                            step_feedback.get("step_input", "")
-                            if step_feedback.get("step_showinput")
-                            not in [None, "false"]
-                            else ""
-                        ),
-                        output=step_feedback.get("step_output", ""),
-                        createdAt=step_feedback.get("step_createdat"),
-                        start=step_feedback.get("step_start"),
-                        end=step_feedback.get("step_end"),
-                        generation=step_feedback.get("step_generation"),
-                        showInput=step_feedback.get("step_showinput"),
-                        language=step_feedback.get("step_language"),
-                        feedback=feedback,
-                    )
+                    step_dict = self._step_dict_from_row(step_feedback)
                     # Append the step to the steps list of the corresponding ThreadDict
                     thread_dicts[thread_id]["steps"].append(step_dict)
 
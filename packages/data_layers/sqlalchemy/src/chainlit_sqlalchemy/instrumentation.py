@@ -0,0 +1,78 @@
+import functools
+import time
+from contextvars import ContextVar
+from typing import Any, Callable
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Name of the outermost data layer method being executed, e.g. "list_threads"
+current_operation: ContextVar[str | None] = ContextVar(
+    "chainlit_sqlalchemy_operation", default=None
+)
+
+OPERATION_OPTION = "chainlit_operation"
+
+StatementCallback = Callable[[str, float, str, Any, Any], None]
+
+
+def instrumented(method):
+    """Tag the database statements issued by the decorated method with its name and time it."""
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if current_operation.get() is not None:
+            # Attribute nested calls to the outermost method
+            return await method(self, *args, **kwargs)
+
+        token = current_operation.set(method.__name__)
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            current_operation.reset(token)
+            if self.metrics_sink is not None:
+                self.metrics_sink.observe(
+                    "operation_duration_seconds",
+                    time.perf_counter() - start,
+                    {"method": method.__name__},
+                )
+
+    return wrapper
+
+
+def operation_execution_options() -> dict:
+    """Execution options carrying the current operation to the cursor hooks."""
+    return {OPERATION_OPTION: current_operation.get() or "unknown"}
+
+
+def install_statement_hooks(engine: AsyncEngine, callback: StatementCallback):
+    """Time every statement executed by `engine`.
+
+    `callback` receives the operation name, the elapsed time in seconds, the
+    statement, its parameters and the SQLAlchemy execution context.
+    """
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("chainlit_statement_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        elapsed = time.perf_counter() - conn.info["chainlit_statement_start"].pop()
+        operation = (
+            context.execution_options.get(OPERATION_OPTION, "unknown")
+            if context is not None
+            else "unknown"
+        )
+        callback(operation, elapsed, statement, parameters, context)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("chainlit_statement_start"):
+            connection.info["chainlit_statement_start"].pop()
@@ -0,0 +1,130 @@
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, List, Literal
+
+from chainlit.logger import logger
+from sqlalchemy.engine import make_url
+
+InvalidationEntity = Literal["user", "thread", "step", "all"]
+
+
+@dataclass
+class InvalidationEvent:
+    entity: InvalidationEntity
+    id: str
+    thread_id: str | None = None
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, payload: str) -> "InvalidationEvent":
+        return cls(**json.loads(payload))
+
+
+InvalidationCallback = Callable[[InvalidationEvent], None]
+
+
+class BaseInvalidationBus(ABC):
+    """Broadcasts cache invalidation events between data layer instances."""
+
+    def __init__(self):
+        self._callbacks: List[InvalidationCallback] = []
+
+    def subscribe(self, callback: InvalidationCallback):
+        self._callbacks.append(callback)
+
+    def _dispatch(self, event: InvalidationEvent):
+        for callback in self._callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.warning(f"Invalidation callback failed: {e}")
+
+    async def start(self):
+        """Start receiving events. Must be idempotent."""
+
+    @abstractmethod
+    async def publish(self, event: InvalidationEvent):
+        pass
+
+    async def close(self):
+        pass
+
+
+class InMemoryInvalidationBus(BaseInvalidationBus):
+    """Delivers events to subscribers within the current process, for tests and single-worker setups."""
+
+    async def publish(self, event: InvalidationEvent):
+        self._dispatch(event)
+
+
+class PostgresInvalidationBus(BaseInvalidationBus):
+    """Invalidation bus on top of Postgres LISTEN/NOTIFY.
+
+    Uses a dedicated asyncpg connection (outside of the SQLAlchemy pool) to
+    listen on `channel`. When that connection is lost, subscribers receive an
+    `all` event so they can drop their caches until it is re-established.
+    """
+
+    def __init__(self, conninfo: str, channel: str = "chainlit_invalidation"):
+        super().__init__()
+        # Accept SQLAlchemy style URLs, e.g. postgresql+asyncpg://...
+        self._dsn = (
+            make_url(conninfo)
+            .set(drivername="postgresql")
+            .render_as_string(hide_password=False)
+        )
+        self.channel = channel
+        self._connection: Any = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        if self._connection is not None and not self._connection.is_closed():
+            return
+        async with self._lock:
+            if self._connection is not None and not self._connection.is_closed():
+                return
+
+            import asyncpg  # type: ignore
+
+            connection = await asyncpg.connect(self._dsn)
+            await connection.add_listener(self.channel, self._on_notification)
+            connection.add_termination_listener(self._on_termination)
+            self._connection = connection
+            # Anything may have changed while we were not listening
+            self._dispatch(InvalidationEvent(entity="all", id=""))
+
+    async def publish(self, event: InvalidationEvent):
+        await self.start()
+        async with self._lock:
+            await self._connection.execute(
+                "SELECT pg_notify($1, $2)", self.channel, event.to_json()
+            )
+
+    async def close(self):
+        async with self._lock:
+            if self._connection is not None and not self._connection.is_closed():
+                await self._connection.remove_listener(
+                    self.channel, self._on_notification
+                )
+                await self._connection.close()
+            self._connection = None
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        if pid == connection.get_server_pid():
+            # Our own notification, already applied locally by the publisher
+            return
+        try:
+            event = InvalidationEvent.from_json(payload)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring malformed invalidation event {payload!r}: {e}")
+            return
+        self._dispatch(event)
+
+    def _on_termination(self, connection):
+        logger.warning("PostgresInvalidationBus: listener connection lost")
+        self._connection = None
+        self._dispatch(InvalidationEvent(entity="all", id=""))
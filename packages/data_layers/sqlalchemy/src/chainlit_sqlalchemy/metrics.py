@@ -0,0 +1,117 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+Labels = Dict[str, str]
+
+
+class BaseMetricsSink(ABC):
+    """Receives data layer metrics.
+
+    Metric names are unprefixed (e.g. `statement_duration_seconds`), adapters
+    are expected to add their own namespace.
+    """
+
+    @abstractmethod
+    def observe(self, name: str, value: float, labels: Labels):
+        """Record a sample of a distribution (histogram)."""
+
+    @abstractmethod
+    def increment(self, name: str, value: float, labels: Labels):
+        """Add `value` to a monotonic counter."""
+
+
+def _key(labels: Labels) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted(labels.items()))
+
+
+class InMemoryMetricsSink(BaseMetricsSink):
+    """Keeps every sample in memory, for tests and debugging."""
+
+    def __init__(self):
+        self.samples: Dict[str, Dict[Tuple, List[float]]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+        self.counters: Dict[str, Dict[Tuple, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+
+    def observe(self, name: str, value: float, labels: Labels):
+        self.samples[name][_key(labels)].append(value)
+
+    def increment(self, name: str, value: float, labels: Labels):
+        self.counters[name][_key(labels)] += value
+
+    def get_samples(self, name: str, **labels: str) -> List[float]:
+        return list(self.samples[name].get(_key(labels), []))
+
+    def get_counter(self, name: str, **labels: str) -> float:
+        return self.counters[name].get(_key(labels), 0)
+
+
+class PrometheusMetricsSink(BaseMetricsSink):
+    """Exports metrics through `prometheus_client`."""
+
+    def __init__(self, namespace: str = "chainlit_sqlalchemy", registry: Any = None):
+        try:
+            import prometheus_client  # type: ignore
+        except ImportError as e:
+            raise ImportError(
+                "PrometheusMetricsSink requires prometheus_client, install it with `pip install prometheus-client`"
+            ) from e
+
+        self._prometheus = prometheus_client
+        self.namespace = namespace
+        self.registry = registry or prometheus_client.REGISTRY
+        self._metrics: Dict[str, Any] = {}
+
+    def _metric(self, kind: str, name: str, labels: Labels):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric_class = getattr(self._prometheus, kind)
+            metric = metric_class(
+                name,
+                name.replace("_", " "),
+                labelnames=sorted(labels.keys()),
+                namespace=self.namespace,
+                registry=self.registry,
+            )
+            self._metrics[name] = metric
+        return metric.labels(**labels) if labels else metric
+
+    def observe(self, name: str, value: float, labels: Labels):
+        self._metric("Histogram", name, labels).observe(value)
+
+    def increment(self, name: str, value: float, labels: Labels):
+        self._metric("Counter", name, labels).inc(value)
+
+
+class OpenTelemetryMetricsSink(BaseMetricsSink):
+    """Exports metrics through the OpenTelemetry metrics API."""
+
+    def __init__(self, meter: Any = None, prefix: str = "chainlit_sqlalchemy."):
+        if meter is None:
+            try:
+                from opentelemetry import metrics  # type: ignore
+            except ImportError as e:
+                raise ImportError(
+                    "OpenTelemetryMetricsSink requires opentelemetry-api, install it with `pip install opentelemetry-api`"
+                ) from e
+            meter = metrics.get_meter("chainlit_sqlalchemy")
+
+        self.meter = meter
+        self.prefix = prefix
+        self._instruments: Dict[str, Any] = {}
+
+    def _instrument(self, kind: str, name: str):
+        instrument = self._instruments.get(name)
+        if instrument is None:
+            instrument = getattr(self.meter, kind)(self.prefix + name)
+            self._instruments[name] = instrument
+        return instrument
+
+    def observe(self, name: str, value: float, labels: Labels):
+        self._instrument("create_histogram", name).record(value, attributes=labels)
+
+    def increment(self, name: str, value: float, labels: Labels):
+        self._instrument("create_counter", name).add(value, attributes=labels)
@@ -0,0 +1,46 @@
+import re
+from datetime import date, datetime
+
+# Monthly partitions of the steps table, see partitioned_steps.sql
+PARTITION_PATTERN = re.compile(r"^steps_p(\d{4})_(\d{2})$")
+
+
+def month_of(value: date | datetime | str) -> date:
+    """First day of the month of a date or ISO timestamp."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value[:10])
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def thread_steps_created_after(thread_created_at: str) -> str:
+    """Lower bound of the "createdAt" of a thread's steps, skipping older partitions.
+
+    Steps may be stamped a little before their thread is written, so the bound
+    is the start of the previous month.
+    """
+    return f"{add_months(month_of(thread_created_at), -1):%Y-%m}"
+
+
+def partition_name(month: date) -> str:
+    return f"steps_p{month:%Y_%m}"
+
+
+def partition_month(name: str) -> date | None:
+    match = PARTITION_PATTERN.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def create_partition_query(month: date) -> str:
+    # "createdAt" holds ISO timestamps, which sort like the month prefixes
+    return f"""
+        CREATE TABLE IF NOT EXISTS {partition_name(month)}
+        PARTITION OF steps
+        FOR VALUES FROM ('{month:%Y-%m}') TO ('{add_months(month, 1):%Y-%m}')
+    """
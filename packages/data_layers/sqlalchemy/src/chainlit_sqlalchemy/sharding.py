@@ -0,0 +1,62 @@
+import bisect
+import functools
+import hashlib
+import inspect
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping keys onto shard indexes.
+
+    Each shard is placed on the ring `replicas` times so that adding a shard
+    only moves roughly `1 / len(shards)` of the keys.
+    """
+
+    def __init__(self, shards: int, replicas: int = 128):
+        self.replicas = replicas
+        self._ring: List[Tuple[int, int]] = []
+        for shard in range(shards):
+            self.add_shard(shard)
+
+    def add_shard(self, shard: int):
+        for replica in range(self.replicas):
+            bisect.insort(self._ring, (_hash(f"{shard}:{replica}"), shard))
+
+    def get_shard(self, key: str) -> int:
+        index = bisect.bisect(self._ring, (_hash(key), -1)) % len(self._ring)
+        return self._ring[index][1]
+
+
+ShardResolver = Callable[[Any, Dict[str, Any]], Awaitable[int]]
+
+
+def on_shard(resolve: ShardResolver):
+    """Run the decorated data layer method against the shard returned by `resolve`.
+
+    `resolve` receives the data layer and the bound method arguments by name.
+    Routing is skipped altogether when the data layer has a single engine.
+    """
+
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            if len(self.engines) == 1:
+                return await method(self, *args, **kwargs)
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            shard = await resolve(self, bound.arguments)
+            token = self._shard.set(shard)
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                self._shard.reset(token)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,67 @@
+import asyncio
+import copy
+import functools
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into a single execution.
+
+    Callers arriving while a call for their key is in flight await its outcome
+    instead of starting their own: they all get its result, or all get its
+    exception.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Run `fn` unless a call for `key` is in flight.
+
+        Returns the result and whether it is shared with another caller.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            # Shielded, so that a caller going away does not cancel the others
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        task.add_done_callback(functools.partial(self._forget, key))
+        return await asyncio.shield(task), False
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieve it, in case every caller went away
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+def single_flight(method):
+    """Coalesce concurrent calls of the decorated data layer method with the same arguments.
+
+    Callers joining an in-flight call get a deep copy of its result, so that
+    they can't alter each other's. Calls started before a write, i.e. under an
+    older cache generation, are not joined as they may miss it.
+    """
+
+    @functools.wraps(method)
+    async def wrapper(self, *args: Any, **kwargs: Any):
+        key = (
+            method.__name__,
+            self._cache_generation,
+            args,
+            tuple(sorted(kwargs.items())),
+        )
+        result, shared = await self._single_flight.do(
+            key, lambda: method(self, *args, **kwargs)
+        )
+        return copy.deepcopy(result) if shared else result
+
+    return wrapper
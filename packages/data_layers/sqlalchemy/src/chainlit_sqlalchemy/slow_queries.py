@@ -0,0 +1,148 @@
+import asyncio
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Set
+
+from chainlit.logger import logger
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .cache import LRUCache
+from .instrumentation import OPERATION_OPTION
+
+
+@dataclass
+class SlowQuery:
+    operation: str
+    duration: float
+    statement: str
+    parameters: Any
+    plan: str | None = None
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """Keep the shape of statement parameters, but not their values."""
+    if isinstance(parameters, dict):
+        return {key: "?" for key in parameters}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return [redact_parameters(item) for item in parameters]
+        return ["?"] * len(parameters)
+    return parameters
+
+
+# Literals inlined in statements, e.g. the thread ids of get_all_user_threads
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LITERAL_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+def normalize_statement(statement: str) -> str:
+    """Statement with its literals replaced by `?`, to tell statements apart."""
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _LITERAL_LIST.sub("(?)", statement)
+    return " ".join(statement.split())
+
+
+class SlowQueryRecorder:
+    """Logs statements slower than `threshold` seconds along with their query plan.
+
+    Plans are captured in the background with `EXPLAIN` (Postgres) or
+    `EXPLAIN QUERY PLAN` (SQLite), for read statements only, at most once per
+    statement (literals aside) every `explain_interval` seconds and with at
+    most `max_concurrent_explains` running, so that a slow database is not
+    loaded further.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        explain: bool = True,
+        explain_interval: float = 300.0,
+        max_records: int = 100,
+        max_concurrent_explains: int = 1,
+    ):
+        self.threshold = threshold
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.max_concurrent_explains = max_concurrent_explains
+        self.records: Deque[SlowQuery] = deque(maxlen=max_records)
+        self._last_explained: LRUCache[str, float] = LRUCache(1000)
+        self._pending: Set[asyncio.Task] = set()
+
+    def record(
+        self,
+        engine: AsyncEngine,
+        operation: str,
+        elapsed: float,
+        statement: str,
+        parameters: Any,
+    ) -> SlowQuery | None:
+        if elapsed < self.threshold or operation == "explain":
+            return None
+
+        slow_query = SlowQuery(
+            operation=operation,
+            duration=elapsed,
+            statement=" ".join(statement.split()),
+            parameters=redact_parameters(parameters),
+        )
+        self.records.append(slow_query)
+        logger.warning(
+            f"Slow query in {operation} ({elapsed * 1000:.0f} ms): {slow_query.statement} parameters={slow_query.parameters}"
+        )
+
+        if self.explain and self._should_explain(statement):
+            try:
+                task = asyncio.get_running_loop().create_task(
+                    self._explain(engine, slow_query, statement, parameters)
+                )
+            except RuntimeError:
+                return slow_query
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+        return slow_query
+
+    async def drain(self):
+        """Wait for pending query plans."""
+        while self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def _should_explain(self, statement: str) -> bool:
+        if statement.lstrip().split(None, 1)[0].upper() not in ("SELECT", "WITH"):
+            return False
+        if len(self._pending) >= self.max_concurrent_explains:
+            return False
+        normalized = normalize_statement(statement)
+        now = time.monotonic()
+        last_explained = self._last_explained.get(normalized)
+        if last_explained is not None and now - last_explained < self.explain_interval:
+            return False
+        self._last_explained.set(normalized, now)
+        return True
+
+    async def _explain(
+        self, engine: AsyncEngine, slow_query: SlowQuery, statement: str, parameters
+    ):
+        prefix = (
+            "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+        )
+        try:
+            async with engine.connect() as conn:
+                result = await conn.exec_driver_sql(
+                    prefix + statement,
+                    parameters,
+                    execution_options={OPERATION_OPTION: "explain"},
+                )
+                plan = "\n".join(
+                    " ".join(str(value) for value in row) for row in result.fetchall()
+                )
+        except Exception as e:
+            logger.warning(f"Failed to explain slow query: {e}")
+            return
+
+        slow_query.plan = plan
+        logger.warning(f"Plan of slow query in {slow_query.operation}:\n{plan}")
@@ -0,0 +1,135 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from chainlit.logger import logger
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+DEFAULT_SQLITE_PRAGMAS: Dict[str, Any] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # Negative values are KiB
+    "busy_timeout": 5000,
+}
+
+
+def set_sqlite_pragmas(engine: AsyncEngine, pragmas: Dict[str, Any]):
+    """Apply `pragmas` to every new DBAPI connection of `engine`."""
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+
+def is_write_query(query: str) -> bool:
+    return query.lstrip().split(None, 1)[0].upper() in (
+        "INSERT",
+        "UPDATE",
+        "DELETE",
+        "REPLACE",
+    )
+
+
+@dataclass
+class _WriteJob:
+    query: str
+    parameters: dict
+    execution_options: dict
+    future: "asyncio.Future[int | None]" = field(repr=False)
+
+
+class SQLiteWriteQueue:
+    """Serializes writes through a single task, committing queued writes in batches.
+
+    SQLite allows one writer at a time; funnelling every write through one
+    connection avoids "database is locked" errors between concurrent sessions
+    and lets readers (in WAL mode) proceed without waiting on writers.
+    """
+
+    def __init__(
+        self, session_factory: async_sessionmaker[AsyncSession], batch_size: int = 64
+    ):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self._queue: asyncio.Queue[_WriteJob | None] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def submit(
+        self, query: str, parameters: dict, execution_options: dict | None = None
+    ) -> int | None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        future: asyncio.Future[int | None] = asyncio.get_running_loop().create_future()
+        await self._queue.put(
+            _WriteJob(query, parameters, execution_options or {}, future)
+        )
+        return await future
+
+    async def close(self):
+        if self._task is None or self._task.done():
+            return
+        await self._queue.put(None)
+        await self._task
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            stop = False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                next_job = self._queue.get_nowait()
+                if next_job is None:
+                    stop = True
+                    break
+                batch.append(next_job)
+            await self._execute_batch(batch)
+            if stop:
+                return
+
+    async def _execute_batch(self, batch: List[_WriteJob]):
+        if len(batch) > 1:
+            try:
+                rowcounts: List[int] = []
+                async with self._session_factory() as session:
+                    async with session.begin():
+                        for job in batch:
+                            result = await session.execute(
+                                text(job.query),
+                                job.parameters,
+                                execution_options=job.execution_options,
+                            )
+                            rowcounts.append(result.rowcount)  # pyright: ignore reportAttributeAccessIssue
+            except Exception as e:
+                # Retry one by one so that a single failing write does not fail the batch
+                logger.debug(f"SQLite write batch failed, retrying one by one: {e}")
+            else:
+                for job, rowcount in zip(batch, rowcounts):
+                    if not job.future.done():
+                        job.future.set_result(rowcount)
+                return
+
+        for job in batch:
+            result = await self._execute_one(job)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    async def _execute_one(self, job: _WriteJob) -> int | None:
+        async with self._session_factory() as session:
+            try:
+                async with session.begin():
+                    result = await session.execute(
+                        text(job.query),
+                        job.parameters,
+                        execution_options=job.execution_options,
+                    )
+                return result.rowcount  # pyright: ignore reportAttributeAccessIssue
+            except Exception as e:
+                logger.warn(f"An error occurred: {e}")
+                return None
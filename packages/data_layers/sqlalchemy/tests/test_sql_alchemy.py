@@ -1,20 +1,36 @@
+import asyncio
 import uuid
+from datetime import date
 from pathlib import Path
 
 import pytest
 from chainlit import User
 from chainlit.data.storage_clients.base import BaseStorageClient
 from chainlit.element import Text
-from chainlit_sqlalchemy import SQLAlchemyDataLayer
+from chainlit.step import Step
+from chainlit.types import Feedback, Pagination, ThreadFilter
+from chainlit_sqlalchemy import (
+    InMemoryInvalidationBus,
+    InMemoryMetricsSink,
+    SlowQueryRecorder,
+    SQLAlchemyDataLayer,
+)
+from chainlit_sqlalchemy.data_layer import HOT_STEP_KEYS
+from chainlit_sqlalchemy.partitioning import (
+    add_months,
+    create_partition_query,
+    month_of,
+    partition_month,
+    partition_name,
+    thread_steps_created_after,
+)
+from chainlit_sqlalchemy.singleflight import SingleFlight
+from chainlit_sqlalchemy.slow_queries import normalize_statement
 from sqlalchemy import text
-from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
 
-@pytest.fixture
-async def data_layer(chainlit_mock_storage_client: BaseStorageClient, tmp_path: Path):
-    db_file = tmp_path / "test_db.sqlite"
-    conninfo = f"sqlite+aiosqlite:///{db_file}"
-
+async def create_schema(conninfo: str):
     # Create async engine
     engine = create_async_engine(conninfo)
 
@@ -45,6 +61,7 @@ async def data_layer(chainlit_mock_storage_client: BaseStorageClient, tmp_path:
                     "userIdentifier" TEXT,
                     "tags" TEXT[],
                     "metadata" JSONB,
+                    "deletedAt" TEXT,
                     FOREIGN KEY ("userId") REFERENCES users("id") ON DELETE CASCADE
                 );
         """
@@ -96,7 +113,8 @@ async def data_layer(chainlit_mock_storage_client: BaseStorageClient, tmp_path:
                     "page" INT,
                     "language" TEXT,
                     "forId" UUID,
-                    "mime" TEXT
+                    "mime" TEXT,
+                    "props" JSONB
                 );
         """
             )
@@ -116,6 +134,15 @@ async def data_layer(chainlit_mock_storage_client: BaseStorageClient, tmp_path:
             )
         )
 
+    await engine.dispose()
+
+
+@pytest.fixture
+async def data_layer(chainlit_mock_storage_client: BaseStorageClient, tmp_path: Path):
+    db_file = tmp_path / "test_db.sqlite"
+    conninfo = f"sqlite+aiosqlite:///{db_file}"
+    await create_schema(conninfo)
+
     # Create SQLAlchemyDataLayer instance
     data_layer = SQLAlchemyDataLayer(
         conninfo, storage_provider=chainlit_mock_storage_client
@@ -149,6 +176,34 @@ async def test_create_and_get_element(
     # The 'content' field is not part of the ElementDict, so we remove this assertion
 
 
+async def test_get_elements(chainlit_mock_context, data_layer: SQLAlchemyDataLayer):
+    async with chainlit_mock_context:
+        text_elements = [
+            Text(
+                id=str(uuid.uuid4()),
+                name=f"test_{i}.txt",
+                mime="text/plain",
+                content="test content",
+                for_id="test_step_id",
+            )
+            for i in range(3)
+        ]
+        for text_element in text_elements:
+            await data_layer.create_element(text_element)
+
+    thread_id = text_elements[0].thread_id
+    requested_ids = [text_elements[2].id, "missing", text_elements[0].id]
+    retrieved_elements = await data_layer.get_elements(thread_id, requested_ids)
+
+    assert [element["id"] for element in retrieved_elements] == [
+        text_elements[2].id,
+        text_elements[0].id,
+    ]
+    assert retrieved_elements[0]["name"] == "test_2.txt"
+    assert retrieved_elements[0]["props"] == {}
+    assert await data_layer.get_elements(thread_id, []) == []
+
+
 async def test_get_current_timestamp(data_layer: SQLAlchemyDataLayer):
     timestamp = await data_layer.get_current_timestamp()
     assert isinstance(timestamp, str)
@@ -185,6 +240,16 @@ async def test_update_thread(chainlit_test_user: User, data_layer: SQLAlchemyDat
     assert persisted_user
 
     await data_layer.update_thread("test_thread")
+    created_at_query = """SELECT "createdAt" FROM threads WHERE "id" = :id"""
+    created_at = await data_layer.execute_sql(created_at_query, {"id": "test_thread"})
+    assert isinstance(created_at, list)
+
+    # Renaming keeps the creation time
+    await data_layer.update_thread("test_thread", name="renamed")
+    assert (
+        await data_layer.execute_sql(created_at_query, {"id": "test_thread"})
+        == created_at
+    )
 
 
 async def test_get_thread_author(
@@ -219,3 +284,684 @@ async def test_delete_thread(chainlit_test_user: User, data_layer: SQLAlchemyDat
     await data_layer.delete_thread("test_thread")
     thread = await data_layer.get_thread("test_thread")
     assert thread is None
+
+
+async def test_update_step_skips_unchanged_writes(
+    chainlit_mock_context, chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    persisted_user = await data_layer.create_user(chainlit_test_user)
+    assert persisted_user
+    await data_layer.update_thread("test_thread", user_id=persisted_user.id)
+
+    step_dict = {
+        "id": str(uuid.uuid4()),
+        "name": "test_step",
+        "type": "run",
+        "threadId": "test_thread",
+        "disableFeedback": False,
+        "streaming": False,
+        "output": "hello",
+        "metadata": {"key": "value"},
+    }
+
+    async with chainlit_mock_context:
+        await data_layer.create_step(dict(step_dict))  # type: ignore
+        await data_layer.update_step(dict(step_dict))  # type: ignore
+        assert data_layer.step_write_stats == {"written": 1, "skipped": 1}
+
+        await data_layer.update_step({**step_dict, "output": "hello world"})  # type: ignore
+        assert data_layer.step_write_stats == {"written": 2, "skipped": 1}
+
+    thread = await data_layer.get_thread("test_thread")
+    assert thread is not None
+    assert thread["steps"][0]["output"] == "hello world"
+
+
+async def test_sqlite_production_mode(
+    chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    sqlite_data_layer = SQLAlchemyDataLayer(
+        data_layer._conninfo, sqlite_production_mode=True
+    )
+    try:
+        result = await sqlite_data_layer.execute_sql("PRAGMA journal_mode", {})
+        assert result == [{"journal_mode": "wal"}]
+
+        persisted_user = await sqlite_data_layer.create_user(chainlit_test_user)
+        assert persisted_user
+
+        thread_ids = [str(uuid.uuid4()) for _ in range(20)]
+        await asyncio.gather(
+            *(
+                sqlite_data_layer.update_thread(
+                    thread_id, name=thread_id, user_id=persisted_user.id
+                )
+                for thread_id in thread_ids
+            )
+        )
+
+        threads = await sqlite_data_layer.get_all_user_threads(
+            user_id=persisted_user.id
+        )
+        assert threads is not None
+        assert {thread["id"] for thread in threads} == set(thread_ids)
+    finally:
+        await sqlite_data_layer.close()
+
+
+async def test_cached_reads_are_invalidated_across_instances(
+    chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    bus = InMemoryInvalidationBus()
+    worker_a = SQLAlchemyDataLayer(data_layer._conninfo, invalidation_bus=bus)
+    worker_b = SQLAlchemyDataLayer(data_layer._conninfo, invalidation_bus=bus)
+
+    persisted_user = await worker_a.create_user(chainlit_test_user)
+    assert persisted_user
+    await worker_a.update_thread("test_thread", name="a", user_id=persisted_user.id)
+
+    thread = await worker_a.get_thread("test_thread")
+    assert thread is not None
+    assert thread["name"] == "a"
+
+    # Served from cache, mutating the result must not leak into the cache
+    thread["name"] = "mutated"
+    thread = await worker_a.get_thread("test_thread")
+    assert thread is not None
+    assert thread["name"] == "a"
+
+    # Writes bypassing the data layers are not seen until invalidated
+    await data_layer.execute_sql(
+        """UPDATE threads SET "name" = 'external' WHERE "id" = 'test_thread'""", {}
+    )
+    thread = await worker_a.get_thread("test_thread")
+    assert thread is not None
+    assert thread["name"] == "a"
+
+    await worker_b.update_thread("test_thread", name="b")
+
+    thread = await worker_a.get_thread("test_thread")
+    assert thread is not None
+    assert thread["name"] == "b"
+
+
+async def test_sharding_routes_users_and_rebalances(
+    chainlit_mock_context, data_layer: SQLAlchemyDataLayer, tmp_path: Path
+):
+    shard_conninfo = f"sqlite+aiosqlite:///{tmp_path / 'test_shard.sqlite'}"
+    await create_schema(shard_conninfo)
+
+    identifiers = [f"user_{i}" for i in range(8)]
+    user_ids = {}
+    thread_ids = {}
+    async with chainlit_mock_context:
+        for identifier in identifiers:
+            persisted_user = await data_layer.create_user(User(identifier=identifier))
+            assert persisted_user
+            user_ids[identifier] = persisted_user.id
+            thread_id = str(uuid.uuid4())
+            thread_ids[identifier] = thread_id
+            await data_layer.update_thread(thread_id, user_id=persisted_user.id)
+            await data_layer.create_step(
+                {
+                    "id": str(uuid.uuid4()),
+                    "name": "step",
+                    "type": "run",
+                    "threadId": thread_id,
+                    "disableFeedback": False,
+                    "streaming": False,
+                }  # type: ignore
+            )
+
+    await data_layer.add_shard(shard_conninfo)
+
+    # Users are found on their previous shard until rebalanced
+    for identifier in identifiers:
+        persisted_user = await data_layer.create_user(
+            User(identifier=identifier, metadata={"updated": True})
+        )
+        assert persisted_user
+        assert persisted_user.id == user_ids[identifier]
+        assert persisted_user.metadata == {"updated": True}
+    count_users = """SELECT COUNT(*) AS count FROM users"""
+    counts = [
+        await data_layer._execute_on_shard(shard, count_users, {}) for shard in range(2)
+    ]
+    assert counts == [[{"count": len(identifiers)}], [{"count": 0}]]
+
+    # As do the other workers, configured with the former number of shards
+    worker = SQLAlchemyDataLayer(
+        data_layer._conninfo,
+        shard_conninfos=[shard_conninfo],
+        previous_shard_count=1,
+    )
+    for identifier in identifiers:
+        persisted_user = await worker.get_user(identifier)
+        assert persisted_user
+        assert persisted_user.id == user_ids[identifier]
+    await worker.close()
+    with pytest.raises(ValueError, match="previous_shard_count"):
+        SQLAlchemyDataLayer(data_layer._conninfo, previous_shard_count=2)
+
+    moved = await data_layer.rebalance_shards(batch_size=3)
+    assert data_layer._previous_ring is None
+
+    on_new_shard = [
+        identifier
+        for identifier in identifiers
+        if data_layer._ring.get_shard(identifier) == 1
+    ]
+    assert on_new_shard
+    assert moved == {"users": len(on_new_shard), "threads": len(on_new_shard)}
+
+    for identifier in identifiers:
+        expected_shard = data_layer._ring.get_shard(identifier)
+        for shard in range(2):
+            rows = await data_layer._execute_on_shard(
+                shard,
+                """SELECT "id" FROM threads WHERE "id" = :id""",
+                {"id": thread_ids[identifier]},
+            )
+            assert bool(rows) == (shard == expected_shard)
+
+        assert await data_layer.get_user(identifier)
+        assert await data_layer.get_thread_author(thread_ids[identifier]) == identifier
+        thread = await data_layer.get_thread(thread_ids[identifier])
+        assert thread is not None
+        assert len(thread["steps"]) == 1
+
+    await data_layer.close()
+
+
+async def test_metrics_are_tagged_with_data_layer_method(
+    chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    metrics_sink = InMemoryMetricsSink()
+    instrumented_data_layer = SQLAlchemyDataLayer(
+        data_layer._conninfo, metrics_sink=metrics_sink
+    )
+
+    persisted_user = await instrumented_data_layer.create_user(chainlit_test_user)
+    assert persisted_user
+    await instrumented_data_layer.get_user(chainlit_test_user.identifier)
+
+    # get_user issues a single SELECT returning one row
+    assert (
+        len(metrics_sink.get_samples("statement_duration_seconds", method="get_user"))
+        == 1
+    )
+    assert metrics_sink.get_counter("statements_total", method="get_user") == 1
+    assert metrics_sink.get_counter("rows_total", method="get_user") == 1
+    assert (
+        len(metrics_sink.get_samples("operation_duration_seconds", method="get_user"))
+        == 1
+    )
+
+    # Nested calls are attributed to the outermost method
+    assert metrics_sink.get_counter("statements_total", method="create_user") == 3
+    assert (
+        len(
+            metrics_sink.get_samples("operation_duration_seconds", method="create_user")
+        )
+        == 1
+    )
+
+    await instrumented_data_layer.close()
+
+
+async def test_slow_queries_are_recorded_with_plan(
+    chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    recorder = SlowQueryRecorder(threshold=0)
+    recording_data_layer = SQLAlchemyDataLayer(
+        data_layer._conninfo, slow_query_recorder=recorder
+    )
+
+    await recording_data_layer.get_user(chainlit_test_user.identifier)
+    await recording_data_layer.get_user(chainlit_test_user.identifier)
+    await recorder.drain()
+
+    slow_queries = [r for r in recorder.records if r.operation == "get_user"]
+    assert len(slow_queries) == 2
+    assert slow_queries[0].parameters == ["?"]
+    assert chainlit_test_user.identifier not in str(slow_queries[0].parameters)
+    # Plans are rate limited per statement
+    assert slow_queries[0].plan is not None
+    assert "users" in slow_queries[0].plan
+    assert slow_queries[1].plan is None
+
+    # Statements only differing by their literals are explained once...
+    statement = """SELECT * FROM steps WHERE "threadId" IN ({}) LIMIT 10"""
+    assert normalize_statement(statement.format("'a', 'b'")) == normalize_statement(
+        statement.format("'c'")
+    )
+    recorder = SlowQueryRecorder(threshold=0, max_concurrent_explains=2)
+    for thread_ids in ("'a', 'b'", "'c'"):
+        recorder.record(
+            recording_data_layer.engine,
+            "list_threads",
+            1,
+            statement.format(thread_ids),
+            {},
+        )
+    assert len(recorder._pending) == 1
+    await recorder.drain()
+
+    # ...and a single one runs at a time
+    recorder = SlowQueryRecorder(threshold=0, explain_interval=0)
+    for _ in range(2):
+        recorder.record(recording_data_layer.engine, "get_user", 1, "SELECT 1", {})
+    assert len(recorder._pending) == 1
+    await recorder.drain()
+
+    await recording_data_layer.close()
+
+
+async def test_get_step_descendants(
+    chainlit_mock_context, chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    persisted_user = await data_layer.create_user(chainlit_test_user)
+    assert persisted_user
+    await data_layer.update_thread("test_thread", user_id=persisted_user.id)
+
+    # root -> a -> b -> c, root -> d, other root -> e
+    parents = {"root": None, "a": "root", "b": "a", "c": "b", "d": "root", "e": None}
+    step_ids = {name: str(uuid.uuid4()) for name in parents}
+    async with chainlit_mock_context:
+        for i, (name, parent) in enumerate(parents.items()):
+            await data_layer.create_step(
+                {
+                    "id": step_ids[name],
+                    "name": name,
+                    "type": "run",
+                    "threadId": "test_thread",
+                    "parentId": step_ids[parent] if parent else None,
+                    "disableFeedback": False,
+                    "streaming": False,
+                    "createdAt": f"2024-01-01T00:00:0{i}Z",
+                }  # type: ignore
+            )
+
+    descendants = await data_layer.get_step_descendants("test_thread", step_ids["root"])
+    assert [step["name"] for step in descendants] == ["a", "b", "c", "d"]
+
+    descendants = await data_layer.get_step_descendants(
+        "test_thread", step_ids["root"], max_depth=2
+    )
+    assert [step["name"] for step in descendants] == ["a", "b", "d"]
+
+    assert await data_layer.get_step_descendants("test_thread", step_ids["c"]) == []
+
+
+async def test_soft_delete_thread(
+    chainlit_mock_context, chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    data_layer.soft_delete = True
+    persisted_user = await data_layer.create_user(chainlit_test_user)
+    assert persisted_user
+    await data_layer.update_thread("test_thread", user_id=persisted_user.id)
+    parent_id = str(uuid.uuid4())
+    async with chainlit_mock_context:
+        for step_id, parent in ((parent_id, None), (str(uuid.uuid4()), parent_id)):
+            await data_layer.create_step(
+                {
+                    "id": step_id,
+                    "parentId": parent,
+                    "name": "step",
+                    "type": "run",
+                    "threadId": "test_thread",
+                    "disableFeedback": False,
+                    "streaming": False,
+                }  # type: ignore
+            )
+    assert len(await data_layer.get_step_descendants("test_thread", parent_id)) == 1
+
+    await data_layer.delete_thread("test_thread")
+
+    # Tombstoned threads are hidden from readers...
+    assert await data_layer.get_thread("test_thread") is None
+    with pytest.raises(ValueError, match="Author not found"):
+        await data_layer.get_thread_author("test_thread")
+    threads = await data_layer.list_threads(
+        Pagination(first=10), ThreadFilter(userId=persisted_user.id)
+    )
+    assert threads.data == []
+    assert await data_layer.get_step_descendants("test_thread", parent_id) == []
+
+    # ...but only removed by the reaper
+    count_steps = """SELECT COUNT(*) AS count FROM steps WHERE "threadId" = :id"""
+    result = await data_layer.execute_sql(count_steps, {"id": "test_thread"})
+    assert result == [{"count": 2}]
+
+    assert await data_layer.reap_deleted_threads() == 1
+    assert await data_layer.reap_deleted_threads() == 0
+    result = await data_layer.execute_sql(count_steps, {"id": "test_thread"})
+    assert result == [{"count": 0}]
+    result = await data_layer.execute_sql(
+        """SELECT "id" FROM threads WHERE "id" = :id""", {"id": "test_thread"}
+    )
+    assert result == []
+
+
+async def test_warm_up(data_layer: SQLAlchemyDataLayer):
+    assert await data_layer.warm_up(connections=2) == 2
+
+
+async def test_warm_up_skips_unsupported_statement_preparation(
+    data_layer: SQLAlchemyDataLayer,
+):
+    class Adapter:
+        async def _prepare(self, operation: str):
+            pass
+
+    for adapter in (object(), Adapter()):
+        assert not await data_layer._prepare_statements(
+            adapter, data_layer.engine, ["SELECT 1"]
+        )
+
+
+def test_warm_up_prepares_the_executed_statements(chainlit_mock_context):
+    step = Step(name="step", type="run", thread_id="test_thread")
+    step.start = step.end = "2024-01-01T00:00:00Z"
+    step_dict = step.to_dict()
+    step_dict["showInput"] = str(step_dict["showInput"]).lower()  # type: ignore
+    keys = [
+        key
+        for key, value in step_dict.items()
+        if value is not None and not (isinstance(value, dict) and not value)
+    ]
+    keys += [key for key in ("metadata", "generation") if key not in keys]
+    assert keys in HOT_STEP_KEYS
+
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+async def test_export_and_import_tables(
+    chainlit_mock_context,
+    chainlit_test_user: User,
+    data_layer: SQLAlchemyDataLayer,
+    tmp_path: Path,
+    format,
+):
+    persisted_user = await data_layer.create_user(chainlit_test_user)
+    assert persisted_user
+    await data_layer.update_thread(
+        "test_thread", user_id=persisted_user.id, metadata={"name": "thread"}
+    )
+    async with chainlit_mock_context:
+        for i in range(5):
+            await data_layer.create_step(
+                {
+                    "id": str(uuid.uuid4()),
+                    "name": f"step {i}",
+                    "type": "run",
+                    "threadId": "test_thread",
+                    "disableFeedback": False,
+                    "streaming": False,
+                    "output": 'multi\nline, "quoted"' if i == 0 else "",
+                }  # type: ignore
+            )
+
+    counts = {}
+    for table in ("users", "threads", "steps"):
+        counts[table] = await data_layer.export_table(
+            table, tmp_path / f"{table}.{format}", format=format, batch_size=2
+        )
+    assert counts == {"users": 1, "threads": 1, "steps": 5}
+
+    conninfo = f"sqlite+aiosqlite:///{tmp_path / 'target.db'}"
+    await create_schema(conninfo)
+    target = SQLAlchemyDataLayer(conninfo)
+    try:
+        for table, count in counts.items():
+            imported = await target.import_table(
+                table, tmp_path / f"{table}.{format}", format=format, batch_size=2
+            )
+            assert imported == count
+
+        thread = await target.get_thread("test_thread")
+        assert thread is not None
+        assert thread["userIdentifier"] == chainlit_test_user.identifier
+        assert [step["name"] for step in thread["steps"]] == [
+            f"step {i}" for i in range(5)
+        ]
+        assert thread["steps"][0]["output"] == 'multi\nline, "quoted"'
+    finally:
+        await target.close()
+
+
+async def test_import_rejects_unknown_tables(data_layer: SQLAlchemyDataLayer, tmp_path):
+    with pytest.raises(ValueError, match="Unsupported table"):
+        await data_layer.import_table("sqlite_master", tmp_path / "rows.ndjson")
+
+
+async def test_get_feedback_stats(
+    chainlit_mock_context, chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    persisted_user = await data_layer.create_user(chainlit_test_user)
+    assert persisted_user
+    await data_layer.update_thread("test_thread", user_id=persisted_user.id)
+
+    ratings = [
+        ("2024-01-01T10:00:00Z", "chat", 1),
+        ("2024-01-01T11:00:00Z", "chat", 0),
+        ("2024-01-01T12:00:00Z", "tool", 1),
+        ("2024-01-02T10:00:00Z", "chat", 1),
+    ]
+    async with chainlit_mock_context:
+        for created_at, name, value in ratings:
+            step_id = str(uuid.uuid4())
+            await data_layer.create_step(
+                {
+                    "id": step_id,
+                    "name": name,
+                    "type": "run",
+                    "threadId": "test_thread",
+                    "disableFeedback": False,
+                    "streaming": False,
+                    "createdAt": created_at,
+                }  # type: ignore
+            )
+            await data_layer.upsert_feedback(
+                Feedback(forId=step_id, threadId="test_thread", value=value)
+            )
+
+    by_day = await data_layer.get_feedback_stats(group_by="day")
+    assert [(s["bucket"], s["positive"], s["negative"]) for s in by_day] == [
+        ("2024-01-01", 2, 1),
+        ("2024-01-02", 1, 0),
+    ]
+    by_step = await data_layer.get_feedback_stats(
+        group_by="step", since="2024-01-01", until="2024-01-02"
+    )
+    assert [(s["bucket"], s["total"]) for s in by_step] == [("chat", 2), ("tool", 1)]
+    assert by_step[0]["positive_rate"] == 0.5
+    by_user = await data_layer.get_feedback_stats(
+        group_by="user", user_id=persisted_user.id, step_name="chat"
+    )
+    assert [(s["bucket"], s["total"]) for s in by_user] == [
+        (chainlit_test_user.identifier, 3)
+    ]
+
+
+def test_step_partitions():
+    month = month_of("2024-12-31T23:59:59Z")
+    assert month == date(2024, 12, 1)
+    assert add_months(month, 1) == date(2025, 1, 1)
+    assert add_months(month, -12) == date(2023, 12, 1)
+    assert partition_name(month) == "steps_p2024_12"
+    assert partition_month("steps_p2024_12") == month
+    assert partition_month("steps_default") is None
+    assert "FROM ('2024-12') TO ('2025-01')" in create_partition_query(month)
+    assert thread_steps_created_after("2025-01-01T00:00:00Z") == "2024-12"
+
+
+async def test_step_partitions_require_postgres(data_layer: SQLAlchemyDataLayer):
+    with pytest.raises(ValueError, match="partitioned_steps"):
+        await data_layer.create_step_partitions()
+    data_layer.partitioned_steps = True
+    with pytest.raises(ValueError, match="PostgreSQL"):
+        await data_layer.drop_step_partitions(before="2024-01-01")
+
+
+async def test_partitioned_step_queries(
+    chainlit_mock_context, chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    # Same primary key as partitioned_steps.sql, for the upsert to conflict on
+    await data_layer.execute_sql(
+        """CREATE UNIQUE INDEX "steps_id_createdAt" ON steps ("id", "createdAt")""",
+        {},
+    )
+    data_layer.partitioned_steps = True
+    persisted_user = await data_layer.create_user(chainlit_test_user)
+    assert persisted_user
+    await data_layer.update_thread("test_thread", user_id=persisted_user.id)
+    step = {
+        "id": str(uuid.uuid4()),
+        "name": "step",
+        "type": "run",
+        "threadId": "test_thread",
+        "output": "",
+        "disableFeedback": False,
+        "streaming": False,
+    }
+    child = {**step, "id": str(uuid.uuid4()), "parentId": step["id"]}
+    async with chainlit_mock_context:
+        await data_layer.create_step(step)  # type: ignore
+        await data_layer.update_step({**step, "output": "done"})  # type: ignore
+        await data_layer.create_step(child)  # type: ignore
+
+        result = await data_layer.execute_sql(
+            """SELECT "output", "createdAt" FROM steps WHERE "id" = :id""",
+            {"id": step["id"]},
+        )
+        assert isinstance(result, list)
+        assert [row["output"] for row in result] == ["done"]
+        assert result[0]["createdAt"]
+
+        # An old thread, its first step stamped a little before it
+        await data_layer.execute_sql(
+            """UPDATE threads SET "createdAt" = :created_at WHERE "id" = :id""",
+            {"id": "test_thread", "created_at": "2020-01-15T00:00:00Z"},
+        )
+        assert thread_steps_created_after("2020-01-15T00:00:00Z") == "2019-12"
+        await data_layer.execute_sql(
+            """UPDATE steps SET "createdAt" = :created_at WHERE "id" = :id""",
+            {"id": step["id"], "created_at": "2019-12-31T23:59:59Z"},
+        )
+
+        # Renaming the thread does not move the bound past its steps
+        await data_layer.update_thread("test_thread", name="renamed")
+        threads = await data_layer.get_all_user_threads(user_id=persisted_user.id)
+        assert threads
+        assert len(threads[0]["steps"]) == 2
+        descendants = await data_layer.get_step_descendants("test_thread", step["id"])
+        assert [d["id"] for d in descendants] == [child["id"]]
+
+        await data_layer.delete_step(child["id"])
+    await data_layer.delete_thread("test_thread")
+    result = await data_layer.execute_sql("""SELECT "id" FROM steps""", {})
+    assert result == []
+
+
+async def test_statement_timeout_interrupts_slow_queries(
+    data_layer: SQLAlchemyDataLayer,
+):
+    metrics_sink = InMemoryMetricsSink()
+    data_layer.metrics_sink = metrics_sink
+    data_layer.statement_timeout = 0.1
+    slow_query = """
+        WITH RECURSIVE counter (n) AS (
+            SELECT 1 UNION ALL SELECT n + 1 FROM counter WHERE n < 1000000000
+        )
+        SELECT COUNT(*) AS count FROM counter
+    """
+
+    started = asyncio.get_running_loop().time()
+    assert await data_layer.execute_sql(slow_query, {}) is None
+    assert asyncio.get_running_loop().time() - started < 2
+    assert metrics_sink.get_counter("statement_timeouts_total", method="unknown") == 1
+
+    # The connection is usable again, and fast queries are not affected
+    assert await data_layer.execute_sql("SELECT 1 AS one", {}) == [{"one": 1}]
+
+    data_layer.statement_timeouts = {"unknown": 30}
+    assert await data_layer.execute_sql("SELECT COUNT(*) AS count FROM users", {}) == [
+        {"count": 0}
+    ]
+
+
+async def test_client_side_statement_timeout_invalidates_the_connection(
+    data_layer: SQLAlchemyDataLayer, monkeypatch: pytest.MonkeyPatch
+):
+    # Neither cancelled by the server nor interrupted, as on other dialects
+    monkeypatch.setattr(data_layer.engine.dialect, "name", "mysql")
+    invalidated = []
+    invalidate = AsyncSession.invalidate
+
+    async def record_invalidate(session: AsyncSession):
+        invalidated.append(session)
+        await invalidate(session)
+
+    monkeypatch.setattr(AsyncSession, "invalidate", record_invalidate)
+    data_layer.statement_timeout = 0.1
+    slow_query = """
+        WITH RECURSIVE counter (n) AS (
+            SELECT 1 UNION ALL SELECT n + 1 FROM counter WHERE n < 1000000
+        )
+        SELECT COUNT(*) AS count FROM counter
+    """
+    assert await data_layer.execute_sql(slow_query, {}) is None
+    assert len(invalidated) == 1
+
+    monkeypatch.undo()
+    assert await data_layer.execute_sql("SELECT 1 AS one", {}) == [{"one": 1}]
+
+
+async def test_concurrent_reads_are_coalesced(
+    chainlit_test_user: User, data_layer: SQLAlchemyDataLayer
+):
+    metrics_sink = InMemoryMetricsSink()
+    data_layer = SQLAlchemyDataLayer(data_layer._conninfo, metrics_sink=metrics_sink)
+    await data_layer.create_user(chainlit_test_user)
+
+    users = await asyncio.gather(
+        *(data_layer.get_user(chainlit_test_user.identifier) for _ in range(5))
+    )
+    assert metrics_sink.get_counter("statements_total", method="get_user") == 1
+    assert all(user == users[0] for user in users)
+    # Every caller gets its own copy
+    assert len({id(user) for user in users}) == 5
+    assert len(data_layer._single_flight) == 0
+
+    await data_layer.get_user(chainlit_test_user.identifier)
+    assert metrics_sink.get_counter("statements_total", method="get_user") == 2
+
+    # Reads started after a write don't join those which may miss it
+    before_write = asyncio.ensure_future(
+        data_layer.get_user(chainlit_test_user.identifier)
+    )
+    await asyncio.sleep(0)
+    await data_layer._publish_invalidation("user", chainlit_test_user.identifier)
+    assert not before_write.done()
+    after_write = data_layer.get_user(chainlit_test_user.identifier)
+    await asyncio.gather(before_write, after_write)
+    assert metrics_sink.get_counter("statements_total", method="get_user") == 4
+    await data_layer.close()
+
+
+async def test_single_flight_fails_all_waiters():
+    flights = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(
+        *(flights.do("key", failing) for _ in range(3)), return_exceptions=True
+    )
+    assert calls == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flights) == 0